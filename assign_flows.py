@@ -1,11 +1,15 @@
 from metro import multiplex as mx
 from metro import utility
 from metro import ita
+from metro import checkpoint
+from metro import results
 
 import pandas as pd
 import numpy as np
 import cProfile
 import time
+import os
+import sys
 import networkx as nx
 import pandas as pd
 
@@ -14,6 +18,10 @@ import pandas as pd
 # -----------------------------------------------------------------------------
 def main():
 
+    # python assign_flows.py --resume continues a killed run: betas with complete 
+    # results are skipped and an interrupted assignment resumes from its checkpoint
+    resume = '--resume' in sys.argv
+
     # Read in the multiplex
     m = mx.read_multi()
 
@@ -25,7 +33,7 @@ def main():
 
     # compute ITA with no metro
     no_metro_beta = 1000
-    ita_iteration(m, beta = no_metro_beta)
+    ita_iteration(m, beta = no_metro_beta, resume = resume).write(m)
 
     # compute the mean free flow speed v_f and the mean congested speed v_c
     mean_free_flow_time = m.mean_edge_attr_per(layers = ['streets'],
@@ -78,7 +86,7 @@ def main():
     betas = pd.read_csv('betas.csv').beta
 
     for beta in betas:
-      ita_iteration(m, beta)
+      ita_iteration(m, beta, resume = resume)
 
       # start = time.clock()
       # m.scale_edge_attribute(layer = 'metro',
@@ -102,30 +110,63 @@ def main():
       # time_taken = str(round((time.clock() - start) / 60.0, 1)) + 'm'
       # print 'assignment for beta = ' + str(beta) + ' completed in ' + time_taken
 
+    # write the flows and congested times of every beta into m only now, for the edge file
+    for beta in betas:
+      read_beta(m, beta, summary = False).write(m)
     m.to_txt('3_throughput/', 'mx_flow')
 
-def ita_iteration(m, beta):
+def beta_file(beta, suffix = ''):
+  return '3_throughput/beta_' + str(beta) + suffix + '_edges.csv'
+
+def save_beta(result, beta, suffix = ''):
+  '''
+  Save the flows and congested times of beta, marking it as complete. 
+  '''
+  checkpoint.to_csv(result.to_df(), beta_file(beta, suffix), index = False)
+
+def read_beta(m, beta, suffix = '', summary = True):
+  '''
+  Read the flows and congested times of beta on m if its results are complete. 
+
+  Returns:
+      results.assignment_result: the result of beta, or None if it was not complete
+  '''
+  if not os.path.exists(beta_file(beta, suffix)):
+    return None
+  if summary and not os.path.exists('3_throughput/route_info_' + str(beta) + suffix + '.csv'):
+    return None
+  return results.read_csv(beta_file(beta, suffix), m, 'flow_' + str(beta) + suffix, 'congested_time_m_' + str(beta) + suffix)
+
+def ita_iteration(m, beta, P = [.2, .2, .2, .2, .1, .1], summary = True, suffix = '', resume = False):
+  if resume:
+    result = read_beta(m, beta, suffix, summary)
+    if result is not None:
+      print 'assignment for beta = ' + str(beta) + ' already complete, skipping'
+      return result
+
   start = time.clock()
-  m.scale_edge_attribute(layer = 'metro',
-                         attribute = 'free_flow_time_m',
-                         beta = beta)
 
-  df = m.run_ita(n_nodes = None, 
-                summary = True, 
-                attrname = 'congested_time_m_' + str(beta),
-                flow_name = 'flow_' +str(beta),
-                P = [.2, .2, .2, .2, .1, .1],
-                scale = .25)
+  # metro times are scaled by beta on the fly, leaving m unchanged
+  overlay = m.add_overlay('beta_' + str(beta), multipliers = {'free_flow_time_m' : {'metro' : beta}})
+
+  result = m.run_ita(n_nodes = None, 
+                summary = summary, 
+                attrname = 'congested_time_m_' + str(beta) + suffix,
+                flow_name = 'flow_' +str(beta) + suffix,
+                P = P,
+                scale = .25, 
+                checkpoint = '3_throughput/checkpoint_' + str(beta) + suffix + '.npz', 
+                resume = resume, 
+                overlay = overlay)
 
-  if df is not None:
-    df.to_csv('3_throughput/route_info_' + str(beta) + '.csv')
+  if result.details is not None:
+    checkpoint.to_csv(result.details, '3_throughput/route_info_' + str(beta) + suffix + '.csv')
 
-  m.scale_edge_attribute(layer = 'metro',
-                         attribute = 'free_flow_time_m',
-                         beta = 1.0/beta)
+  save_beta(result, beta, suffix)
 
   time_taken = str(round((time.clock() - start) / 60.0, 1)) + 'm'
   print 'assignment for beta = ' + str(beta) + ' completed in ' + time_taken
+  return result
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,110 @@
+from metro import multiplex as mx
+from metro import csr
+from metro import cch
+
+import numpy as np
+import time
+import sys
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+def main():
+
+    # python benchmark_paths.py [od file] [number of origins]
+    od_file = sys.argv[1] if len(sys.argv) > 1 else '1_data/taz_od/1_0.txt'
+    n_origins = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    # Read in the multiplex and an OD keyed to it
+    m = mx.read_multi()
+    m.read_od(layer = 'taz',
+              key = 'taz',
+              od_file = od_file,
+              sep = " ")
+    g, od = m.to_igraph()
+    G = csr.csr_from_igraph(g)
+
+    origins = [o for o in od if len(od[o]) > 0]
+    origins = [origins[i] for i in np.linspace(0, len(origins) - 1, min(n_origins, len(origins))).astype(int)]
+    targets = [np.array(od[o].keys(), dtype = np.int64) for o in origins]
+
+    print 'benchmarking ' + str(len(origins)) + ' origins from ' + od_file + ', ' + \
+          str(int(np.median([len(t) for t in targets]))) + ' destinations per origin (median), ' + \
+          str(G.n) + ' vertices'
+    compare_settled(G, origins, targets)
+    compare_time(g, G, origins, targets)
+
+def compare_settled(G, origins, targets):
+    """
+    Summary:
+        Compare the vertices settled per origin by full searches, by searches that stop at the last
+        destination (as igraph's get_shortest_paths does), and by csr_graph.target_trees().
+
+    Args:
+        G (csr.csr_graph): the network
+        origins (list): the origins
+        targets (list): per origin, the array of its destinations
+
+    Returns:
+        None
+    """
+    dist, pred = G.shortest_path_trees(origins)
+    full = np.isfinite(dist).sum(axis = 1)
+    exact = np.array([(row <= row[t].max()).sum() for row, t in zip(dist, targets)])
+    dist, pred, settled = G.target_trees(origins, targets)
+
+    for label, counts in [('full search', full),
+                          ('stop at last destination (igraph)', exact),
+                          ('target_trees', settled)]:
+        share = counts * 1.0 / full
+        print label.ljust(36) + 'mean ' + str(int(counts.mean())).rjust(6) + ' vertices, ' + \
+              str(round(100 * share.mean(), 1)).rjust(5) + '% of full (median ' + \
+              str(round(100 * np.median(share), 1)) + '%)'
+
+def compare_time(g, G, origins, targets):
+    """
+    Summary:
+        Time paths to the destinations of every origin with igraph's get_shortest_paths, with full
+        csr searches, with csr.target_paths(), and with searches of a contraction hierarchy (see metro.cch),
+        whose construction and customization are timed separately.
+
+    Args:
+        g (igraph.Graph): the network
+        G (csr.csr_graph): the network as arrays
+        origins (list): the origins
+        targets (list): per origin, the array of its destinations
+
+    Returns:
+        None
+    """
+    start = time.time()
+    for o, t in zip(origins, targets):
+        g.get_shortest_paths(o, to = t.tolist(), weights = 'free_flow_time_m', mode = 'OUT', output = 'epath')
+    timings = [('igraph get_shortest_paths', time.time() - start)]
+
+    start = time.time()
+    for i in range(0, len(origins), 256):
+        dist, pred = G.shortest_path_trees(origins[i:i + 256])
+        G.tree_paths(origins[i:i + 256], pred, targets[i:i + 256])
+    timings.append(('csr full search', time.time() - start))
+
+    start = time.time()
+    csr.target_paths(G, origins, targets, targeted = True)
+    timings.append(('csr target_paths', time.time() - start))
+
+    start = time.time()
+    G.hierarchy = cch.hierarchy_of(G)
+    G.hierarchy.customize()
+    print 'hierarchy built and customized in ' + str(round(time.time() - start, 2)) + 's'
+    start = time.time()
+    for i in range(0, len(origins), 256):
+        dist, pred = G.shortest_path_trees(origins[i:i + 256])
+        G.tree_paths(origins[i:i + 256], pred, targets[i:i + 256])
+    timings.append(('csr hierarchy', time.time() - start))
+    G.hierarchy = None
+
+    for label, seconds in timings:
+        print label.ljust(36) + str(round(1000 * seconds / len(origins), 2)).rjust(6) + ' ms per origin'
+
+if __name__ == '__main__':
+    main()
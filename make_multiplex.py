@@ -1,7 +1,6 @@
 from metro import analysis
-from metro import utility 
 from metro import multiplex as mx
-import networkx as nx
+import pandas as pd
 import numpy as np
 
 
@@ -16,156 +15,137 @@ def main():
 	metro = read_metro('1_data/metro', 'metro')
 	metro = clean_metro(metro)
 
-	layer_dict = {'metro'   : metro, 
-	              'streets' : streets, 
-	              'taz'     : taz}
-	multi = mx.multiplex()
-	multi.add_layers(layer_dict)
-
-	multi.spatial_join(layer1 = 'metro', 
-	                   layer2 = 'streets', 
-	                   transfer_speed = 1e10,
-	                   base_cost = 0,
-	                   capacity = 1e10,
-	                   both = True)
-
-	multi.spatial_join(layer1 = 'taz', 
-	                   layer2 = 'streets', 
-	                   transfer_speed = 1e10, 
-	                   base_cost = 0, 
-	                   capacity = 1e10, 
-	                   both = True, )
+	# tables are (layer, nodes, edges, node id column); edges refer to nodes through their 'source' and 'target' columns
+	layers = [('metro',   metro[0],   metro[1],   'Station'),
+	          ('streets', streets[0], streets[1], 'id'),
+	          ('taz',     taz[0],     taz[1],     'id')]
+
+	transfers = [{'layer1'         : 'metro',
+	              'layer2'         : 'streets',
+	              'transfer_speed' : 1e10,
+	              'base_cost'      : 0,
+	              'capacity'       : 1e10,
+	              'both'           : True},
+	             {'layer1'         : 'taz',
+	              'layer2'         : 'streets',
+	              'transfer_speed' : 1e10,
+	              'base_cost'      : 0,
+	              'capacity'       : 1e10,
+	              'both'           : True}]
+
+	multi = mx.multiplex_from_tables(layers, transfers)
 
 	multi.to_txt('2_multiplex', 'multiplex_unscaled')
 
 def read_metro(directory, file_prefix):
-	"""convenience function to quickly read in and clean the metro network
-	
+	"""convenience function to quickly read in the metro network
+
 	Args:
 		directory (str): the location in which to find the node and edge files
 		file_prefix (TYPE): the prefix of the node and edge files
-	
+
 	Returns:
-		networkx.DiGraph(): the metro network
+		tuple: pandas.DataFrame of nodes and pandas.DataFrame of edges of the metro network
 	"""
-	metro = mx.graph_from_txt(nodes_file_name = directory + '/' + file_prefix +'_nodes.txt', 
-						   edges_file_name = directory + '/' + file_prefix +'_edges.txt', 
-						   sep = '\t', 
-						   nid = 'Station', 
-						   eidfrom = 'From', 
-						   eidto = 'To')
-
-	print str(len(metro.nodes())) + ' nodes added to metro network'
-	print str(len(metro.edges())) + ' edges added to metro network.'
-	
-	return metro
+	nodes = pd.read_csv(directory + '/' + file_prefix +'_nodes.txt', sep = '\t', index_col = False)
+	edges = pd.read_csv(directory + '/' + file_prefix +'_edges.txt', sep = '\t', index_col = False)
+
+	print str(len(nodes)) + ' nodes added to metro network'
+	print str(len(edges)) + ' edges added to metro network.'
+
+	return nodes, edges
 
 def clean_metro(metro):
+	nodes, edges = metro
+
 	# Rename some attributes
-	utility.rename_node_attribute(metro, old = 'Latitude', new = 'lat')
-	utility.rename_node_attribute(metro, old = 'Longitude', new = 'lon')
-	utility.rename_edge_attribute(metro, old = 'Time (s)', new = 'time_s')
-	
+	nodes = nodes.rename(columns = {'Latitude' : 'lat', 'Longitude' : 'lon'})
+	edges = edges.rename(columns = {'Time (s)' : 'time_s'})
+
 	# delete extraneous attributes
-	
-	# utility.del_edge_attribute(metro, 'To')
-	# utility.del_edge_attribute(metro, 'From')
-	# utility.del_node_attribute(metro, 'Station')
+
+	# edges = edges.drop(['To', 'From'], axis = 1)
+	# nodes = nodes.drop('Station', axis = 1)
+
+	edges['source'] = edges['From']
+	edges['target'] = edges['To']
 
 	# compute time in minutes
-	time_m = {(e[0], e[1]) : metro.edge[e[0]][e[1]]['time_s'] / 60 for e in metro.edges_iter()}
+	time_m = edges['time_s'] / 60
 
-	# mark whether a given edge is a transfer edge to another metro line.  
-	transfer = {key : 'transfer' for key in time_m if time_m[key] == 5.0}
-	nx.set_edge_attributes(metro, 'transfer', transfer)
+	# mark whether a given edge is a transfer edge to another metro line.
+	edges['transfer'] = pd.Series('transfer', index = edges.index).where(time_m == 5.0)
 
-	nx.set_edge_attributes(metro, 'free_flow_time_m', time_m)
-	nx.set_edge_attributes(metro, 'uniform_time_m', nx.get_edge_attributes(metro, 'free_flow_time_m'))
+	edges['free_flow_time_m'] = time_m
+	edges['uniform_time_m'] = time_m
 
 	# -----------------------------------------------------------
-	# ZEYAD: please delete the below three lines when you update the metro data set. Replace them with whatever is necessary to appropriate set a distance attribute in kilometers. 
-	dists = {(e[0], e[1]) : analysis.distance((metro.node[e[0]]['lat'],metro.node[e[0]]['lon']) , 
-							  (metro.node[e[1]]['lat'],metro.node[e[1]]['lon'])) for e in metro.edges_iter()}
-	nx.set_edge_attributes(metro, 'dist_km', dists)
+	# ZEYAD: please delete the below lines when you update the metro data set. Replace them with whatever is necessary to appropriate set a distance attribute in kilometers.
+	pos = nodes.set_index('Station')[['lat', 'lon']]
+	source, target = pos.loc[edges['source']].values, pos.loc[edges['target']].values
+	edges['dist_km'] = [analysis.distance(s, t) for s, t in zip(source, target)]
 	# -----------------------------------------------------------
 
 	# assume metro has unlimited capacity
-	nx.set_edge_attributes(metro, 'capacity', 100000000000000000000000)
-	
+	edges['capacity'] = 1e23
+
 	# don't need time_s anymore
-	utility.del_edge_attribute(metro, 'time_s')
-	
-	return metro
+	edges = edges.drop('time_s', axis = 1)
+
+	return nodes, edges
 
 def read_streets(directory, file_prefix):
-	"""convenience function to quickly read in the street network 
-	
+	"""convenience function to quickly read in the street network
+
 	Args:
 		directory (str): the directory in which to find the street network node and edge files
 		file_prefix (str): the file prefix of the node and edge files
-	
+
 	Returns:
-		networkx.DiGraph(): the street network. 
+		tuple: pandas.DataFrame of nodes and pandas.DataFrame of edges of the street network
 	"""
-	streets = mx.graph_from_txt(nodes_file_name = directory + '/' + file_prefix +'_nodes.txt', 
-						   edges_file_name = directory + '/' + file_prefix +'_edges.txt', 
-						   sep = ' ', 
-						   nid = 'id', 
-						   eidfrom = 'source', 
-						   eidto = 'target')
-
-	print str(len(streets.nodes())) + ' nodes added to street network'
-	print str(len(streets.edges())) + ' edges added to street network.'
-	
-	return streets
+	nodes = pd.read_csv(directory + '/' + file_prefix +'_nodes.txt', sep = ' ', index_col = False)
+	edges = pd.read_csv(directory + '/' + file_prefix +'_edges.txt', sep = ' ', index_col = False)
+
+	# a repeated (source, target) pair is a single edge, with the attributes of its last row
+	edges = edges.drop_duplicates(['source', 'target'], keep = 'last')
+
+	print str(len(nodes)) + ' nodes added to street network'
+	print str(len(edges)) + ' edges added to street network.'
+
+	return nodes, edges
 
 def clean_streets(streets):
+	nodes, edges = streets
 
 	# Rename attributes
-	utility.rename_edge_attribute(streets,'cost_time_m', 'free_flow_time_m')
-	utility.rename_edge_attribute(streets, 'len_km', 'dist_km')
-
-	utility.rename_node_attribute(streets, old = 'st_x', new = 'lon')
-	utility.rename_node_attribute(streets, old = 'st_y', new = 'lat')
+	edges = edges.rename(columns = {'cost_time_m' : 'free_flow_time_m', 'len_km' : 'dist_km'})
+	nodes = nodes.rename(columns = {'st_x' : 'lon', 'st_y' : 'lat'})
 
 	# Delete some extraneous attributes
-	utility.del_edge_attribute(streets, 'gid')
-	utility.del_edge_attribute(streets, 'source')
-	utility.del_edge_attribute(streets, 'target')
+	edges = edges.drop('gid', axis = 1)
 
 	# compute uniform time
-	dists = nx.get_edge_attributes(streets, 'dist_km')
-	total_dist = np.array(dists.values()).sum()
-	total_time_free = np.array(nx.get_edge_attributes(streets, 'free_flow_time_m').values()).sum()
-	uniform_speed = total_time_free/total_dist
-	uniform_times = {key : dists[key] * uniform_speed  for key in dists}
-	nx.set_edge_attributes(streets, 'uniform_time_m', uniform_times)
-
-	# Delete edges with zero capacity. to impute capacity for them instead, uncomment block below. 
-	for e in streets.copy().edges_iter():
-		if streets.edge[e[0]][e[1]]['capacity'] == 0:
-			streets.remove_edge(*e)
-
-	# impute capacity -- just use the mean of all the other capacities. 
-	# cap = [streets.edge[e[0]][e[1]]['capacity'] for e in streets.edges_iter()]
-	# cap = np.array(cap)
-	# mean = cap.mean()
-	# for e in streets.edges_iter():
-	# 	if streets.edge[e[0]][e[1]]['capacity'] == 0:
-	# 		streets.edge[e[0]][e[1]]['capacity'] = mean
-	
-	return streets
+	uniform_speed = edges['free_flow_time_m'].sum() / edges['dist_km'].sum()
+	edges['uniform_time_m'] = edges['dist_km'] * uniform_speed
+
+	# Delete edges with zero capacity. to impute capacity for them instead, uncomment block below.
+	edges = edges[edges['capacity'] != 0]
+
+	# impute capacity -- just use the mean of all the other capacities.
+	# mean = edges['capacity'][edges['capacity'] != 0].mean()
+	# edges['capacity'] = edges['capacity'].replace(0, mean)
+
+	return nodes, edges
 
 def read_taz(directory, file_prefix):
-	taz = mx.graph_from_txt(nodes_file_name = directory + '/' + file_prefix +'_nodes.txt',
-	                             nid = 'id',
-	                             sep = '\t')
-	print str(len(taz.nodes())) + ' nodes added to TAZ connector network'
-	return taz
+	nodes = pd.read_csv(directory + '/' + file_prefix +'_nodes.txt', sep = '\t', index_col = False)
+	print str(len(nodes)) + ' nodes added to TAZ connector network'
+	return nodes, None
 
 def clean_taz(taz):
 	return taz
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,5 +1,8 @@
 from math import sqrt
 from metro import utility
+from metro import costs
+from metro import csr
+from metro import cch
 import networkx as nx
 import numpy as np
 from collections import defaultdict
@@ -60,22 +63,29 @@ def local_intermodality(self, layer = None, thru_layer = None, weight = None):
 	Returns:
 		None
 	"""
-	g = utility.nx_2_igraph(self.G)
-	nodes = g.vs.select(layer=layer)
-
-	def intermodality(v, g, nodes = nodes, weight = weight):
-		paths = g.get_shortest_paths(v, nodes, weights = weight)
-		total = len(nodes)
+	g, od = self.to_igraph(node_attrs = ['layer'], edge_attrs = [] if weight is None else [weight])
+	nodes = [v.index for v in g.vs.select(layer=layer)]
+	G = csr.csr_from_igraph(g, weight, capacity = None)
+	through = np.array(g.vs['layer']) == thru_layer
+	heads = np.array(g.get_edgelist(), dtype = np.int64).reshape(-1, 2)[:, 1]
+
+	def intermodality(v, paths):
+		# a path visits v and the heads of its edges; unreachable targets have no path
 		intermodal = 0
-		for p in paths: 
-			if thru_layer in [g.vs[u]['layer'] for u in p]:
+		for u, p in zip(nodes, paths): 
+			if through[heads[p]].any() or (through[v] and (len(p) > 0 or u == v)):
 				intermodal += 1
-		return intermodal * 1.0 / total
-
-	d = {v['name'] : intermodality(v = v, g = g, nodes = nodes, weight = weight) 
-		 for v in nodes}
+		return intermodal * 1.0 / len(nodes)
+
+	d = {}
+	batch_size = 256
+	for i in range(0, len(nodes), batch_size):
+		batch = nodes[i:i + batch_size]
+		for v, paths in zip(batch, csr.target_paths(G, batch, [nodes] * len(batch), batch_size = batch_size)):
+			d[g.vs[v]['name']] = intermodality(v, paths)
 	
 	nx.set_node_attributes(self.G, 'intermodality', d)
+	self.mutated()
 
 def spatial_outreach(multi, node_layer = 'taz', thru_layers = ['streets'], weight = None, cost = None, attrname = 'outreach'):
 	'''
@@ -101,9 +111,7 @@ def spatial_outreach(multi, node_layer = 'taz', thru_layers = ['streets'], weigh
 	def distance_matrix(nodes, weight):
 		N = len(nodes)
 
-		lengths = g.shortest_paths_dijkstra(weights = weight, 
-		                                    source = nodes, 
-		                                    target = nodes)
+		lengths = cch.path_lengths(g, nodes, nodes, weight)
 
 		d = {nodes[i] : {nodes[j] : lengths[i][j] for j in range(N) } 
 			 for i in range(N)}
@@ -117,7 +125,8 @@ def spatial_outreach(multi, node_layer = 'taz', thru_layers = ['streets'], weigh
 		points = [pos[n] for n in ego(n, cost, d)]
 		return MultiPoint(points).convex_hull.area
 		
-	g = utility.nx_2_igraph(multi.layers_as_subgraph(thru_layers + [node_layer]))
+	g = utility.nx_2_igraph(multi.layers_as_subgraph(thru_layers + [node_layer]), 
+	                        node_attrs = ['layer', 'lon', 'lat'], edge_attrs = [] if weight is None else [weight])
 	nodes = g.vs.select(lambda vertex: vertex['layer'] == node_layer)['name']
 	pos = {v['name'] : (v['lon'] * LON_DIST, v['lat'] * LAT_DIST) 
 		   for v in g.vs.select(lambda v: v['name'] in nodes)}
@@ -126,6 +135,7 @@ def spatial_outreach(multi, node_layer = 'taz', thru_layers = ['streets'], weigh
 	
 	outreach = {n : sqrt(area(n, cost, d)/pi) for n in nodes}
 	nx.set_node_attributes(multi.G, attrname, outreach)
+	multi.mutated()
 
 def proximity_to(multi, layers, to_layer):
 	"""
@@ -140,11 +150,14 @@ def proximity_to(multi, layers, to_layer):
 	Returns:
 		None
 	"""
-	layers_copy = multi.layers_as_subgraph(layers)	
-	to_layer_copy = multi.layers_as_subgraph([to_layer])
-	d = {n : utility.find_nearest(n, layers_copy, to_layer_copy)[1] 
-		 for n in layers_copy.node}
+	to_index = multi.spatial_index(to_layer)
+	d = {}
+	for layer in layers:
+		index = multi.spatial_index(layer)
+		nearest, nearest_dist = to_index.nearest(index.positions)
+		d.update(zip(index.names, nearest_dist))
 	nx.set_node_attributes(multi.G, 'proximity_to_' + to_layer, d)
+	multi.mutated()
 
 def accessible_nodes(self, origin, weight, limit):
 	'''
@@ -173,7 +186,7 @@ def accessible_nodes(self, origin, weight, limit):
 def path_lengths_igraph(g, nodes, weight, mode = 'array'):
 	'''
 	Summary: 
-		quick finding of shortest path lengths between nodes. 
+		quick finding of shortest path lengths between nodes, with a contraction hierarchy (see cch.path_lengths()). 
 		If as_df, returns as a pd dataframe with columns for origin and destination. 
 		If not as_df, returns a 1d np.array(). This is significantly faster in situations when we don't need
 		to keep track of o and d.
@@ -188,9 +201,7 @@ def path_lengths_igraph(g, nodes, weight, mode = 'array'):
 	returns:
 		the shortest path lengths as either an array or a pandas.DataFrame
 	'''
-	lengths = g.shortest_paths_dijkstra(weights = weight, 
-	                                    source = nodes, 
-	                                    target = nodes)
+	lengths = cch.path_lengths(g, nodes, nodes, weight)
 	if mode == 'df':
 		q = [(nodes[i],nodes[j],lengths[i][j]) for i in range(len(nodes)) 
 		for j in range(len(nodes))]
@@ -200,12 +211,11 @@ def path_lengths_igraph(g, nodes, weight, mode = 'array'):
 		p = [tup[2] for tup in q]
 
 		df = pd.DataFrame({'o' : o, 'd' : d, weight + '_length' : p})
-		return lengths
+		return lengths.tolist()
 	elif mode == 'array':
-		lengths = np.array(lengths)
 		return lengths.ravel()
 	else:
-		return lengths
+		return lengths.tolist()
 
 def standardize(array):
 	"""
@@ -226,29 +236,21 @@ def congestion_gradient(free_flow_time_m, flow, capacity, a = .15, b = 4, compon
 	"""
 	Summary: 
 		Compute the derivative of the BPR congestion function for specified values of free flow time, flow, and capacity. 
-		The derivative has two terms, either of which can be returned, or the sum of the two.  
+		The derivative has two terms, either of which can be returned, or the sum of the two. See costs.gradient(). 
 	
 	Args:
 	    free_flow_time_m (float): the free flow time of the edge
 	    flow (float): the flow through the edge
 	    capacity (float): the capacity of the edge
-	    a (float, optional): BPR tuning parameter
-	    b (int, optional): BPR tuning parameter
+	    a (float or np.array, optional): BPR tuning parameter, per edge if an array
+	    b (int or np.array, optional): BPR tuning parameter, per edge if an array
 	    components (str, optional): which component of the derivative to return; 
 	    options include 'selfish', 'social', or 'both'
 	
 	Returns:
-	    TYPE: 
+	    np.array: the requested component for each edge 
 	"""
-	selfish = free_flow_time_m *     a * (flow / capacity) ** b
-	social  = free_flow_time_m * b * a * (flow / capacity) ** b
-
-	if components == 'both':
-		return selfish + social
-	elif components == 'selfish':
-		return selfish
-	elif components == 'social':
-		return social
+	return costs.gradient(free_flow_time_m, flow, capacity, a, b, components)
 
 
 
@@ -0,0 +1,411 @@
+import numpy as np
+import heapq
+import hashlib
+import os
+from scipy.sparse.csgraph import dijkstra
+from metro import checkpoint as checkpoints
+from metro import csr
+
+# the directory in which elimination orders are cached: $METRO_CACHE_DIR if set, otherwise 2_multiplex/cache
+# of the repository, whatever the working directory
+CACHE_DIR = os.environ.get('METRO_CACHE_DIR',
+                           os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '2_multiplex', 'cache'))
+
+class hierarchy:
+    '''
+    hierarchy is a customizable contraction hierarchy (CCH) over a csr_graph. Vertices are
+    ranked by an elimination order that depends on the topology only, so it is computed once
+    (see elimination_order()) and cached on disk; eliminating them in that order adds the
+    shortcut edges of the hierarchy, each joining a lower and an upper vertex. Whenever the
+    edge weights change, customize() recomputes the weights of all shortcuts in a few array
+    operations per level, and queries then sweep the hierarchy for whole batches of origins
+    at once: upwards from the origins, then downwards over every vertex (as in PHAST), which
+    gives each origin's distances to the whole network. Shortcuts are unpacked into the last
+    original edge of the path they stand for, so the results are shortest path trees that
+    csr_graph.tree_flows() and tree_paths() can load directly.
+    attributes:
+        self.G -- (csr_graph) the network
+        self.order -- (np.array) the vertices in elimination order
+        self.rank -- (np.array) the position of each vertex in self.order
+        self.lower -- (np.array) the lower (earlier eliminated) vertex of each edge of the hierarchy
+        self.upper -- (np.array) the upper vertex of each edge of the hierarchy
+        self.up -- (np.array) the customized weight of each edge from its lower to its upper vertex
+        self.down -- (np.array) the customized weight of each edge from its upper to its lower vertex
+        self.weights -- (np.array) the edge weights of G, in stored order, for which self was last customized
+    '''
+    def __init__(self, G, order):
+        self.G = G
+        self.order = np.asarray(order, dtype = np.int64)
+        self.rank = np.empty(G.n, dtype = np.int64)
+        self.rank[self.order] = np.arange(G.n)
+        self.weights = None
+
+        self.lower, self.upper = _contract(G, self.order)
+        n = G.n
+        self._keys = self.lower * n + self.upper
+        sort = np.argsort(self._keys)
+        self.lower, self.upper, self._keys = self.lower[sort], self.upper[sort], self._keys[sort]
+
+        # the hierarchy edge and direction of each original edge; loops are never on a shortest path
+        self._loop = G.sources == G.targets
+        low = np.where(self.rank[G.sources] < self.rank[G.targets], G.sources, G.targets)
+        high = np.where(self.rank[G.sources] < self.rank[G.targets], G.targets, G.sources)
+        self._edge_of = np.searchsorted(self._keys, low * n + high)
+        self._upward = (G.sources == low) & ~self._loop
+
+        self._levels()
+        self._triangles()
+
+    def edge(self, u, w):
+        """
+        Summary:
+            Find the edges of the hierarchy joining pairs of vertices.
+
+        Args:
+            u (np.array): the lower vertices
+            w (np.array): the upper vertices
+
+        Returns:
+            np.array: the index of each edge (u, w)
+        """
+        return np.searchsorted(self._keys, np.asarray(u, dtype = np.int64) * self.G.n + w)
+
+    def _levels(self):
+        # the level of a vertex is one more than the highest level of its lower neighbours, and its
+        # depth one more than the highest depth of its upper neighbours, so the edges leaving vertices
+        # of one level (depth) only depend on edges leaving vertices of lower levels (depths)
+        n = self.G.n
+        level = np.zeros(n, dtype = np.int64)
+        depth = np.zeros(n, dtype = np.int64)
+        by_upper = np.argsort(self.rank[self.upper], kind = 'mergesort')
+        by_lower = np.argsort(-self.rank[self.lower], kind = 'mergesort')
+        for k in by_upper:
+            level[self.upper[k]] = max(level[self.upper[k]], level[self.lower[k]] + 1)
+        for k in by_lower:
+            depth[self.lower[k]] = max(depth[self.lower[k]], depth[self.upper[k]] + 1)
+        self._level, self._depth = level, depth
+
+        # per level, the edges leaving its vertices upwards, and per depth, downwards, in rounds
+        # within which no vertex is updated twice
+        self._up_rounds = _rounds(level[self.lower], self.upper)
+        self._down_rounds = _rounds(depth[self.upper], self.lower)
+
+    def _triangles(self):
+        # the lower triangles (v; u, w) of the hierarchy, with v below u below w, grouped by the level of v
+        n = self.G.n
+        order = np.lexsort((self.rank[self.upper], self.lower))
+        lower, upper = self.lower[order], self.upper[order]
+        starts = np.searchsorted(lower, np.arange(n + 1))
+        v, u, w = [], [], []
+        for x in np.nonzero(np.diff(starts) > 1)[0]:
+            above = upper[starts[x]:starts[x + 1]]
+            i, j = np.triu_indices(len(above), 1)
+            v.append(np.repeat(x, len(i)))
+            u.append(above[i])
+            w.append(above[j])
+        v = np.concatenate(v + [np.zeros(0, dtype = np.int64)])
+        u = np.concatenate(u + [np.zeros(0, dtype = np.int64)])
+        w = np.concatenate(w + [np.zeros(0, dtype = np.int64)])
+
+        vu, vw, uw = self.edge(v, u), self.edge(v, w), self.edge(u, w)
+        sort = np.lexsort((uw, self._level[v]))
+        self._tri = (vu[sort], vw[sort], uw[sort])
+        levels = self._level[v][sort]
+        self._tri_starts = np.searchsorted(levels, np.arange(levels.max() + 2 if len(levels) else 1))
+
+    def customize(self, weights = None):
+        """
+        Summary:
+            Set the weights of the hierarchy from edge weights of G: each edge first takes the weight of the original
+            edges it joins, if any, and then, level by level, the weight of the cheapest path through any lower triangle.
+
+        Args:
+            weights (np.array, optional): edge weights of G in stored order; defaults to G.cost
+
+        Returns:
+            None
+        """
+        if weights is None:
+            weights = self.G.cost
+        weights = np.asarray(weights, dtype = np.float64)
+        m = len(self.lower)
+        up, down = np.empty(m), np.empty(m)
+        up.fill(np.inf)
+        down.fill(np.inf)
+        keep = ~self._loop
+        np.minimum.at(up, self._edge_of[keep & self._upward], weights[keep & self._upward])
+        np.minimum.at(down, self._edge_of[keep & ~self._upward], weights[keep & ~self._upward])
+        self._original = (up.copy(), down.copy())
+
+        vu, vw, uw = self._tri
+        for k in range(len(self._tri_starts) - 1):
+            lo, hi = self._tri_starts[k], self._tri_starts[k + 1]
+            if lo == hi:
+                continue
+            target = uw[lo:hi]
+            first = np.concatenate(([0], np.nonzero(np.diff(target))[0] + 1))
+            edges = target[first]
+            up[edges] = np.minimum(up[edges], np.minimum.reduceat(down[vu[lo:hi]] + up[vw[lo:hi]], first))
+            down[edges] = np.minimum(down[edges], np.minimum.reduceat(down[vw[lo:hi]] + up[vu[lo:hi]], first))
+        self.up, self.down = up, down
+        self._unpack()
+        self.weights = weights.copy()
+
+    def _unpack(self):
+        # the tail of the last original edge on the path each edge of the hierarchy stands for, in each direction
+        up_original, down_original = self._original
+        vu, vw, uw = self._tri
+        m = len(self.lower)
+        if len(uw) == 0:
+            # without lower triangles there are no shortcuts: every edge of the hierarchy is an original edge
+            self._tails = (self.lower.copy(), self.upper.copy())
+            return
+        up_middle = np.repeat(-1, m)
+        down_middle = np.repeat(-1, m)
+        up_match = self.down[vu] + self.up[vw] == self.up[uw]
+        down_match = self.down[vw] + self.up[vu] == self.down[uw]
+        up_middle[uw[up_match]] = np.nonzero(up_match)[0]
+        down_middle[uw[down_match]] = np.nonzero(down_match)[0]
+
+        up_tail = np.repeat(-1, m)
+        down_tail = np.repeat(-1, m)
+        by_level = np.argsort(self._level[self.lower], kind = 'mergesort')
+        levels = self._level[self.lower][by_level]
+        bounds = np.searchsorted(levels, np.arange(levels.max() + 2 if m else 1))
+        for k in range(len(bounds) - 1):
+            e = by_level[bounds[k]:bounds[k + 1]]
+            direct = up_original[e] == self.up[e]
+            t = up_middle[e]
+            up_tail[e] = np.where(direct | (t < 0), self.lower[e], up_tail[vw[np.maximum(t, 0)]])
+            direct = down_original[e] == self.down[e]
+            t = down_middle[e]
+            down_tail[e] = np.where(direct | (t < 0), self.upper[e], up_tail[vu[np.maximum(t, 0)]])
+        self._tails = (up_tail, down_tail)
+
+    def trees(self, origins, weights = None):
+        """
+        Summary:
+            Compute shortest path trees from a batch of origins by sweeping the hierarchy, customizing it first if
+            the weights have changed. The trees can be used wherever those of csr_graph.shortest_path_trees() are.
+
+        Args:
+            origins (list): vertex ids from which to search
+            weights (np.array, optional): edge weights of G in stored order; defaults to G.cost
+
+        Returns:
+            np.array: distances, one row per origin
+            np.array: predecessors, one row per origin, negative for origins and unreachable vertices
+        """
+        if weights is None:
+            weights = self.G.cost
+        if self.weights is None or not np.array_equal(self.weights, weights):
+            self.customize(weights)
+
+        origins = np.asarray(origins, dtype = np.int64)
+        B, n = len(origins), self.G.n
+        rows = np.arange(B)
+        # vertex-major, so that each edge reads and writes one contiguous row of B values
+        dist = np.empty((n, B))
+        dist.fill(np.inf)
+        dist[origins, rows] = 0
+        pred = np.empty((n, B), dtype = np.int32)
+        pred.fill(-9999)
+        up_tail, down_tail = self._tails
+
+        for sweep, tails, heads, hweights, unpacked in [(self._up_rounds, self.lower, self.upper, self.up, up_tail),
+                                                         (self._down_rounds, self.upper, self.lower, self.down, down_tail)]:
+            for edges in sweep:
+                h = heads[edges]
+                d = dist[tails[edges]] + hweights[edges][:, None]
+                current = dist[h]
+                better = d < current
+                dist[h] = np.where(better, d, current)
+                pred[h] = np.where(better, unpacked[edges][:, None], pred[h])
+        pred[origins, rows] = -9999
+        dist, pred = dist.T.copy(), pred.T.copy()
+
+        # edges of (numerically) zero weight can tie, and a tie may close a cycle of predecessors; follow
+        # every chain of ties, which ends within as many steps as there are ties unless it is a cycle
+        flat = np.nonzero((pred >= 0) & (dist[rows[:, None], np.maximum(pred, 0)] == dist))
+        tied = np.zeros(pred.shape, dtype = bool)
+        tied[flat] = True
+        cur_rows, cur = flat
+        for step in range(len(cur)):
+            if len(cur) == 0:
+                break
+            cur = pred[cur_rows, cur]
+            keep = tied[cur_rows, cur]
+            cur_rows, cur = cur_rows[keep], cur[keep]
+        if len(cur):
+            redo = np.unique(cur_rows)
+            dist[redo], pred[redo] = dijkstra(self.G.matrix(weights), 
+                                              directed = True, 
+                                              indices = origins[redo], 
+                                              return_predecessors = True)
+        return dist, pred
+
+    def distances(self, sources, targets, weights = None, batch_size = 256):
+        """
+        Summary:
+            Compute the matrix of shortest path lengths between two sets of vertices, sweeping the hierarchy for
+            batches of sources.
+
+        Args:
+            sources (list): vertex ids from which to measure
+            targets (list): vertex ids to which to measure
+            weights (np.array, optional): edge weights of G in stored order; defaults to G.cost
+            batch_size (int, optional): the number of sources swept together
+
+        Returns:
+            np.array: the lengths, one row per source and one column per target, infinite where there is no path
+        """
+        sources = np.asarray(sources, dtype = np.int64)
+        targets = np.asarray(targets, dtype = np.int64)
+        out = np.empty((len(sources), len(targets)))
+        for i in range(0, len(sources), batch_size):
+            dist, pred = self.trees(sources[i:i + batch_size], weights)
+            out[i:i + batch_size] = dist[:, targets]
+        return out
+
+def _rounds(group, head):
+    """
+    Summary:
+        Split edges into consecutive rounds, in increasing order of group, such that no head appears twice in a round.
+
+    Args:
+        group (np.array): the group of each edge, e.g. the level of its tail
+        head (np.array): the vertex each edge updates
+
+    Returns:
+        list: arrays of edge indices, one per round
+    """
+    order = np.lexsort((head, group))
+    group, head = group[order], head[order]
+    rounds = []
+    bounds = np.searchsorted(group, np.arange(group.max() + 2 if len(group) else 1))
+    for k in range(len(bounds) - 1):
+        edges, heads = order[bounds[k]:bounds[k + 1]], head[bounds[k]:bounds[k + 1]]
+        if len(edges) == 0:
+            continue
+        # the occurrence of each head among the edges of the group
+        first = np.concatenate(([True], heads[1:] != heads[:-1]))
+        starts = np.maximum.accumulate(np.where(first, np.arange(len(heads)), 0))
+        occurrence = np.arange(len(heads)) - starts
+        for r in range(occurrence.max() + 1):
+            rounds.append(edges[occurrence == r])
+    return rounds
+
+def _contract(G, order):
+    """
+    Summary:
+        Eliminate the vertices of G in order, joining the remaining neighbours of each, and return the edges of the resulting
+        hierarchy, each from the vertex eliminated first to the other.
+
+    Args:
+        G (csr_graph): the network
+        order (np.array): the elimination order
+
+    Returns:
+        np.array: the lower vertex of each edge
+        np.array: the upper vertex of each edge
+    """
+    neighbours = _neighbours(G)
+    lower, upper = [], []
+    for v in order.tolist():
+        above = neighbours[v]
+        for u in above:
+            neighbours[u].discard(v)
+            neighbours[u].update(above)
+            neighbours[u].discard(u)
+        lower.extend([v] * len(above))
+        upper.extend(above)
+        neighbours[v] = None
+    return np.array(lower, dtype = np.int64), np.array(upper, dtype = np.int64)
+
+def _neighbours(G):
+    neighbours = [set() for v in range(G.n)]
+    for u, v in zip(G.sources.tolist(), G.targets.tolist()):
+        if u != v:
+            neighbours[u].add(v)
+            neighbours[v].add(u)
+    return neighbours
+
+def elimination_order(G, cache_dir = CACHE_DIR):
+    """
+    Summary:
+        Order the vertices of G for contraction with the minimum degree heuristic, which repeatedly eliminates the vertex
+        with the fewest remaining neighbours. The order depends on the topology of G only, so it is cached in cache_dir,
+        keyed by a hash of the edges, and read back whenever the same topology is contracted again.
+
+    Args:
+        G (csr_graph): the network
+        cache_dir (str, optional): the directory of the cache, CACHE_DIR by default, or None to compute the order without caching
+
+    Returns:
+        np.array: the vertices in elimination order
+    """
+    if cache_dir is not None:
+        digest = hashlib.md5(np.asarray(G.keys, dtype = np.int64).tobytes() + str(G.n)).hexdigest()
+        file_name = os.path.join(cache_dir, 'cch_order_' + digest + '.npz')
+        cached = checkpoints.load(file_name)
+        if cached is not None:
+            return cached['order']
+
+    neighbours = _neighbours(G)
+    heap = [(len(neighbours[v]), v) for v in range(G.n)]
+    heapq.heapify(heap)
+    order = []
+    while heap:
+        degree, v = heapq.heappop(heap)
+        if neighbours[v] is None or degree != len(neighbours[v]):
+            continue
+        above = neighbours[v]
+        for u in above:
+            neighbours[u].discard(v)
+            neighbours[u].update(above)
+            neighbours[u].discard(u)
+            heapq.heappush(heap, (len(neighbours[u]), u))
+        neighbours[v] = None
+        order.append(v)
+    order = np.array(order, dtype = np.int64)
+
+    if cache_dir is not None:
+        checkpoints.save(file_name, order = order)
+    return order
+
+def hierarchy_of(G, cache_dir = CACHE_DIR):
+    """
+    Summary:
+        Build the contraction hierarchy of a csr_graph, with the elimination order read from cache_dir if it was computed before.
+
+    Args:
+        G (csr_graph): the network
+        cache_dir (str, optional): the directory in which elimination orders are cached, or None
+
+    Returns:
+        hierarchy: the hierarchy, customized on first use
+    """
+    return hierarchy(G, elimination_order(G, cache_dir))
+
+def path_lengths(g, sources, targets, weight = None, cache_dir = CACHE_DIR):
+    """
+    Summary:
+        Compute the matrix of shortest path lengths between two sets of vertices of an igraph.Graph() with a contraction
+        hierarchy, as a faster equivalent of g.shortest_paths_dijkstra(source = sources, target = targets, weights = weight).
+
+    Args:
+        g (igraph.Graph): the network
+        sources (list): vertex ids or names from which to measure
+        targets (list): vertex ids or names to which to measure
+        weight (str, optional): the edge attribute giving lengths; if None, every edge has length 1
+        cache_dir (str, optional): the directory in which elimination orders are cached, or None
+
+    Returns:
+        np.array: the lengths, one row per source and one column per target, infinite where there is no path
+    """
+    def ids(vertices):
+        return np.array([v if isinstance(v, (int, long, np.integer)) else g.vs.find(name = v).index for v in vertices],
+                        dtype = np.int64)
+
+    G = csr.csr_from_igraph(g, weight, None)
+    return hierarchy_of(G, cache_dir).distances(ids(sources), ids(targets))
@@ -0,0 +1,72 @@
+import numpy as np
+import os
+from metro.utility import check_directory
+
+def save(file_name, **arrays):
+    """
+    Summary:
+        Save arrays to a .npz checkpoint. The file is written under a temporary name and then renamed,
+        so a checkpoint on disk is always complete, even if the process is killed while saving.
+
+    Args:
+        file_name (str): the checkpoint file, e.g. '3_throughput/checkpoint.npz'
+        **arrays: the arrays to save, by name
+
+    Returns:
+        None
+    """
+    check_directory(os.path.dirname(file_name) or '.')
+    tmp = file_name + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp, file_name)
+
+def load(file_name):
+    """
+    Summary:
+        Load a checkpoint written by save().
+
+    Args:
+        file_name (str): the checkpoint file
+
+    Returns:
+        dict: the saved arrays by name, or None if there is no checkpoint
+    """
+    if file_name is None or not os.path.exists(file_name):
+        return None
+    data = np.load(file_name)
+    state = {key : data[key] for key in data.files}
+    data.close()
+    return state
+
+def remove(file_name):
+    """
+    Summary:
+        Delete a checkpoint, if it exists.
+
+    Args:
+        file_name (str): the checkpoint file
+
+    Returns:
+        None
+    """
+    if file_name is not None and os.path.exists(file_name):
+        os.remove(file_name)
+
+def to_csv(df, file_name, **kwargs):
+    """
+    Summary:
+        Write a pandas.DataFrame to csv under a temporary name and then rename it, so that the file
+        only exists once it is complete and can mark a finished piece of work.
+
+    Args:
+        df (pandas.DataFrame): the df to write
+        file_name (str): the csv file
+        **kwargs: passed to df.to_csv()
+
+    Returns:
+        None
+    """
+    tmp = file_name + '.tmp'
+    df.to_csv(tmp, **kwargs)
+    os.rename(tmp, file_name)
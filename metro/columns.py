@@ -0,0 +1,444 @@
+import numpy as np
+import pandas as pd
+import networkx as nx
+import igraph as ig
+from collections import OrderedDict
+
+class store:
+    '''
+    store holds the nodes and edges of a multiplex in columnar form: nodes and edges are numbered by
+    integer ids, every attribute is one typed array over all nodes or all edges (float64, int64 or,
+    for anything else, object), and the 'layer' attribute is categorical, i.e. a small integer code
+    per node and edge into a list of layer names. A label-to-id table maps node labels such as
+    'streets_123' to ids. Attribute reads, per-layer reductions and bulk changes are array operations,
+    and a networkx.DiGraph (to_graph()) or igraph.Graph (to_igraph()) is generated only when needed.
+    A missing attribute is NaN in float columns and None in object columns; int columns are complete.
+    attributes:
+        self.labels -- (np.array) the label of each node, by id
+        self.ids -- (dict) the id of each node label
+        self.layers -- (list) the layer names, indexed by layer code
+        self.node_layer -- (np.array) the layer code of each node
+        self.node_columns -- (OrderedDict) the array of each node attribute, by attribute
+        self.sources -- (np.array) the id of the source of each edge
+        self.targets -- (np.array) the id of the target of each edge
+        self.edge_layer -- (np.array) the layer code of each edge
+        self.edge_columns -- (OrderedDict) the array of each edge attribute, by attribute
+    '''
+    def __init__(self, labels, node_layer, node_columns, sources, targets, edge_layer, edge_columns, layers):
+        self.labels = np.asarray(labels, dtype = object)
+        self.ids = {label : i for i, label in enumerate(self.labels)}
+        self.layers = list(layers)
+        self.node_layer = np.asarray(node_layer, dtype = np.int16)
+        self.node_columns = OrderedDict(node_columns)
+        self.sources = np.asarray(sources, dtype = np.int32)
+        self.targets = np.asarray(targets, dtype = np.int32)
+        self.edge_layer = np.asarray(edge_layer, dtype = np.int16)
+        self.edge_columns = OrderedDict(edge_columns)
+        self._keys = None
+
+    def number_of_nodes(self):
+        return len(self.labels)
+
+    def number_of_edges(self):
+        return len(self.sources)
+
+    def nbytes(self):
+        """
+        Summary:
+            Estimate the memory held by self, counting the objects of object columns.
+
+        Returns:
+            int: the size of self, in bytes
+        """
+        def size(a):
+            return a.nbytes + (sum(getattr(x, '__sizeof__', lambda : 0)() for x in a) if a.dtype == object else 0)
+        arrays = [self.labels, self.node_layer, self.sources, self.targets, self.edge_layer] + \
+                 self.node_columns.values() + self.edge_columns.values()
+        return sum(size(a) for a in arrays)
+
+    # -------------------------------------------------------------------------
+    # SELECTION
+    # -------------------------------------------------------------------------
+
+    def layer_codes(self, layers):
+        return [self.layers.index(layer) for layer in layers if layer in self.layers]
+
+    def node_mask(self, layers = None):
+        """
+        Summary:
+            Select the nodes of some layers.
+
+        Args:
+            layers (list, optional): the layers, all of them if not given
+
+        Returns:
+            np.array: a boolean mask over node ids
+        """
+        if layers is None:
+            return np.ones(len(self.labels), dtype = bool)
+        return np.in1d(self.node_layer, self.layer_codes(layers))
+
+    def edge_mask(self, layers = None):
+        """
+        Summary:
+            Select the edges of some layers.
+
+        Args:
+            layers (list, optional): the layers, all of them if not given
+
+        Returns:
+            np.array: a boolean mask over edge ids
+        """
+        if layers is None:
+            return np.ones(len(self.sources), dtype = bool)
+        return np.in1d(self.edge_layer, self.layer_codes(layers))
+
+    def subgraph_edge_mask(self, layers):
+        """
+        Summary:
+            Select the edges of the subgraph induced by the nodes of some layers, which includes the transfer
+            edges between them, as multiplex.layers_as_subgraph() does.
+
+        Args:
+            layers (list): the layers
+
+        Returns:
+            np.array: a boolean mask over edge ids
+        """
+        nodes = self.node_mask(layers)
+        return nodes[self.sources] & nodes[self.targets]
+
+    def edge_ids(self, edges):
+        """
+        Summary:
+            Find the ids of edges given by the labels of their ends.
+
+        Args:
+            edges (list): the edges (u, v), by node label
+
+        Returns:
+            np.array: the id of each edge, or -1 for pairs that are not edges of self
+        """
+        n = len(self.labels)
+        if self._keys is None:
+            keys = self.sources.astype(np.int64) * n + self.targets
+            self._order = np.argsort(keys, kind = 'mergesort')
+            self._keys = keys[self._order]
+        u = np.array([self.ids.get(e[0], -1) for e in edges], dtype = np.int64)
+        v = np.array([self.ids.get(e[1], -1) for e in edges], dtype = np.int64)
+        keys = u * n + v
+        ids = np.full(len(keys), -1, dtype = np.int64)
+        if len(self._keys) > 0:
+            i = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+            found = (u >= 0) & (v >= 0) & (self._keys[i] == keys)
+            ids[found] = self._order[i[found]]
+        return ids
+
+    # -------------------------------------------------------------------------
+    # ATTRIBUTES
+    # -------------------------------------------------------------------------
+
+    def node_attribute(self, attr, layers = None):
+        """
+        Summary:
+            Read a node attribute as an array.
+
+        Args:
+            attr (str): the attribute, or 'layer' for the name of each node's layer
+            layers (list, optional): the layers of the nodes to read, all of them if not given
+
+        Returns:
+            np.array: the attribute of each selected node, in id order
+        """
+        values = np.array(self.layers, dtype = object)[self.node_layer] if attr == 'layer' else self.node_columns[attr]
+        return values if layers is None else values[self.node_mask(layers)]
+
+    def edge_attribute(self, attr, layers = None):
+        """
+        Summary:
+            Read an edge attribute as an array.
+
+        Args:
+            attr (str): the attribute, or 'layer' for the name of each edge's layer
+            layers (list, optional): the layers of the edges to read, all of them if not given
+
+        Returns:
+            np.array: the attribute of each selected edge, in id order
+        """
+        values = np.array(self.layers, dtype = object)[self.edge_layer] if attr == 'layer' else self.edge_columns[attr]
+        return values if layers is None else values[self.edge_mask(layers)]
+
+    def set_edge_attribute(self, attr, values, ids = None, dtype = None):
+        """
+        Summary:
+            Set an edge attribute from an array, adding the column if needed. Edges of a new column that
+            are not set are missing.
+
+        Args:
+            attr (str): the attribute
+            values (np.array): the values, one per edge of ids
+            ids (np.array, optional): the ids of the edges to set, all edges if not given
+            dtype (np.dtype, optional): the type of a new column, by default that of values
+
+        Returns:
+            None
+        """
+        values = np.asarray(values)
+        if attr not in self.edge_columns:
+            dtype = np.dtype(dtype or values.dtype)
+            if ids is None:
+                self.edge_columns[attr] = values.astype(dtype)
+                return
+            if dtype.kind in 'iub':
+                dtype = np.dtype(np.float64)
+            self.edge_columns[attr] = np.full(len(self.sources), np.nan if dtype.kind == 'f' else None,
+                                              dtype = dtype if dtype.kind == 'f' else object)
+        column = self.edge_columns[attr]
+        if column.dtype.kind in 'iu' and values.dtype.kind == 'f':
+            column = self.edge_columns[attr] = column.astype(np.float64)
+        if ids is None:
+            column[:] = values
+        else:
+            column[ids] = values
+
+    def scale_edge_attribute(self, attr, beta, layers = None):
+        """
+        Summary:
+            Multiply an edge attribute by a constant, over the edges of some layers.
+
+        Args:
+            attr (str): the attribute
+            beta (float): the constant
+            layers (list, optional): the layers, all of them if not given
+
+        Returns:
+            None
+        """
+        mask = self.edge_mask(layers)
+        column = self.edge_columns[attr]
+        if column.dtype.kind in 'iu' and float(beta) != int(beta):
+            column = self.edge_columns[attr] = column.astype(np.float64)
+        column[mask] = column[mask] * beta
+
+    def mean_edge_attribute(self, attr, edges = None, weight_attr = None):
+        """
+        Summary:
+            Compute the (optionally weighted) mean of an edge attribute over some edges.
+
+        Args:
+            attr (str): the attribute
+            edges (np.array, optional): a boolean mask over edge ids, all edges if not given
+            weight_attr (str, optional): the edge attribute to weight by
+
+        Returns:
+            float: the mean
+        """
+        edges = self.edge_mask() if edges is None else edges
+        weights = None if weight_attr is None else self.edge_columns[weight_attr][edges].astype(np.float64)
+        return np.average(self.edge_columns[attr][edges].astype(np.float64), weights = weights)
+
+    def nodes_df(self, attrs, layers = None):
+        """
+        Summary:
+            Tabulate node attributes, one row per node of some layers.
+
+        Args:
+            attrs (list): the attributes to include as columns
+            layers (list, optional): the layers, all of them if not given
+
+        Returns:
+            pd.DataFrame: a df with a 'label' column and one column per attribute
+        """
+        mask = self.node_mask(layers)
+        df = pd.DataFrame({attr : self.node_attribute(attr)[mask] for attr in attrs}, columns = attrs)
+        df['label'] = self.labels[mask]
+        return df
+
+    def edges_df(self, attrs, edges = None):
+        """
+        Summary:
+            Tabulate edge attributes, one row per edge.
+
+        Args:
+            attrs (list): the attributes to include as columns
+            edges (np.array, optional): a boolean mask over edge ids, all edges if not given
+
+        Returns:
+            pd.DataFrame: a df with one column per attribute
+        """
+        edges = self.edge_mask() if edges is None else edges
+        return pd.DataFrame({attr : self.edge_attribute(attr)[edges] for attr in attrs}, columns = attrs)
+
+    # -------------------------------------------------------------------------
+    # CONVERSION
+    # -------------------------------------------------------------------------
+
+    def to_graph(self):
+        """
+        Summary:
+            Generate the networkx form of self. Missing attributes are left unset.
+
+        Returns:
+            networkx.DiGraph: the graph, whose nodes are the labels of self
+        """
+        layers = np.array(self.layers, dtype = object)
+        G = nx.DiGraph()
+        G.add_nodes_from(zip(self.labels, _records(self.node_columns, layers[self.node_layer])))
+        G.add_edges_from(zip(self.labels[self.sources], self.labels[self.targets],
+                             _records(self.edge_columns, layers[self.edge_layer])))
+        return G
+
+    def to_igraph(self, node_attrs = None, edge_attrs = None):
+        """
+        Summary:
+            Generate the igraph form of self, as utility.nx_2_igraph() converts the networkx form, with
+            vertices and edges in id order. Missing attributes are None.
+
+        Args:
+            node_attrs (list, optional): the node attributes to copy, all of them if not given
+            edge_attrs (list, optional): the edge attributes to copy, all of them except 'source' and 'target' if not given
+
+        Returns:
+            igraph.Graph: the graph, whose vertices are named by the labels of self
+        """
+        g = ig.Graph(n = len(self.labels), edges = zip(self.sources.tolist(), self.targets.tolist()), directed = True)
+        g.vs['name'] = [str(label) for label in self.labels]
+        if node_attrs is None:
+            node_attrs = [a for a in self.node_columns if a != 'name'] + ['layer']
+        for a in node_attrs:
+            g.vs[a] = _values(self.node_attribute(a)) if a == 'layer' or a in self.node_columns else None
+        if edge_attrs is None:
+            edge_attrs = [a for a in self.edge_columns if a not in ('source', 'target')] + ['layer']
+        for a in edge_attrs:
+            g.es[a] = _values(self.edge_attribute(a)) if a == 'layer' or a in self.edge_columns else None
+        return g
+
+def _values(column):
+    # a column as a list, with missing values as None
+    values = column.tolist()
+    if column.dtype.kind == 'f' and np.isnan(column).any():
+        values = [None if x != x else x for x in values]
+    return values
+
+def _records(columns, layer):
+    # per row, a dict of the values present in columns, and the layer
+    names = columns.keys()
+    present = [(name, column.dtype.kind) for name, column in columns.items()]
+    records = []
+    for row, l in zip(zip(*columns.values()) if names else [()] * len(layer), layer):
+        attr = {name : x for (name, kind), x in zip(present, row)
+                if not (x is None or (kind == 'f' and x != x))}
+        attr['layer'] = l
+        records.append(attr)
+    return records
+
+def column(values, dtype = None):
+    """
+    Summary:
+        Store a list of attribute values, with None for missing values, as a typed column: float64 if all
+        values present are floats, int64 if all values are present ints within its range, and object otherwise.
+
+    Args:
+        values (list): the values
+        dtype (np.dtype, optional): the type of a float column, e.g. np.float32 to save memory
+
+    Returns:
+        np.array: the column
+    """
+    present = [x for x in values if x is not None]
+    numbers = all(isinstance(x, (int, long, float, np.integer, np.floating)) and not isinstance(x, (bool, np.bool_))
+                  for x in present)
+    if numbers and all(isinstance(x, (float, np.floating)) for x in present) and len(present) > 0:
+        return np.array([np.nan if x is None else x for x in values], dtype = dtype or np.float64)
+    if numbers and len(present) == len(values) and len(values) > 0:
+        try:
+            return np.array(values, dtype = np.int64)
+        except OverflowError:
+            pass
+    out = np.empty(len(values), dtype = object)
+    out[:] = values
+    return out
+
+def _layers(node_layer, edge_layer):
+    # the layer names, in order of appearance, and the codes of nodes and edges
+    layers = list(OrderedDict.fromkeys(list(node_layer) + list(edge_layer)))
+    codes = {layer : i for i, layer in enumerate(layers)}
+    return layers, [codes[l] for l in node_layer], [codes[l] for l in edge_layer]
+
+def store_from_records(nodes, edges, dtypes = {}):
+    """
+    Summary:
+        Build a store from node and edge records, as given by G.nodes(data = True) and G.edges(data = True)
+        of a graph in which every node and edge has a 'layer' attribute.
+
+    Args:
+        nodes (list): the nodes, as pairs (label, attribute dict)
+        edges (list): the edges, as triples (u, v, attribute dict)
+        dtypes (dict, optional): the type of some float columns, e.g. {'capacity' : np.float32}
+
+    Returns:
+        store: the store
+    """
+    nodes, edges = list(nodes), list(edges)
+    labels = [n for n, attr in nodes]
+    ids = {n : i for i, n in enumerate(labels)}
+    layers, node_layer, edge_layer = _layers([attr['layer'] for n, attr in nodes], [attr['layer'] for u, v, attr in edges])
+
+    def columns(attrs):
+        names = sorted(set().union(*[attr.keys() for attr in attrs]) - set(['layer']))
+        return [(name, column([attr.get(name) for attr in attrs], dtypes.get(name))) for name in names]
+
+    return store(labels, node_layer, columns([attr for n, attr in nodes]),
+                 [ids[u] for u, v, attr in edges], [ids[v] for u, v, attr in edges], edge_layer,
+                 columns([attr for u, v, attr in edges]), layers)
+
+def store_from_graph(G, dtypes = {}):
+    """
+    Summary:
+        Build a store from a networkx graph in which every node and edge has a 'layer' attribute, keeping
+        the order of G.nodes() and G.edges().
+
+    Args:
+        G (networkx.DiGraph): the graph
+        dtypes (dict, optional): the type of some float columns, e.g. {'capacity' : np.float32}
+
+    Returns:
+        store: the store
+    """
+    return store_from_records(G.nodes(data = True), G.edges(data = True), dtypes)
+
+def store_from_tables(labels, nodes, sources, targets, edges, dtypes = {}):
+    """
+    Summary:
+        Build a store from tables of nodes and edges, each with a 'layer' column, whose other columns
+        become attributes with the dtype of the table. Missing values are NaN, as read by pandas.
+
+    Args:
+        labels (list): the label of each row of nodes
+        nodes (pd.DataFrame): the nodes
+        sources (list): the label of the source of each row of edges
+        targets (list): the label of the target of each row of edges
+        edges (pd.DataFrame): the edges
+        dtypes (dict, optional): the type of some float columns, e.g. {'capacity' : np.float32}
+
+    Returns:
+        store: the store
+    """
+    labels = list(labels)
+    ids = {n : i for i, n in enumerate(labels)}
+    layers, node_layer, edge_layer = _layers(nodes['layer'].values, edges['layer'].values)
+
+    def columns(df):
+        out = []
+        for name in df:
+            if name != 'layer':
+                values = df[name].values
+                if values.dtype.kind == 'f' and name in dtypes:
+                    values = values.astype(dtypes[name])
+                elif values.dtype.kind not in 'fiu':
+                    values = values.astype(object)
+                out.append((name, values))
+        return out
+
+    return store(labels, node_layer, columns(nodes),
+                 [ids[u] for u in sources], [ids[v] for v in targets], edge_layer, columns(edges), layers)
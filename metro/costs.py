@@ -0,0 +1,152 @@
+import numpy as np
+
+# Edges at or above this capacity (metro edges and transfers) are never congested,
+# so the BPR power term is skipped for them.
+UNLIMITED = 1e10
+
+# Standard BPR parameters
+BPR_A = .15
+BPR_B = 4.
+
+def edge_parameters(value, layers = None, default = None):
+    """
+    Summary:
+        Expand a BPR parameter into one value per edge.
+
+    Args:
+        value (float or dict): a single value for all edges, or a dict keyed by layer name
+        layers (list, optional): the layer of each edge; required if value is a dict
+        default (float, optional): the value for edges whose layer is not in value. If None, every layer must be in value. 
+
+    Returns:
+        float or np.array: value itself if it is a number, otherwise an array with one value per edge
+    """
+    if not isinstance(value, dict):
+        return value
+    if default is None:
+        return np.array([value[layer] for layer in layers], dtype = np.float64)
+    return np.array([value.get(layer, default) for layer in layers], dtype = np.float64)
+
+def relative_delay(flow, capacity, a = .15, b = 4.):
+    """
+    Summary:
+        Compute the relative delay a * (flow / capacity) ** b of the BPR function over arrays of edges.
+        The delay is zero on edges with capacity at or above UNLIMITED.
+
+    Args:
+        flow (np.array): the flow through each edge
+        capacity (np.array): the capacity of each edge
+        a (float or np.array, optional): BPR parameter, per edge if an array
+        b (float or np.array, optional): BPR parameter, per edge if an array
+
+    Returns:
+        np.array: the relative delay of each edge
+    """
+    flow, capacity, a, b = np.broadcast_arrays(*[np.asarray(x, dtype = np.float64)
+                                                for x in (flow, capacity, a, b)])
+    out = np.zeros(flow.shape)
+    limited = capacity < UNLIMITED
+    out[limited] = a[limited] * (flow[limited] / capacity[limited]) ** b[limited]
+    return out
+
+def congestion(base, flow, capacity, a = .15, b = 4.):
+    """
+    Summary:
+        Compute the congestion term base * a * (flow / capacity) ** b of the BPR function over arrays of edges.
+
+    Args:
+        base (np.array): the base cost of each edge, usually free_flow_time_m
+        flow (np.array): the flow through each edge
+        capacity (np.array): the capacity of each edge
+        a (float or np.array, optional): BPR parameter, per edge if an array
+        b (float or np.array, optional): BPR parameter, per edge if an array
+
+    Returns:
+        np.array: the congestion term of each edge
+    """
+    return np.asarray(base, dtype = np.float64) * relative_delay(flow, capacity, a, b)
+
+def bpr(base, flow, capacity, a = .15, b = 4.):
+    """
+    Summary:
+        Compute congested travel times with the standard BPR function over arrays of edges.
+
+    Args:
+        base (np.array): the base cost of each edge, usually free_flow_time_m
+        flow (np.array): the flow through each edge
+        capacity (np.array): the capacity of each edge
+        a (float or np.array, optional): BPR parameter, per edge if an array
+        b (float or np.array, optional): BPR parameter, per edge if an array
+
+    Returns:
+        np.array: the congested travel time through each edge
+    """
+    return _unwrap(np.asarray(base, dtype = np.float64) * (1 + relative_delay(flow, capacity, a, b)))
+
+def bpr_derivative(base, flow, capacity, a = .15, b = 4.):
+    """
+    Summary:
+        Compute the derivative of the BPR function with respect to flow over arrays of edges.
+
+    Args:
+        base (np.array): the base cost of each edge, usually free_flow_time_m
+        flow (np.array): the flow through each edge
+        capacity (np.array): the capacity of each edge
+        a (float or np.array, optional): BPR parameter, per edge if an array
+        b (float or np.array, optional): BPR parameter, per edge if an array
+
+    Returns:
+        np.array: the marginal increase in travel time per unit of flow on each edge
+    """
+    flow = np.asarray(flow, dtype = np.float64)
+    term = congestion(base, flow, capacity, a, b) * b
+    out = np.zeros(term.shape)
+    np.divide(term, flow, out = out, where = flow > 0)
+    return _unwrap(out)
+
+def gradient(base, flow, capacity, a = .15, b = 4., components = 'both'):
+    """
+    Summary:
+        Compute the congestion gradient of each edge, i.e. the marginal total travel time of one more unit of flow
+        beyond the base cost. It splits into a selfish part, the extra time experienced by the new unit itself, and a
+        social part, the extra time the unit imposes on the flow already on the edge.
+
+    Args:
+        base (np.array): the base cost of each edge, usually free_flow_time_m
+        flow (np.array): the flow through each edge
+        capacity (np.array): the capacity of each edge
+        a (float or np.array, optional): BPR parameter, per edge if an array
+        b (float or np.array, optional): BPR parameter, per edge if an array
+        components (str, optional): which component to return; options include 'selfish', 'social', or 'both'
+
+    Returns:
+        np.array: the requested component of the gradient of each edge
+    """
+    selfish = congestion(base, flow, capacity, a, b)
+    if components == 'selfish':
+        return _unwrap(selfish)
+    social = selfish * b
+    if components == 'social':
+        return _unwrap(social)
+    elif components == 'both':
+        return _unwrap(selfish + social)
+
+def relative_gap(cost, flow, aon_flow):
+    """
+    Summary:
+        Compute the relative gap of an assignment, (c.x - c.y) / c.x, where c are the current edge costs, x the
+        current flows and y the all-or-nothing flows over shortest paths at c. It is zero at user equilibrium.
+
+    Args:
+        cost (np.array): the current cost of each edge
+        flow (np.array): the current flow through each edge
+        aon_flow (np.array): the all-or-nothing flow through each edge at the current costs
+
+    Returns:
+        float: the relative gap
+    """
+    total = np.dot(cost, flow)
+    return (total - np.dot(cost, aon_flow)) / total if total > 0 else 0.
+
+def _unwrap(x):
+    return x[()] if np.ndim(x) == 0 else x
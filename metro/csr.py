@@ -0,0 +1,941 @@
+import numpy as np
+import ctypes
+import heapq
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
+from scipy.sparse import csr_matrix, coo_matrix
+from scipy.sparse.csgraph import dijkstra, breadth_first_order
+from metro import routes
+from metro import demand
+
+class csr_graph:
+    '''
+    csr_graph holds a directed network as compressed sparse row arrays, so that
+    shortest paths, flow accumulation and cost updates in assignment can be done
+    on whole arrays rather than one igraph edge attribute at a time. Edges are
+    stored sorted by (source, target).
+    attributes:
+        self.n -- (int) the number of vertices
+        self.offsets -- (np.array) edges leaving vertex v are stored in positions offsets[v]:offsets[v + 1]
+        self.sources -- (np.array) source vertex of each stored edge
+        self.targets -- (np.array) target vertex of each stored edge
+        self.eid -- (np.array) index of each stored edge in the edge sequence the graph was built from
+        self.keys -- (np.array) source * n + target of each stored edge, in increasing order
+        self.base -- (np.array) base cost of each stored edge, usually free_flow_time_m
+        self.capacity -- (np.array) capacity of each stored edge
+        self.cost -- (np.array) current (congested) cost of each stored edge
+        self.flow -- (np.array) current flow through each stored edge
+        self.hierarchy -- (cch.hierarchy) if not None, the contraction hierarchy with which shortest_path_trees() searches
+    '''
+    def __init__(self, n, sources, targets, base, capacity):
+        sources = np.asarray(sources, dtype = np.int64)
+        targets = np.asarray(targets, dtype = np.int64)
+
+        self.n = n
+        self.eid = np.lexsort((targets, sources))
+        self.sources = sources[self.eid]
+        self.targets = targets[self.eid]
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(self.sources, minlength = n))))
+        self.keys = self.sources * n + self.targets
+
+        self.base = np.asarray(base, dtype = np.float64)[self.eid]
+        self.capacity = np.asarray(capacity, dtype = np.float64)[self.eid]
+        self.hierarchy = None
+        self.reset()
+
+    def reset(self):
+        """
+        Summary:
+            Zero the flows and set the cost of every edge back to its base cost.
+
+        Returns:
+            None
+        """
+        self.cost = self.base.copy()
+        self.flow = np.zeros(len(self.base))
+
+    def share(self):
+        """
+        Summary:
+            Move the arrays of self into shared memory, so that worker processes forked afterwards read the
+            same copy of the graph. Costs must then be updated in place (e.g. self.cost[:] = ...) for
+            workers to see them. 
+
+        Returns:
+            None
+        """
+        for attr in ['offsets', 'sources', 'targets', 'eid', 'keys', 'base', 'capacity', 'cost', 'flow']:
+            setattr(self, attr, shared_copy(getattr(self, attr)))
+
+    def matrix(self, weights = None):
+        """
+        Summary:
+            Return the network as a scipy.sparse.csr_matrix for use with scipy.sparse.csgraph.
+
+        Args:
+            weights (np.array, optional): edge weights in stored order; defaults to self.cost
+
+        Returns:
+            scipy.sparse.csr_matrix: the weighted adjacency matrix, sharing the index arrays of self.
+        """
+        if weights is None:
+            weights = self.cost
+        return csr_matrix((weights, self.targets, self.offsets), shape = (self.n, self.n))
+
+    def shortest_path_trees(self, origins, weights = None):
+        """
+        Summary:
+            Compute shortest path trees from a batch of origins.
+
+        Args:
+            origins (list): vertex ids from which to search
+            weights (np.array, optional): edge weights in stored order; defaults to self.cost. Searches use self.hierarchy, if set. 
+
+        Returns:
+            np.array: distances, one row per origin
+            np.array: predecessors, one row per origin, negative for origins and unreachable vertices
+        """
+        if self.hierarchy is not None:
+            return self.hierarchy.trees(origins, weights)
+        return dijkstra(self.matrix(weights),
+                        directed = True,
+                        indices = origins,
+                        return_predecessors = True)
+
+    def target_trees(self, origins, targets, weights = None, landmarks = 16):
+        """
+        Summary:
+            Compute shortest path trees from a batch of origins, with each search bounded by a radius (see the limit argument of scipy.sparse.csgraph.dijkstra()) that the 
+            distance to every target is known not to exceed: the shortest distance through a landmark, 
+            min over landmarks L of d(o, L) + d(L, t), from searches to and from a few landmarks spread over the network 
+            (see landmark_distances()). Searches that still miss a target, e.g. an unreachable one, are repeated without 
+            a bound. The paths to the targets are those of shortest_path_trees(); vertices beyond the radius are left unsettled. 
+
+        Args:
+            origins (list): vertex ids from which to search
+            targets (list): per origin, an array of the vertices it needs paths to
+            weights (np.array, optional): edge weights in stored order; defaults to self.cost
+            landmarks (int, optional): the number of landmarks
+
+        Returns:
+            np.array: distances, one row per origin, infinite for unsettled vertices
+            np.array: predecessors, one row per origin, negative for origins, unsettled and unreachable vertices
+            np.array: the number of vertices settled from each origin, over all searches
+        """
+        if weights is None:
+            weights = self.cost
+        A = self.matrix(weights)
+        to_landmarks, from_landmarks = self.landmark_distances(weights, landmarks)
+        origins = np.asarray(origins)
+        radius = np.array([(to_landmarks[:, o][:, None] + from_landmarks[:, t]).min(axis = 0).max() if len(t) else 0. 
+                           for o, t in zip(origins, targets)])
+
+        B = len(origins)
+        dist = np.empty((B, self.n))
+        pred = np.empty((B, self.n), dtype = np.int32)
+        settled = np.zeros(B, dtype = np.int64)
+        todo = []
+        # origins with similar radii are searched together, with the largest radius of the group
+        order = np.argsort(radius)
+        for group in np.array_split(order, max(1, B // 32)):
+            limit = radius[group].max()
+            if not np.isfinite(limit):
+                todo.extend(group)
+                continue
+            d, p = dijkstra(A, directed = True, indices = origins[group], return_predecessors = True, 
+                            limit = limit * (1 + 1e-9))
+            dist[group], pred[group] = d.reshape(len(group), self.n), p.reshape(len(group), self.n)
+            reached = np.isfinite(dist[group])
+            settled[group] += reached.sum(axis = 1)
+            todo.extend(k for i, k in enumerate(group) if not reached[i, targets[k]].all())
+
+        if todo:
+            todo = np.array(todo)
+            d, p = dijkstra(A, directed = True, indices = origins[todo], return_predecessors = True)
+            dist[todo], pred[todo] = d.reshape(len(todo), self.n), p.reshape(len(todo), self.n)
+            settled[todo] += np.isfinite(dist[todo]).sum(axis = 1)
+        return dist, pred, settled
+
+    def landmark_distances(self, weights = None, k = 16):
+        """
+        Summary:
+            Compute distances to and from k landmarks spread over the network, chosen one by one as the vertex farthest 
+            from those already chosen. The result is cached for as long as the weights do not change. 
+
+        Args:
+            weights (np.array, optional): edge weights in stored order; defaults to self.cost
+            k (int, optional): the number of landmarks
+
+        Returns:
+            np.array: distances from each vertex to each landmark, one row per landmark
+            np.array: distances from each landmark to each vertex, one row per landmark
+        """
+        if weights is None:
+            weights = self.cost
+        cached = getattr(self, '_landmarks', None)
+        if cached is not None and cached[0] == k and np.array_equal(cached[1], weights):
+            return cached[2], cached[3]
+
+        A = self.matrix(weights)
+        chosen = [0]
+        nearest = dijkstra(A, directed = False, indices = 0)
+        while len(chosen) < k:
+            reachable = np.isfinite(nearest)
+            v = int(np.nonzero(reachable)[0][np.argmax(nearest[reachable])])
+            if nearest[v] == 0:
+                break
+            chosen.append(v)
+            nearest = np.minimum(nearest, dijkstra(A, directed = False, indices = v))
+        from_landmarks = dijkstra(A, directed = True, indices = chosen).reshape(len(chosen), self.n)
+        to_landmarks = dijkstra(A.T.tocsr(), directed = True, indices = chosen).reshape(len(chosen), self.n)
+        self._landmarks = (k, weights.copy(), to_landmarks, from_landmarks)
+        return to_landmarks, from_landmarks
+
+    def group_trees(self, roots, weights = None):
+        """
+        Summary:
+            Compute shortest path trees that each grow from a set of roots at once, as if searched from a virtual 
+            vertex joined to every root of the set by a zero-cost edge. Each vertex hangs from whichever root is 
+            closest to it. 
+
+        Args:
+            roots (list): per tree, an array of root vertices
+            weights (np.array, optional): edge weights in stored order; defaults to self.cost
+
+        Returns:
+            np.array: distances, one row per tree
+            np.array: predecessors, one row per tree, negative for roots and unreachable vertices
+        """
+        if weights is None:
+            weights = self.cost
+        n, B = self.n, len(roots)
+        if all(len(r) == 1 for r in roots):
+            return self.shortest_path_trees([r[0] for r in roots], weights)
+
+        # one virtual vertex per tree, after the vertices of self, with zero-cost edges to its roots
+        counts = [len(r) for r in roots]
+        indptr = np.concatenate((self.offsets, self.offsets[-1] + np.cumsum(counts)))
+        A = csr_matrix((np.concatenate((weights, np.zeros(sum(counts)))), 
+                        np.concatenate((self.targets, np.concatenate(roots))), 
+                        indptr), shape = (n + B, n + B))
+        dist, pred = dijkstra(A, directed = True, indices = n + np.arange(B), return_predecessors = True)
+        dist, pred = dist[:, :n], pred[:, :n]
+        pred[pred >= n] = -9999
+        return dist, pred
+
+    def tree_flows(self, origins, pred, demand_index, demand_flow):
+        """
+        Summary:
+            Load demand onto a batch of shortest path trees and return the resulting edge flows.
+            Each tree edge carries the total demand of the subtree below it. Subtree totals are
+            computed level by level over a breadth-first ordering of the forest of all trees in
+            the batch, so the work is a fixed number of array operations per tree level.
+
+        Args:
+            origins (list): the origin of each tree, in the row order of pred, or for trees grown by self.group_trees() its array of roots
+            pred (np.array): predecessor rows as returned by self.shortest_path_trees()
+            demand_index (np.array): flat indices row * self.n + destination of each demand entry
+            demand_flow (np.array): the demand of each entry
+
+        Returns:
+            np.array: flow through each edge, in stored order
+        """
+        n = self.n
+        B = len(origins)
+        root = B * n
+
+        pred = pred.ravel()
+        node = np.nonzero(pred >= 0)[0]
+        parent = pred[node] + (node // n) * n
+
+        # one forest for the batch, hanging from a virtual root at index B * n
+        roots = _root_index(origins, n)
+        rows = np.concatenate((parent, np.repeat(root, len(roots))))
+        cols = np.concatenate((node, roots))
+        forest = csr_matrix((np.ones(len(rows), dtype = np.int8), (rows, cols)),
+                            shape = (root + 1, root + 1))
+        order, parent_position, starts = _bfs_levels(forest, root)
+
+        F = np.zeros(root + 1)
+        F[demand_index] = demand_flow
+        F = F[order]
+        for k in range(len(starts) - 2, 1, -1):
+            lo, hi, up = starts[k], starts[k + 1], starts[k - 1]
+            F[up:lo] += np.bincount(parent_position[lo - 1:hi - 1] - up,
+                                    weights = F[lo:hi],
+                                    minlength = lo - up)
+
+        # tree edges below the virtual root's children, summed into stored order
+        tree_nodes = order[starts[2]:]
+        tree_flow = F[starts[2]:]
+        return self.edge_sum(pred[tree_nodes], tree_nodes % n, tree_flow)
+
+    def edge_sum(self, u, v, x):
+        """
+        Summary:
+            Sum values keyed by (source, target) pairs onto the stored edges.
+
+        Args:
+            u (np.array): source vertices, each (u, v) must be an edge of self
+            v (np.array): target vertices
+            x (np.array): the values to sum
+
+        Returns:
+            np.array: the sums, in stored order
+        """
+        m = len(self.targets)
+        # adding explicit zeros for every edge makes the summed pattern equal to
+        # that of self, so the data array comes back in stored order
+        summed = coo_matrix((np.concatenate((x, np.zeros(m))),
+                             (np.concatenate((u, self.sources)),
+                              np.concatenate((v, self.targets)))),
+                            shape = (self.n, self.n)).tocsr()
+        return summed.data
+
+    def slot(self, u, v):
+        """
+        Summary:
+            Find the stored positions of edges given by their endpoints.
+
+        Args:
+            u (np.array): source vertices
+            v (np.array): target vertices; each (u, v) must be an edge of self
+
+        Returns:
+            np.array: the stored position of each edge
+        """
+        return np.searchsorted(self.keys, np.asarray(u, dtype = np.int64) * self.n + v)
+
+    def tree_paths(self, origins, pred, targets):
+        """
+        Summary:
+            Read the edge paths to a set of targets off a batch of shortest path trees. All paths are
+            walked together, one tree level per step, and written straight into a flat buffer.
+
+        Args:
+            origins (list): the origins of the trees, in the row order of pred
+            pred (np.array): predecessor rows as returned by self.shortest_path_trees()
+            targets (list): per origin, an array of destination vertices
+
+        Returns:
+            np.array: the number of edges of each path, in the order of targets
+            np.array: the original indices of the paths' edges, concatenated path by path, each path ordered from origin to target
+        """
+        n = self.n
+        pred = pred.ravel()
+        rows = np.repeat(np.arange(len(origins)), [len(t) for t in targets])
+        cur = rows * n + np.concatenate(targets)
+
+        # the original id of the tree edge entering each vertex of each tree
+        node = np.nonzero(pred >= 0)[0]
+        into = np.zeros(len(pred), dtype = np.int32)
+        into[node] = self.eid[self.slot(pred[node], node % n)]
+
+        # walk every path up to its origin at once, one level per step
+        route = np.arange(len(cur), dtype = np.int32)
+        step_edges, step_routes = [], []
+        while len(cur):
+            keep = pred[cur] >= 0
+            cur, route = cur[keep], route[keep]
+            step_edges.append(into[cur])
+            step_routes.append(route)
+            cur = pred[cur] + (cur // n) * n
+
+        lengths = np.bincount(np.concatenate(step_routes + [np.zeros(0, dtype = np.int32)]), 
+                              minlength = len(rows))
+        ends = np.cumsum(lengths)
+        edges = np.empty(lengths.sum(), dtype = np.int32)
+        # the k-th step from the target is the k-th edge from the end of the path
+        for k in range(len(step_routes)):
+            edges[ends[step_routes[k]] - 1 - k] = step_edges[k]
+        return lengths, edges
+
+    def from_edge_order(self, x):
+        """
+        Summary:
+            Permute an array indexed by original edge id into stored order. Scalars are returned unchanged. 
+
+        Args:
+            x (np.array or float): values indexed by original edge id
+
+        Returns:
+            np.array or float: the same values, in stored order
+        """
+        if np.ndim(x) == 0:
+            return x
+        return np.asarray(x)[self.eid]
+
+    def to_edge_order(self, x):
+        """
+        Summary:
+            Permute an array in stored order back into the order of the original edge sequence. Scalars are returned unchanged. 
+
+        Args:
+            x (np.array or float): values in stored order
+
+        Returns:
+            np.array or float: the same values, indexed by original edge id
+        """
+        if np.ndim(x) == 0:
+            return x
+        out = np.empty_like(x)
+        out[self.eid] = x
+        return out
+
+def _root_index(origins, n):
+    """
+    Summary:
+        Flatten the roots of a batch of trees into indices row * n + vertex.
+
+    Args:
+        origins (list): per tree, its origin or an array of roots
+        n (int): the number of vertices
+
+    Returns:
+        np.array: the flat index of every root
+    """
+    roots = [np.atleast_1d(o) for o in origins]
+    return (np.repeat(np.arange(len(roots)), [len(r) for r in roots]) * n + 
+            np.concatenate(roots + [np.zeros(0, dtype = np.int64)])).astype(np.int64)
+
+def _bfs_levels(forest, root):
+    """
+    Summary:
+        Order a forest breadth-first from its root and split the order into levels.
+
+    Args:
+        forest (scipy.sparse.csr_matrix): the forest, with an entry (parent, child) per edge
+        root (int): the root of the forest
+
+    Returns:
+        np.array: the vertices in breadth-first order
+        np.array: for each vertex but the root, the position of its parent in the order
+        list: the positions at which each level starts, followed by the length of the order
+    """
+    order, forest_pred = breadth_first_order(forest, root,
+                                             directed = True,
+                                             return_predecessors = True)
+
+    # positions of parents in the breadth-first order are non-decreasing, so
+    # each level is a contiguous block found by bisection
+    position = np.empty(forest.shape[0], dtype = np.int64)
+    position[order] = np.arange(len(order))
+    parent_position = position[forest_pred[order[1:]]]
+    starts = [0, 1]
+    while starts[-1] < len(order):
+        starts.append(1 + np.searchsorted(parent_position, starts[-1]))
+    return order, parent_position, starts
+
+def csr_from_igraph(g, base_cost = 'free_flow_time_m', capacity = 'capacity'):
+    """
+    Summary:
+        Construct a csr_graph from an igraph.Graph().
+
+    Args:
+        g (igraph.Graph): the network to convert
+        base_cost (str, optional): the edge attribute containing base cost; if None, every edge costs 1
+        capacity (str, optional): the edge attribute containing capacity; if None, capacities are left at 0
+
+    Returns:
+        csr_graph: the network as arrays, with eid giving igraph edge indices
+    """
+    edges = np.array(g.get_edgelist(), dtype = np.int64).reshape(-1, 2)
+    m = len(edges)
+    return csr_graph(n = g.vcount(),
+                     sources = edges[:, 0],
+                     targets = edges[:, 1],
+                     base = g.es[base_cost] if base_cost is not None else np.ones(m),
+                     capacity = [float(c) for c in g.es[capacity]] if capacity is not None else np.zeros(m))
+
+def target_paths(G, sources, targets, weights = None, batch_size = 256, targeted = False):
+    """
+    Summary:
+        Find the shortest paths from each source to its targets, in the form of igraph's 
+        Graph.get_shortest_paths(output = 'epath'), from full searches (see csr_graph.shortest_path_trees()) or, 
+        if targeted, from searches bounded by a landmark radius (see csr_graph.target_trees()). The bound only 
+        pays when targets lie close to their source; with the OD tables of 1_data/taz_od/ it still settles 
+        nearly the whole network and is slower than a full search. 
+
+    Args:
+        G (csr_graph): the network
+        sources (list): the vertex ids from which to search
+        targets (list): per source, the vertex ids to find paths to
+        weights (np.array, optional): edge weights in stored order; defaults to G.cost
+        batch_size (int, optional): the number of sources searched together
+        targeted (bool, optional): whether to bound each search by its landmark radius
+
+    Returns:
+        list: per source, a list holding for each target the list of ids of the edges on its path, empty if the target is unreachable
+    """
+    paths = []
+    for i in range(0, len(sources), batch_size):
+        batch = sources[i:i + batch_size]
+        batch_targets = [np.asarray(t, dtype = np.int64) for t in targets[i:i + batch_size]]
+        if targeted:
+            dist, pred, settled = G.target_trees(batch, batch_targets, weights)
+        else:
+            dist, pred = G.shortest_path_trees(batch, weights)
+        lengths, edges = G.tree_paths(batch, pred, batch_targets)
+        edge_lists = np.split(edges, np.cumsum(lengths)[:-1]) if len(lengths) else []
+        start = 0
+        for t in batch_targets:
+            paths.append([e.tolist() for e in edge_lists[start:start + len(t)]])
+            start += len(t)
+    return paths
+
+def od_batches(od, n, batch_size):
+    """
+    Summary:
+        Split an OD dict into batches of origins with flattened demand arrays for csr_graph.tree_flows().
+
+    Args:
+        od (dict or demand.od_matrix): the OD dictionary, keyed according to vertex ids
+        n (int): the number of vertices of the network
+        batch_size (int): the number of origins per batch
+
+    Returns:
+        list: tuples (origins, demand_index, demand_flow, targets, None), where targets holds the destinations of each origin in batch order
+    """
+    origins = [o for o in od if len(od[o]) > 0]
+    batches = []
+    for i in range(0, len(origins), batch_size):
+        batch = origins[i:i + batch_size]
+        targets, flows = zip(*[demand.row_arrays(od, o) for o in batch])
+        targets = [np.asarray(t, dtype = np.int64) for t in targets]
+        rows = np.repeat(np.arange(len(batch)), [len(t) for t in targets])
+        batches.append((batch,
+                        rows * n + np.concatenate(targets),
+                        np.concatenate(flows),
+                        targets, 
+                        None))
+    return batches
+
+def origin_groups(g, G, od, by = 'street'):
+    """
+    Summary:
+        Group the origins of an OD dict so that each group needs a single shortest path search. 
+        
+        With by = 'street', origins with a single outgoing edge, such as connectors with their zero-cost transfer to the 
+        street layer, are grouped by the vertex that edge leads to and searched from it. Each origin's paths are its 
+        transfer edge followed by the group's paths, so routes match a search per origin up to tie-breaking. 
+        
+        Otherwise by names a vertex attribute, e.g. 'taz', and the origins sharing its value are searched from all at once 
+        (see csr_graph.group_trees()), treating them as one zone: each destination is reached from whichever origin of the 
+        group is closest to it, and trips between origins of the same group are not routed. 
+        
+        Origins that cannot be grouped form groups of their own. 
+
+    Args:
+        g (igraph.Graph()): the network, carrying the vertex attribute by
+        G (csr_graph): the network as built from g
+        od (dict or demand.od_matrix): the OD dictionary, keyed according to vertex ids
+        by (str, optional): 'street', or the vertex attribute by which to group
+
+    Returns:
+        list: per group, a tuple (roots, members, slots): the vertices searched from, the member origins, and the stored position 
+            of each member's edge to the root for 'street' groups, None otherwise
+    """
+    origins = sorted(o for o in od if len(od[o]) > 0)
+    groups = OrderedDict()
+    if by == 'street':
+        degree = np.diff(G.offsets)
+        for o in origins:
+            key = ('street', G.targets[G.offsets[o]]) if degree[o] == 1 else ('origin', o)
+            groups.setdefault(key, []).append(o)
+        return [(np.array([key[1]]), members, [G.offsets[o] for o in members] if key[0] == 'street' else None) 
+                for key, members in groups.items()]
+
+    values = g.vs[by]
+    for o in origins:
+        key = ('value', values[o]) if values[o] is not None else ('origin', o)
+        groups.setdefault(key, []).append(o)
+    return [(np.array(members), members, None) for members in groups.values()]
+
+def group_batches(G, od, groups, batch_size):
+    """
+    Summary:
+        Split origin groups into batches, as od_batches() does for origins. The demand of each group's members is summed 
+        by destination and routed from the group's roots; the batch also records how to split flows and routes back to 
+        the members. 
+
+    Args:
+        G (csr_graph): the network
+        od (dict or demand.od_matrix): the OD dictionary, keyed according to vertex ids
+        groups (list): groups as returned by origin_groups()
+        batch_size (int): the number of groups per batch
+
+    Returns:
+        list: tuples (roots, demand_index, demand_flow, targets, members), as in od_batches() but with the array of roots of each 
+            group in place of its origin, and where members is a dict of arrays over the members' OD entries: 'o', 'd' and 'flow'; 
+            'pos', the position of each entry's path among the group paths to targets (-1 for none); 'prefix', the id of the 
+            member's edge to the root that precedes the path (-1 for none); and 'slots' and 'totals', the stored positions of 
+            the members' edges to their roots with the demand each carries 
+    """
+    n = G.n
+    batches = []
+    for i in range(0, len(groups), batch_size):
+        batch = groups[i:i + batch_size]
+        targets, flows = [], []
+        o, d, f, pos, prefix, slots, totals = [], [], [], [], [], [], []
+        count = 0
+        for roots, members, member_slots in batch:
+            rows = [demand.row_arrays(od, a) for a in members]
+            dests = [np.asarray(ds, dtype = np.int64) for ds, fs in rows]
+            if member_slots is None:
+                routed = [np.ones(len(ds), dtype = bool) for ds in dests]
+            else:
+                # a connector's trips to itself do not leave it
+                routed = [ds != a for a, ds in zip(members, dests)]
+            group_d = np.concatenate([ds[r] for ds, r in zip(dests, routed)])
+            group_f = np.concatenate([fs[r] for (ds, fs), r in zip(rows, routed)])
+            unique, inverse = np.unique(group_d, return_inverse = True)
+            targets.append(unique)
+            flows.append(np.bincount(inverse, weights = group_f, minlength = len(unique)))
+
+            start = 0
+            for k, a in enumerate(members):
+                r = routed[k]
+                member_pos = np.repeat(-1, len(r))
+                member_pos[r] = count + inverse[start:start + r.sum()]
+                start += r.sum()
+                o.append(np.repeat(a, len(r)))
+                d.append(dests[k])
+                f.append(rows[k][1])
+                pos.append(member_pos)
+                if member_slots is None:
+                    prefix.append(np.repeat(-1, len(r)))
+                else:
+                    prefix.append(np.where(r, G.eid[member_slots[k]], -1))
+                    slots.append(member_slots[k])
+                    totals.append(rows[k][1][r].sum())
+            count += len(unique)
+
+        index = np.repeat(np.arange(len(batch)), [len(t) for t in targets]) * n + np.concatenate(targets)
+        batches.append(([roots for roots, members, member_slots in batch], 
+                        index, 
+                        np.concatenate(flows), 
+                        targets, 
+                        {'o' : np.concatenate(o), 
+                         'd' : np.concatenate(d), 
+                         'flow' : np.concatenate(f), 
+                         'pos' : np.concatenate(pos), 
+                         'prefix' : np.concatenate(prefix), 
+                         'slots' : np.array(slots, dtype = np.int64), 
+                         'totals' : np.array(totals, dtype = np.float64)}))
+    return batches
+
+def member_routes(members, lengths, edges):
+    """
+    Summary:
+        Split the paths of a batch of origin groups back into the routes of their members. 
+
+    Args:
+        members (dict): the member arrays of a batch, as returned by group_batches()
+        lengths (np.array): the number of edges of each group path, as returned by csr_graph.tree_paths()
+        edges (np.array): the edges of the group paths, concatenated
+
+    Returns:
+        np.array: the number of edges of each member route
+        np.array: the edges of the member routes, concatenated route by route
+    """
+    pos, prefix = members['pos'], members['prefix']
+    routed = pos >= 0
+    starts = np.cumsum(lengths) - lengths
+    body = np.where(routed, lengths[np.maximum(pos, 0)], 0)
+    lead = (routed & (prefix >= 0)).astype(np.int64)
+    member_lengths = body + lead
+    member_starts = np.cumsum(member_lengths) - member_lengths
+
+    out = np.empty(member_lengths.sum(), dtype = np.int32)
+    out[member_starts[lead > 0]] = prefix[lead > 0]
+    offset = np.arange(body.sum()) - np.repeat(np.cumsum(body) - body, body)
+    out[np.repeat(member_starts + lead, body) + offset] = edges[np.repeat(starts[np.maximum(pos, 0)], body) + offset]
+    return member_lengths, out
+
+def class_batches(ods, n, batch_size):
+    """
+    Summary:
+        Split the origins of several OD dicts (demand classes) into common batches, so that the shortest path trees of 
+        a batch can be loaded with the demand of every class.
+
+    Args:
+        ods (list): the OD dictionaries (dict or demand.od_matrix), keyed according to vertex ids
+        n (int): the number of vertices of the network
+        batch_size (int): the number of origins per batch
+
+    Returns:
+        list: tuples (origins, classes), where classes holds per OD dict a tuple (demand_index, demand_flow, targets) as in od_batches(), 
+            or None if the class has no demand from the batch's origins
+    """
+    origins = sorted(set(o for od in ods for o in od if len(od[o]) > 0))
+    batches = []
+    for i in range(0, len(origins), batch_size):
+        batch = origins[i:i + batch_size]
+        classes = []
+        for od in ods:
+            rows = [demand.row_arrays(od, o) if o in od else (np.zeros(0, dtype = np.int64), np.zeros(0)) for o in batch]
+            targets = [np.asarray(t, dtype = np.int64) for t, f in rows]
+            if sum(len(t) for t in targets) == 0:
+                classes.append(None)
+                continue
+            index = np.repeat(np.arange(len(batch)), [len(t) for t in targets]) * n + np.concatenate(targets)
+            classes.append((index, np.concatenate([f for t, f in rows]), targets))
+        batches.append((batch, classes))
+    return batches
+
+def route_classes(G, batches, members, weights, p, scale, stores = None):
+    """
+    Summary:
+        Route batches of origins once over a cost vector shared by several demand classes, and load each class's demand 
+        onto the same shortest path trees.
+
+    Args:
+        G (csr_graph): the network
+        batches (list): batches as returned by class_batches()
+        members (list): the classes routed over weights, as positions in the classes of each batch
+        weights (np.array): the edge costs shared by the members, in stored order
+        p (float): the increment being assigned
+        scale (float): the proportion of demand to assign
+        stores (list, optional): per class, a routes.route_store to which the class's routes are appended, or None
+
+    Returns:
+        dict: flow through each edge, in stored order, keyed by member
+    """
+    flows = {c : np.zeros(len(G.targets)) for c in members}
+    for origins, classes in batches:
+        loaded = [c for c in members if classes[c] is not None]
+        if not loaded:
+            continue
+        dist, pred = G.shortest_path_trees(origins, weights)
+        for c in loaded:
+            index, flow, targets = classes[c]
+            flows[c] += G.tree_flows(origins, pred, index, p * scale * flow)
+            if stores is not None and stores[c] is not None:
+                lengths, edges = G.tree_paths(origins, pred, targets)
+                stores[c].append(o = np.repeat(origins, [len(t) for t in targets]), 
+                                 d = np.concatenate(targets), 
+                                 p = p, 
+                                 flow = scale * flow, 
+                                 lengths = lengths, 
+                                 edges = edges)
+    return flows
+
+def shared_copy(x):
+    """
+    Summary:
+        Copy an array into shared memory.
+
+    Args:
+        x (np.array): the array to copy
+
+    Returns:
+        np.array: a copy of x backed by a multiprocessing.sharedctypes.RawArray
+    """
+    raw = RawArray(ctypes.c_byte, max(x.nbytes, 1))
+    y = np.frombuffer(raw, dtype = x.dtype)[:x.size].reshape(x.shape)
+    y[...] = x
+    return y
+
+def balanced_groups(od, groups, k):
+    """
+    Summary:
+        Split origin groups into k chunks with roughly equal numbers of destinations, as balanced_chunks() does for origins.
+
+    Args:
+        od (dict): the OD dictionary
+        groups (list): groups as returned by origin_groups()
+        k (int): the number of chunks
+
+    Returns:
+        list: k lists of groups
+    """
+    loads = [sum(len(od[o]) for o in members) for roots, members, slots in groups]
+    heap = [(0, i) for i in range(k)]
+    chunks = [[] for i in range(k)]
+    for j in sorted(range(len(groups)), key = lambda j : (-loads[j], j)):
+        load, i = heapq.heappop(heap)
+        chunks[i].append(groups[j])
+        heapq.heappush(heap, (load + loads[j], i))
+    return chunks
+
+def balanced_chunks(od, k):
+    """
+    Summary:
+        Split the origins of an OD dict into k chunks with roughly equal numbers of destinations, 
+        assigning origins greedily from the largest fan-out down to the least-loaded chunk.
+
+    Args:
+        od (dict): the OD dictionary
+        k (int): the number of chunks
+
+    Returns:
+        list: k OD dicts, each holding a subset of the origins of od
+    """
+    origins = sorted([o for o in od if len(od[o]) > 0], key = lambda o : (-len(od[o]), o))
+    heap = [(0, i) for i in range(k)]
+    chunks = [{} for i in range(k)]
+    for o in origins:
+        load, i = heapq.heappop(heap)
+        chunks[i][o] = od[o]
+        heapq.heappush(heap, (load + len(od[o]), i))
+    return chunks
+
+def route_batches(G, batches, p, scale, store = None, targeted = False):
+    """
+    Summary:
+        Route batches of origins over the current costs of G and load their demand.
+
+    Args:
+        G (csr_graph): the network
+        batches (list): batches as returned by od_batches() or group_batches()
+        p (float): the increment being assigned
+        scale (float): the proportion of demand to assign; edges are loaded with p * scale * demand
+        store (routes.route_store, optional): if supplied, every route is appended to the store with its OD flow, scale * demand
+        targeted (bool, optional): if True, stop each search once its destinations are settled (see csr_graph.target_trees()); 
+            ignored for trees grown from origin groups
+
+    Returns:
+        np.array: flow through each edge, in stored order
+        int: the number of tree vertices settled
+        int: the number of tree vertices in all trees; for targeted searches, the number of vertices times the number of origins
+    """
+    flow = np.zeros(len(G.targets))
+    settled, size = 0, 0
+    for b, (origins, index, demand, targets, members) in enumerate(batches):
+        if members is not None:
+            dist, pred = G.group_trees(origins)
+        elif targeted:
+            dist, pred, touched = G.target_trees(origins, targets)
+        else:
+            dist, pred = G.shortest_path_trees(origins)
+
+        if members is None and targeted:
+            settled += touched.sum()
+            size += len(origins) * G.n
+        else:
+            tree_size = (pred >= 0).sum() + len(origins)
+            settled += tree_size
+            size += tree_size
+
+        flow += G.tree_flows(origins, pred, index, p * scale * demand)
+        if members is not None:
+            flow += np.bincount(members['slots'], weights = p * scale * members['totals'], minlength = len(flow))
+        if store is not None and members is not None:
+            lengths, edges = member_routes(members, *G.tree_paths(origins, pred, targets))
+            store.append(o = members['o'], 
+                         d = members['d'], 
+                         p = p, 
+                         flow = scale * members['flow'], 
+                         lengths = lengths, 
+                         edges = edges)
+        elif store is not None:
+            lengths, edges = G.tree_paths(origins, pred, targets)
+            store.append(o = np.repeat(origins, [len(t) for t in targets]), 
+                         d = np.concatenate(targets), 
+                         p = p, 
+                         flow = scale * demand, 
+                         lengths = lengths, 
+                         edges = edges)
+    return flow, settled, size
+
+# -----------------------------------------------------------------------------
+# PARALLEL ROUTING
+# -----------------------------------------------------------------------------
+
+_worker = {}
+
+def _init_worker(G, chunks, stores):
+    _worker['G'] = G
+    _worker['chunks'] = chunks
+    _worker['stores'] = stores
+
+def _route_chunk(args):
+    k, p, scale, targeted = args
+    return route_batches(_worker['G'], _worker['chunks'][k], p, scale, _worker['stores'][k], targeted)
+
+class router:
+    '''
+    router routes the origins of an OD dict over a csr_graph, either serially or split into chunks
+    across a pool of worker processes. Workers are forked once, after the graph has been moved to
+    shared memory, and read the current costs of the graph on every call. Each chunk is routed into
+    its own flow array and the arrays are summed in chunk order, so results do not depend on
+    scheduling. If routes are kept, each chunk appends them to its own route store. If
+    origin groups are given (see origin_groups()), each group is searched once and its flows and
+    routes are split back to its member origins.
+    attributes:
+        self.G -- (csr_graph) the network
+        self.chunks -- (list) per chunk, the batches as returned by od_batches(), or by group_batches() if origins are grouped
+        self.stores -- (list) per chunk, a routes.route_store, or None if routes are not kept
+        self.targeted -- (bool) whether searches stop once their destinations are settled, see csr_graph.target_trees()
+        self.counters -- (list) per call of route(), the pair (vertices settled, vertices in all trees)
+        self.pool -- (multiprocessing.Pool) the worker pool, None when routing serially
+    '''
+    def __init__(self, G, od, processes = 1, batch_size = 256, route_file = None, groups = None, targeted = False):
+        self.G = G
+        self.targeted = targeted
+        self.pool = None
+        if processes > 1:
+            G.share()
+        if groups is not None:
+            self.chunks = [group_batches(G, od, chunk, batch_size) 
+                           for chunk in (balanced_groups(od, groups, processes) if processes > 1 else [groups])]
+        elif processes > 1:
+            self.chunks = [od_batches(chunk, G.n, batch_size) 
+                           for chunk in balanced_chunks(od, processes)]
+        else:
+            self.chunks = [od_batches(od, G.n, batch_size)]
+
+        if route_file is None:
+            self.stores = [None for chunk in self.chunks]
+        elif len(self.chunks) == 1:
+            self.stores = [routes.route_store(route_file)]
+        else:
+            self.stores = [routes.route_store(route_file + '_' + str(k)) 
+                           for k in range(len(self.chunks))]
+
+        self.counters = []
+
+        if processes > 1:
+            self.pool = Pool(processes, _init_worker, (G, self.chunks, self.stores))
+
+    def route(self, p, scale):
+        """
+        Summary:
+            Route every chunk over the current costs of self.G.
+
+        Args:
+            p (float): the increment being assigned
+            scale (float): the proportion of demand to assign
+
+        Returns:
+            np.array: flow through each edge, in stored order
+        """
+        tasks = [(k, p, scale, self.targeted) for k in range(len(self.chunks))]
+        if self.pool is None:
+            _init_worker(self.G, self.chunks, self.stores)
+            results = [_route_chunk(task) for task in tasks]
+        else:
+            results = self.pool.map(_route_chunk, tasks, chunksize = 1)
+
+        flow = np.zeros(len(self.G.targets))
+        settled, size = 0, 0
+        for chunk_flow, chunk_settled, chunk_size in results:
+            flow += chunk_flow
+            settled += chunk_settled
+            size += chunk_size
+        self.counters.append((settled, size))
+        return flow
+
+    def close(self):
+        """
+        Summary:
+            Shut down the worker pool, if any.
+
+        Returns:
+            None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,381 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import os
+import glob
+from collections import Mapping, MutableMapping
+from scipy.sparse import csr_matrix, coo_matrix
+from metro.utility import check_directory
+
+# the arrays of an od_matrix, as saved in a cache
+ARRAYS = ['labels', 'origins', 'indptr', 'destinations', 'flows']
+
+class od_matrix(Mapping):
+    '''
+    od_matrix holds an OD matrix in compressed sparse row form, with one row per origin
+    and float32 flows, so that large OD tables never pass through dicts of dicts. Vertices
+    are stored once, in labels, and referred to by index, so re-keying the matrix (e.g.
+    from multiplex node names to igraph vertex ids) only relabels that array. The matrix
+    also behaves like the read-only dict of dicts used elsewhere: od[o] is a row view
+    that behaves like a dict {d : flow}, and flows can be changed through it in place.
+    attributes:
+        self.labels -- (np.array) the key of each vertex used by the matrix
+        self.origins -- (np.array) for each row, the index in labels of its origin
+        self.indptr -- (np.array) the entries of row i are at positions indptr[i]:indptr[i + 1]
+        self.destinations -- (np.array) for each entry, the index in labels of its destination
+        self.flows -- (np.array) the flow of each entry, float32
+    '''
+    def __init__(self, labels, origins, indptr, destinations, flows):
+        self.labels = np.asarray(labels)
+        self.origins = np.asarray(origins, dtype = np.int32)
+        self.indptr = np.asarray(indptr, dtype = np.int64)
+        self.destinations = np.asarray(destinations, dtype = np.int32)
+        self.flows = np.asarray(flows, dtype = np.float32)
+        self._rows = None
+
+    def row_of(self, o):
+        """
+        Summary:
+            Find the row of an origin.
+
+        Args:
+            o: the key of the origin
+
+        Returns:
+            int: the row of o, or None if o has no row
+        """
+        if self._rows is None:
+            self._rows = {o : i for i, o in enumerate(self.labels[self.origins].tolist())}
+        return self._rows.get(o)
+
+    def __getitem__(self, o):
+        i = self.row_of(o)
+        if i is None:
+            raise KeyError(o)
+        return od_row(self, i)
+
+    def __contains__(self, o):
+        return self.row_of(o) is not None
+
+    def __iter__(self):
+        return iter(self.labels[self.origins].tolist())
+
+    def __len__(self):
+        return len(self.origins)
+
+    def keys(self):
+        return self.labels[self.origins].tolist()
+
+    def total(self):
+        """
+        Summary:
+            Sum all flows of the matrix.
+
+        Returns:
+            float: the total flow
+        """
+        return float(self.flows.sum(dtype = np.float64))
+
+    def re_key(self, key_map):
+        """
+        Summary:
+            Re-key the matrix according to a mapping of keys. The returned matrix shares its index and flow arrays with self.
+
+        Args:
+            key_map (dict): a dict in which keys are old labels and values are new labels
+
+        Returns:
+            od_matrix: the re-keyed matrix
+        """
+        labels = [key_map[label] for label in self.labels.tolist()]
+        return od_matrix(labels, self.origins, self.indptr, self.destinations, self.flows)
+
+    def subset(self, origins):
+        """
+        Summary:
+            Select the rows of some origins.
+
+        Args:
+            origins (list): the keys of the origins to keep
+
+        Returns:
+            od_matrix: a matrix holding copies of the selected rows
+        """
+        rows = np.array([self.row_of(o) for o in origins if o in self], dtype = np.int64)
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        positions = np.concatenate([np.arange(self.indptr[i], self.indptr[i + 1]) for i in rows] + [np.zeros(0, dtype = np.int64)])
+        return od_matrix(self.labels,
+                         self.origins[rows],
+                         np.concatenate(([0], np.cumsum(lengths))),
+                         self.destinations[positions],
+                         self.flows[positions])
+
+class od_row(MutableMapping):
+    '''
+    od_row is a dict-like view of one row of an od_matrix, keyed by destination. Setting the
+    flow of a destination writes through to the matrix. Destinations outside the row cannot
+    be added, except with a flow of 0, which is ignored; deleting a destination sets its flow to 0.
+    attributes:
+        self.matrix -- (od_matrix) the matrix
+        self.lo -- (int) the position of the row's first entry
+        self.hi -- (int) the position after the row's last entry
+    '''
+    def __init__(self, matrix, row):
+        self.matrix = matrix
+        self.lo = matrix.indptr[row]
+        self.hi = matrix.indptr[row + 1]
+        self._positions = None
+
+    def position(self, d):
+        if self._positions is None:
+            self._positions = {d : self.lo + k for k, d in enumerate(self.keys())}
+        return self._positions.get(d)
+
+    def __getitem__(self, d):
+        k = self.position(d)
+        if k is None:
+            raise KeyError(d)
+        return float(self.matrix.flows[k])
+
+    def __setitem__(self, d, flow):
+        k = self.position(d)
+        if k is not None:
+            self.matrix.flows[k] = flow
+        elif flow != 0:
+            raise KeyError('cannot add destination ' + str(d) + ' to an od_matrix row')
+
+    def __delitem__(self, d):
+        self[d] = 0
+
+    def __contains__(self, d):
+        return self.position(d) is not None
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return int(self.hi - self.lo)
+
+    def keys(self):
+        return self.matrix.labels[self.matrix.destinations[self.lo:self.hi]].tolist()
+
+    def values(self):
+        return self.matrix.flows[self.lo:self.hi].tolist()
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    def arrays(self):
+        """
+        Summary:
+            Return the row as arrays.
+
+        Returns:
+            np.array: the destination keys
+            np.array: the flows, as float64
+        """
+        return (self.matrix.labels[self.matrix.destinations[self.lo:self.hi]],
+                self.matrix.flows[self.lo:self.hi].astype(np.float64))
+
+def row_arrays(od, o):
+    """
+    Summary:
+        Return the destinations and flows of an origin as arrays, from an od_matrix or a dict of dicts.
+
+    Args:
+        od (od_matrix or dict): the OD matrix
+        o: the key of the origin
+
+    Returns:
+        np.array: the destination keys
+        np.array: the flows, as float64
+    """
+    row = od[o]
+    if isinstance(row, od_row):
+        return row.arrays()
+    return (np.fromiter(row.keys(), dtype = np.int64, count = len(row)),
+            np.fromiter(row.values(), dtype = np.float64, count = len(row)))
+
+def merge_od(od, key_map, loops = False):
+    """
+    Summary:
+        Re-key an OD matrix according to a mapping of keys that may send several keys to the same one, summing
+        the flows of the origin-destination pairs that are merged.
+
+    Args:
+        od (od_matrix or dict): the OD matrix
+        key_map (dict): a dict in which keys are old labels and values are new labels; labels missing from it are kept
+        loops (bool, optional): whether to keep the flows of pairs whose origin and destination are merged into one key
+
+    Returns:
+        od_matrix: the re-keyed matrix, with one row per new origin
+    """
+    origins = [o for o in od if len(od[o]) > 0]
+    rows = [row_arrays(od, o) for o in origins]
+    old_o = np.repeat(np.arange(len(origins)), [len(d) for d, f in rows])
+    old_d = np.concatenate([d for d, f in rows] + [np.zeros(0, dtype = np.int64)])
+    flows = np.concatenate([f for d, f in rows] + [np.zeros(0)])
+
+    o_keys = [key_map.get(o, o) for o in origins]
+    d_keys = [key_map.get(d, d) for d in old_d.tolist()]
+    labels = sorted(set(o_keys) | set(d_keys))
+    index = {key : i for i, key in enumerate(labels)}
+    o = np.array([index[key] for key in o_keys], dtype = np.int64)[old_o]
+    d = np.array([index[key] for key in d_keys], dtype = np.int64)
+    if not loops:
+        o, d, flows = o[o != d], d[o != d], flows[o != d]
+
+    F = coo_matrix((flows, (o, d)), shape = (len(labels), len(labels))).tocsr()
+    F.sum_duplicates()
+    F.sort_indices()
+    nonempty = np.nonzero(np.diff(F.indptr))[0]
+    return od_matrix(labels,
+                     nonempty,
+                     np.concatenate(([0], F.indptr[nonempty + 1])),
+                     F.indices,
+                     F.data)
+
+def spread_od(F, tract_of, threshold = 1e-11):
+    """
+    Summary:
+        Spread tract-to-tract flows evenly over the connectors of each tract, as the product of sparse
+        tract-to-connector matrices with the tract flows. Each connector pair of tracts (s, t) receives
+        F[s, t] / (n_s * n_t), where n_s and n_t are their numbers of connectors.
+
+    Args:
+        F (scipy.sparse matrix): tract flows, indexed by tract number
+        tract_of (np.array): the tract number of each connector
+        threshold (float, optional): flows below threshold are dropped
+
+    Returns:
+        scipy.sparse.csr_matrix: connector flows, indexed by connector number
+    """
+    n = len(tract_of)
+    counts = np.bincount(tract_of, minlength = F.shape[0]).astype(np.float64)
+    T = csr_matrix((1 / counts[tract_of], (tract_of, np.arange(n))), shape = (F.shape[0], n))
+    od = (T.T.tocsr().dot(F.tocsr())).dot(T).tocsr()
+    od.data[od.data < threshold] = 0
+    od.eliminate_zeros()
+    od.sort_indices()
+    return od
+
+def cache_prefix(od_file, connectors, cache_dir = None, **options):
+    """
+    Summary:
+        Name the cache of an OD table. The name records the size and modification time of the table and a hash of
+        the connectors and reading options, so that a cache is only used for the same table read in the same way.
+
+    Args:
+        od_file (str): the path of the OD table
+        connectors (dict): the tract of each connector, keyed by connector
+        cache_dir (str, optional): the cache directory; defaults to a directory 'cache' next to od_file
+        **options: the other options with which the table is read
+
+    Returns:
+        str: the path prefix of the cache files
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(od_file), 'cache')
+    stat = os.stat(od_file)
+    digest = hashlib.md5(repr((sorted(connectors.items()), sorted(options.items())))).hexdigest()[:12]
+    return os.path.join(cache_dir, os.path.basename(od_file) + '_%d_%d_%s' % (stat.st_size, int(stat.st_mtime * 1e6), digest))
+
+def save_cache(od, prefix):
+    """
+    Summary:
+        Save an od_matrix as one .npy file per array. Files are written under temporary names and renamed, flows last,
+        so the presence of the flows file marks a complete cache. Older caches of the same table, read with the same connectors
+        and options, are removed; caches read in other ways are kept.
+
+    Args:
+        od (od_matrix): the matrix to save
+        prefix (str): the path prefix, as returned by cache_prefix()
+
+    Returns:
+        None
+    """
+    check_directory(os.path.dirname(prefix) or '.')
+    stem, _, _, digest = prefix.rsplit('_', 3)
+    for f in glob.glob(stem + '_*_*_' + digest + '.*.npy'):
+        key = f[len(stem) + 1:].split('.', 1)[0].split('_')
+        if len(key) == 3 and key[2] == digest and not f.startswith(prefix + '.'):
+            os.remove(f)
+    for name in ARRAYS:
+        tmp = prefix + '.' + name + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, getattr(od, name))
+        os.rename(tmp, prefix + '.' + name + '.npy')
+
+def load_cache(prefix):
+    """
+    Summary:
+        Load an od_matrix saved by save_cache(), memory-mapping its index and flow arrays. Flows are mapped copy-on-write,
+        so they can be changed in memory without touching the cache. Labels, which may be python objects, are read in full.
+
+    Args:
+        prefix (str): the path prefix, as returned by cache_prefix()
+
+    Returns:
+        od_matrix: the matrix, or None if there is no complete cache
+    """
+    if not os.path.exists(prefix + '.flows.npy'):
+        return None
+    modes = {'labels' : None, 'flows' : 'c'}
+    arrays = {name : np.load(prefix + '.' + name + '.npy', mmap_mode = modes.get(name, 'r')) for name in ARRAYS}
+    return od_matrix(**arrays)
+
+def read_od(od_file, connectors, sep = ' ', chunksize = 2 ** 18, cache = True, cache_dir = None, **kwargs):
+    """
+    Summary:
+        Read an OD table of tract flows, with columns 'o', 'd' and 'flow', and spread each tract's flows over
+        the connectors in that tract. The file is read in chunks; tracts without connectors are ignored, and
+        repeated tract pairs are summed.
+
+    Args:
+        od_file (str): the path of the OD table
+        connectors (dict): the tract of each connector, keyed by connector (e.g. multiplex node name)
+        sep (str, optional): the separator used in the OD table
+        chunksize (int, optional): the number of rows read at a time
+        cache (bool, optional): if True, keep a binary copy of the result (see save_cache()) and load it instead of the table
+            as long as the table's size and modification time, the connectors and the options are unchanged
+        cache_dir (str, optional): the cache directory; defaults to a directory 'cache' next to od_file
+        **kwargs: additional arguments passed to pd.read_table
+
+    Returns:
+        od_matrix: the OD matrix between connectors
+    """
+    if cache:
+        prefix = cache_prefix(od_file, connectors, cache_dir, sep = sep, **kwargs)
+        od = load_cache(prefix)
+        if od is None:
+            od = read_od(od_file, connectors, sep = sep, chunksize = chunksize, cache = False, **kwargs)
+            save_cache(od, prefix)
+        return od
+
+    labels = np.array(connectors.keys())
+    tract_ids = np.array([connectors[c] for c in connectors.keys()], dtype = np.int64)
+    tracts, tract_of = np.unique(tract_ids, return_inverse = True)
+
+    def tract_number(x):
+        i = np.minimum(np.searchsorted(tracts, x), len(tracts) - 1)
+        return i, tracts[i] == x
+
+    rows, cols, flows = [], [], []
+    for chunk in pd.read_table(od_file, sep = sep, chunksize = chunksize, **kwargs):
+        o, o_found = tract_number(chunk['o'].values.astype(np.int64))
+        d, d_found = tract_number(chunk['d'].values.astype(np.int64))
+        found = o_found & d_found
+        rows.append(o[found])
+        cols.append(d[found])
+        flows.append(chunk['flow'].values[found].astype(np.float64))
+
+    F = coo_matrix((np.concatenate(flows), (np.concatenate(rows), np.concatenate(cols))),
+                   shape = (len(tracts), len(tracts)))
+    od = spread_od(F, tract_of)
+
+    nonempty = np.nonzero(np.diff(od.indptr))[0]
+    return od_matrix(labels,
+                     nonempty,
+                     np.concatenate(([0], od.indptr[nonempty + 1])),
+                     od.indices,
+                     od.data)
@@ -2,7 +2,16 @@ import pandas as pd
 import numpy as np
 import time
 from collections import defaultdict
+from itertools import chain
 import os 
+import math
+import hashlib
+import csr
+import cch
+import costs
+import routes
+import demand
+import checkpoint as checkpoints
 
 def gradient_component(base, flow, capacity, a, b):
     """
@@ -19,7 +28,24 @@ def gradient_component(base, flow, capacity, a, b):
     Returns:
         float: the gradient component 
     """
-    return BPR(base, flow, capacity, a, b) - base + base * a * b * (1.0 * flow / capacity) ** b
+    return costs.gradient(base, flow, capacity, a, b)
+
+def bpr_parameters(es, a, b):
+    """
+    Summary:
+        Expand the BPR parameters a and b into per-edge values for an edge sequence. 
+    
+    Args:
+        es (igraph edge sequence): the edges, carrying a 'layer' attribute if a or b is a dict 
+        a (float or dict): BPR parameter, or a dict of BPR parameters keyed by layer 
+        b (float or dict): BPR parameter, or a dict of BPR parameters keyed by layer 
+    
+    Returns:
+        tuple: a and b, each a float or an np.array with one value per edge. Layers missing from a dict get the standard parameters.  
+    """
+    layers = es['layer'] if isinstance(a, dict) or isinstance(b, dict) else None
+    return (costs.edge_parameters(a, layers, costs.BPR_A), 
+            costs.edge_parameters(b, layers, costs.BPR_B))
 
 def compute_gradient(base_attr, flow_attr, capacity_attr, a, b, es):
     """
@@ -30,91 +56,93 @@ def compute_gradient(base_attr, flow_attr, capacity_attr, a, b, es):
         base (float): the base cost of the edge, usually free_flow_time_m
         flow (float): the flow through the edge
         capacity (float): the capacity of the edge, usually capacity
-        a (float): BPR parameter
-        b (float): BPR parameter
+        a (float or dict): BPR parameter, or a dict of BPR parameters keyed by layer
+        b (float or dict): BPR parameter, or a dict of BPR parameters keyed by layer
         es (igraph edge sequence): the sequence of edges over which to compute 
     
     Returns:
         list: a list of gradient components (floats) 
     """
-    es['gradient'] = [gradient_component(e[base_attr], 
-                                         e[flow_attr], 
-                                         e[capacity_attr], a, b) for e in es]
+    a, b = bpr_parameters(es, a, b)
+    es['gradient'] = list(costs.gradient(es[base_attr], 
+                                         es[flow_attr], 
+                                         [float(c) for c in es[capacity_attr]], a, b))
 
-def summary_constructor(es, base_cost):
+def make_details_df(route_table, es, base_cost, metrics = None):
     """
     Summary:
-        Construct a function to return routewise summaries over the edge sequence es. 
+        Summarise every route of a route store straight from its edge buffers, as sparse products of the route-edge incidence matrix with edge attribute vectors. 
     
     Args:
-        es (igraph edge sequence): the edge sequence containing attributes to summarise 
-        base_cost (str): the attribute containing the base cost per edge, usually free_flow_time_m 
-    
-    Returns:
-        function: computes path summaries when supplied with a path consisting of elements of es. 
-    """
-    def get_path_summary(path):
-        edges = eval(path)
-        congested_time_m = sum([es[e]['congested_time_m'] for e in edges])
-        uniform_time_m = sum([es[e]['uniform_time_m'] for e in edges])
-        free_flow_time_m = sum([es[e]['free_flow_time_m'] for e in edges])
-        dist_km = sum([es[e]['dist_km'] for e in edges])
-        base = sum([es[e][base_cost] for e in edges])
-        weighted_capacity = (1.0 * sum([es[e]['dist_km']*es[e]['capacity'] 
-                             for e in edges]))
-        weighted_flow = (1.0 * sum([es[e]['dist_km']*es[e]['flow'] 
-                         for e in edges]))
-        gamma = [weighted_flow / weighted_capacity if weighted_capacity > 0 else np.nan][0]
-        gradient = (1.0 * sum([es[e]['gradient'] for e in edges]))
-        return (congested_time_m, uniform_time_m, free_flow_time_m, dist_km, base, gamma, gradient)
-    return get_path_summary
-
-def make_details_df(df, es, base_cost):
-    """
-    Summary:
-        Apply a path summary function over the rows of a dataframe containing paths. 
-    
-    Args:
-        df (pd.DataFrame): contains a column called 'path' containing elements of es 
-        es (igraph edge sequence): the edge sequence containing edge attributes 
+        route_table (dict): the columns of a route store, as returned by routes.route_store.load() 
+        es (igraph edge sequence): the edge sequence containing edge attributes, indexed by the store's edge ids 
         base_cost (str): the attribute containing the base cost, usually free_flow_time_m 
+        metrics (dict, optional): additional route metrics, keyed by column name. Each value is a function that takes es and returns one value per edge, to be summed along each route. Example:
+
+            metrics = {'metro_km' : lambda es : np.array(es['dist_km']) * (np.array(es['layer']) == 'metro'),
+                       'transfers' : lambda es : np.array(es['layer']) == 'metro--streets'}
     
     Returns:
-        pd.DataFrame: a dataframe with summary measures. The path attribute is deleted, since it takes large amounts of memory.  
+        pd.DataFrame: a dataframe with one row of summary measures per route.  
     """
-    get_path_summary = summary_constructor(es, base_cost)
-    df['congested_time_m'], df['uniform_time_m'], df['free_flow_time_m'], df['dist_km'], df['base_cost'], df['gamma'], df['gradient'] = zip(*df['path'].map(get_path_summary))
-    del df['path']
-    return df[['o', 'd', 'p', 'flow', 'dist_km', 'uniform_time_m', 'free_flow_time_m', 'congested_time_m', 'base_cost', 'gamma', 'gradient']]
+    def edge_attr(attr):
+        return np.array(es[attr], dtype = float)
+
+    if metrics is None:
+        metrics = {}
+
+    cols = ['congested_time_m', 'uniform_time_m', 'free_flow_time_m', 'dist_km', 'gradient']
+    extra = sorted(metrics.keys())
+    dist_km = edge_attr('dist_km')
+    X = np.column_stack([edge_attr(col) for col in cols] + 
+                        [edge_attr(base_cost), 
+                         dist_km * edge_attr('capacity'), 
+                         dist_km * edge_attr('flow')] + 
+                        [np.asarray(metrics[col](es), dtype = float) for col in extra])
+    S = routes.route_metrics(route_table, X)
+
+    df = pd.DataFrame({'o' : route_table['o'], 
+                       'd' : route_table['d'], 
+                       'p' : route_table['p'], 
+                       'flow' : route_table['flow']})
+    for k, col in enumerate(cols + ['base_cost']):
+        df[col] = S[:, k]
+
+    weighted_capacity, weighted_flow = S[:, len(cols) + 1], S[:, len(cols) + 2]
+    gamma = np.empty(len(df))
+    gamma.fill(np.nan)
+    np.divide(weighted_flow, weighted_capacity, out = gamma, where = weighted_capacity > 0)
+    df['gamma'] = gamma
+
+    for k, col in enumerate(extra):
+        df[col] = S[:, len(cols) + 3 + k]
+
+    return df[['o', 'd', 'p', 'flow', 'dist_km', 'uniform_time_m', 'free_flow_time_m', 'congested_time_m', 'base_cost', 'gamma', 'gradient'] + extra]
 
 def agg_df(df):
     """
     Summary:
-        Aggregate a dataframe by origin and destination, weighting by flows between them. 
+        Aggregate a dataframe by origin and destination, weighting each row by its increment p, as one sparse product. 
     
     Args:
-        df (pandas.DataFrame): the df to aggregate 
+        df (pandas.DataFrame): the df to aggregate, with columns 'o', 'd' and 'p' 
     
     Returns:
         pandas.DataFrame: the aggregated df, grouped by 'o' and 'd'.  
     """
-    cols = ['flow', 
-            'dist_km', 
-            'uniform_time_m',
-            'free_flow_time_m', 
-            'congested_time_m', 
-            'base_cost',
-            'gamma', 
-            'gradient']
+    cols = [col for col in df.columns if col not in ['o', 'd', 'p']]
 
-    for col in cols:
-        df[col] = df[col] * df.p
-    f = {col : sum for col in cols}
-    
-    agged = df.groupby(["o", "d"]).agg(f)
+    # like a pandas groupby sum, missing values count as zero
+    values = df[cols].values.astype(float)
+    values[np.isnan(values)] = 0
+
+    o, d, A = routes.od_aggregation(df.o.values, df.d.values, df.p.values)
+    agged = pd.DataFrame(A.dot(values), 
+                         columns = cols, 
+                         index = pd.MultiIndex.from_arrays([o, d], names = ['o', 'd']))
     
-    agged['o'] = agged.index.get_level_values('o')
-    agged['d'] = agged.index.get_level_values('d')    
+    agged['o'] = o
+    agged['d'] = d
     
     return agged
 
@@ -134,10 +162,10 @@ def BPR(base, flow, capacity, a, b):
     Returns:
         float: the congested travel time through the edge 
     """
-    return base * (1 + a * (1.0 * flow / capacity) ** b)
+    return costs.bpr(base, flow, capacity, a, b)
 
     
-def ITA(g, od, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.15, b = 4., scale = .25, details = False):
+def ITA(g, od, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.15, b = 4., scale = .25, details = False, route_file = '3_throughput/routes', route_metrics = None, checkpoint = None, resume = False):
     """
     Summary: 
         Run Iterated Traffic Assignment on a network. 
@@ -147,29 +175,47 @@ def ITA(g, od, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.1
         od (dict): the OD dictionary, keyed according to vertices of g
         base_cost (str, optional): attribute containing base cost per edge, usually 'free_flow_time_m' 
         P (list, optional): the iterations in which to conduct assignment. Must add to 1. 
-        a (float, optional): BPR parameter
-        b (float, optional): BPR parameter
+        a (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        b (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
         scale (float, optional): the proportion of flow to assign
-        details (bool, optional): whether to supply a summary data frame with routewise metrics as a return value. VERY computationally expensive. This function should run in roughly 12-15 minutes if details = False, but closer to 2.5 hours if details = True. 
+        details (bool, optional): whether to supply a summary data frame with routewise metrics as a return value. Routes are kept in a binary route store (see metro.routes) while assigning. This function should run in roughly 12-15 minutes if details = False. 
+        route_file (str, optional): path prefix of the route store used when details = True; its files are deleted once summarised. 
+        route_metrics (dict, optional): additional route metrics for details, see make_details_df(). 
+        checkpoint (str, optional): a .npz file to which flows, costs, the increment index and the route store offsets are saved after each increment; it is deleted once the assignment completes. 
+        resume (bool, optional): if True, continue from checkpoint, if it exists and was written by the same assignment (same network, demand, P, scale and details), rather than starting over. 
 
     Returns:
         df: only if details = True, returns a dataframe summarising route information 
     """
-    import time 
-    
-
-    columns = ['o', 'd', 'p', 'flow', 'path']
     flow_dict = defaultdict(int)
 
     es = g.es
     
     es['flow'] = 0
     es['congested_time_m'] = list(es[base_cost])
+
+    base = np.array(es[base_cost], dtype = float)
+    capacity = np.array([float(c) for c in es['capacity']])
+    a_e, b_e = bpr_parameters(es, a, b)
+
+    stores = [routes.route_store(route_file) if details else None]
+    store = stores[0]
+    signature = assignment_signature(base, capacity, a_e, b_e, g.vcount(), od, P, scale, stores)
+    state = restore(checkpoint, signature, stores) if resume else None
+    done = 0
+    if state is not None:
+        done = int(state['increment'])
+        flow_dict.update(zip(np.nonzero(state['flow'])[0], state['flow'][state['flow'] != 0]))
+        es['flow'] = list(state['flow'])
+        es['congested_time_m'] = list(state['cost'])
+        print 'resuming after increment ' + str(done)
+    elif details:
+        store.remove()
     
-    j = 0
-    for p in P: 
+    for k, p in enumerate(P): 
+        if k < done:
+            continue
         start = time.clock()
-        paths_list = pd.DataFrame(columns = columns)
         for o in od:
             ds = od[o]
             if len(ds) > 0:
@@ -187,29 +233,22 @@ def ITA(g, od, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.1
                             flow_dict[e] += p * scale * flow
 
 
-                # Update paths list
+                # Update route store
                 if details:
-                    update_piece = [{'o' : o, 
-                    'd' : targets[i], 
-                    'p' : p,
-                    'flow' : scale * od[o][targets[i]], 
-                    'path' : str(paths[i])} for i in range(len(targets))]
-                    update_piece = pd.DataFrame(update_piece)
-                    paths_list = paths_list.append(update_piece)
+                    store.append(o = np.repeat(o, len(targets)), 
+                                 d = targets, 
+                                 p = p, 
+                                 flow = [scale * od[o][t] for t in targets], 
+                                 lengths = [len(path) for path in paths], 
+                                 edges = np.fromiter(chain.from_iterable(paths), dtype = np.int32))
                 
 
         # Assign the flows to the graph
-        for key in flow_dict:
-            es[key]['flow'] = flow_dict[key]
-            es[key]['congested_time_m'] = BPR(base = es[key][base_cost], 
-                                    flow = es[key]['flow'], 
-                                    capacity = float(es[key]['capacity']),
-                                    a = a,
-                                    b = b)
-        if details:
-            paths_list.to_csv('3_throughput/paths_list_' + str(j) + '.csv')
-            j += 1
-            del paths_list
+        flow = np.zeros(len(es))
+        flow[flow_dict.keys()] = flow_dict.values()
+        es['flow'] = list(flow)
+        es['congested_time_m'] = list(costs.bpr(base, flow, capacity, a_e, b_e))
+        save_checkpoint(checkpoint, signature, k + 1, flow, np.array(es['congested_time_m']), stores)
         time_taken = str(round((time.clock() - start) / 60.0, 1)) + 'm'
         print 'assignment for p = ' + str(p) + ' completed in ' + time_taken
         
@@ -217,20 +256,452 @@ def ITA(g, od, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.1
     compute_gradient('free_flow_time_m', 'flow', 'capacity', a, b, es)
     
     # Compute details
+    df = read_details(g, stores, base_cost, route_metrics) if details else None
+    checkpoints.remove(checkpoint)
+    return df
+
+def ITA_csr(g, od, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.15, b = 4., scale = .25, details = False, batch_size = 256, processes = 1, route_file = '3_throughput/routes', route_metrics = None, checkpoint = None, resume = False, group = None, targeted = False, hierarchy = False):
+    """
+    Summary: 
+        Run Iterated Traffic Assignment on a network held as compressed sparse row arrays (see metro.csr). 
+        Origins are routed in batches and flows are accumulated over whole shortest path trees with array operations, 
+        rather than edge by edge through igraph attributes. Results match ITA() up to tie-breaking between equal-cost paths. 
+    
+    Args:
+        g (igraph.Graph()): the network on which to run ITA 
+        od (dict): the OD dictionary, keyed according to vertices of g
+        base_cost (str, optional): attribute containing base cost per edge, usually 'free_flow_time_m' 
+        P (list, optional): the iterations in which to conduct assignment. Must add to 1. 
+        a (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        b (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        scale (float, optional): the proportion of flow to assign
+        details (bool, optional): whether to supply a summary data frame with routewise metrics as a return value. Routes are kept in binary route stores (see metro.routes) while assigning. 
+        batch_size (int, optional): the number of origins routed together; memory use per process grows with batch_size times the number of vertices. 
+        processes (int, optional): the number of worker processes. With processes > 1 the origins are split into chunks balanced by destination count, routed in parallel over a shared-memory copy of the graph, and their flows summed in a fixed order. 
+        route_file (str, optional): path prefix of the route store used when details = True, suffixed by chunk number when processes > 1; its files are deleted once summarised. 
+        route_metrics (dict, optional): additional route metrics for details, see make_details_df(). 
+        checkpoint (str, optional): a .npz file to which flows, costs, the increment index and the route store offsets are saved after each increment; it is deleted once the assignment completes. 
+        resume (bool, optional): if True, continue from checkpoint, if it exists and was written by the same assignment (same network, demand, P, scale and details), rather than starting over. 
+        group (str, optional): if given, search once per group of origins rather than once per origin, see csr.origin_groups(). 'street' groups connectors by the street vertex they transfer to, which leaves routes unchanged up to tie-breaking; a vertex attribute such as 'taz' treats the connectors of each tract as one zone, routing each trip from the tract's connector closest to its destination. 
+        targeted (bool, optional): if True, bound each origin's search by the distance to its farthest destination through a landmark (see csr.csr_graph.target_trees()), rather than settling the whole network. The share of vertices settled in each increment is printed and kept in the graph attribute g['settled']. Ignored with group. 
+        hierarchy (bool, optional): if True, compute shortest path trees with a customizable contraction hierarchy (see metro.cch), customized to the congested costs of each increment, rather than with scipy's Dijkstra. The elimination order of the network is cached in cch.CACHE_DIR. Ignored with targeted. 
+
+    Returns:
+        df: only if details = True, returns a dataframe summarising route information 
+    """
+    G = csr.csr_from_igraph(g, base_cost)
+    if hierarchy:
+        G.hierarchy = cch.hierarchy_of(G)
+    groups = None
+    if group is not None:
+        groups = csr.origin_groups(g, G, od, group)
+        print 'routing ' + str(sum(len(members) for roots, members, slots in groups)) + ' origins in ' + str(len(groups)) + ' groups'
+    a_e, b_e = [G.from_edge_order(x) for x in bpr_parameters(g.es, a, b)]
+    R = csr.router(G, od, 
+                   processes = processes, 
+                   batch_size = batch_size, 
+                   route_file = route_file if details else None, 
+                   groups = groups, 
+                   targeted = targeted)
+
+    signature = assignment_signature(G.to_edge_order(G.base), G.to_edge_order(G.capacity), 
+                                     G.to_edge_order(a_e), G.to_edge_order(b_e), G.n, od, P, scale, R.stores)
+    state = restore(checkpoint, signature, R.stores) if resume else None
+    done = 0
+    if state is not None:
+        done = int(state['increment'])
+        G.flow[:] = G.from_edge_order(state['flow'])
+        G.cost[:] = G.from_edge_order(state['cost'])
+        print 'resuming after increment ' + str(done)
+    elif details:
+        for store in R.stores:
+            store.remove()
+
+    try:
+        for k, p in enumerate(P): 
+            if k < done:
+                continue
+            start = time.time()
+            G.flow += R.route(p, scale)
+
+            # Update congested costs in place, so that workers see them
+            G.cost[:] = costs.bpr(G.base, G.flow, G.capacity, a_e, b_e)
+            save_checkpoint(checkpoint, signature, k + 1, 
+                            G.to_edge_order(G.flow), G.to_edge_order(G.cost), R.stores)
+            time_taken = str(round((time.time() - start) / 60.0, 1)) + 'm'
+            print 'assignment for p = ' + str(p) + ' completed in ' + time_taken
+            if targeted and group is None:
+                settled, size = R.counters[-1]
+                print '    settled ' + str(round(100. * settled / max(size, 1), 1)) + '% of vertices'
+    finally:
+        R.close()
+
+    if targeted and group is None:
+        g['settled'] = [float(settled) / max(size, 1) for settled, size in R.counters]
+
+    es = g.es
+    es['flow'] = list(G.to_edge_order(G.flow))
+    es['congested_time_m'] = list(G.to_edge_order(G.cost))
+
+    compute_gradient('free_flow_time_m', 'flow', 'capacity', a, b, es)
+
+    df = read_details(g, R.stores, base_cost, route_metrics) if details else None
+    checkpoints.remove(checkpoint)
+    return df
+
+def ITA_classes(g, ods, base_cost = 'free_flow_time_m', P = [0.4, 0.3, 0.2, 0.1], a = 0.15, b = 4., scale = .25, details = False, batch_size = 256, route_file = '3_throughput/routes', route_metrics = None):
+    """
+    Summary: 
+        Run Iterated Traffic Assignment for several demand classes at once, e.g. the OD tables of several scenarios. Each class 
+        is assigned on its own, as by ITA_csr(), with its own flows and costs, but in every increment the classes whose costs 
+        are identical share their shortest path trees: each origin's tree is computed once and every such class's demand is 
+        loaded onto it. All classes route over the base costs in the first increment, so that increment costs about as much 
+        as for a single class. 
+    
+    Args:
+        g (igraph.Graph()): the network on which to run ITA 
+        ods (list): the OD dictionaries of the classes, each keyed according to vertices of g
+        base_cost (str, optional): attribute containing base cost per edge, usually 'free_flow_time_m' 
+        P (list, optional): the iterations in which to conduct assignment. Must add to 1. 
+        a (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        b (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        scale (float, optional): the proportion of flow to assign
+        details (bool, optional): whether to return a summary data frame with routewise metrics per class, as ITA_csr() does. 
+        batch_size (int, optional): the number of origins routed together. 
+        route_file (str, optional): path prefix of the route stores used when details = True, suffixed by class number. 
+        route_metrics (dict, optional): additional route metrics for details, see make_details_df(). 
+
+    Returns:
+        np.array: the flow through each edge, one row per class, indexed by edge id 
+        np.array: the congested cost of each edge, one row per class, indexed by edge id 
+        list: only if details = True, a dataframe summarising route information per class; otherwise None 
+    """
+    G = csr.csr_from_igraph(g, base_cost)
+    a_e, b_e = [G.from_edge_order(x) for x in bpr_parameters(g.es, a, b)]
+    batches = csr.class_batches(ods, G.n, batch_size)
+    stores = [routes.route_store(route_file + '_' + str(c)) if details else None for c in range(len(ods))]
+    for store in stores:
+        if store is not None:
+            store.remove()
+
+    flows = [np.zeros(len(G.base)) for od in ods]
+    cost = [G.base.copy() for od in ods]
+    for p in P:
+        start = time.time()
+
+        # classes with identical costs share their trees
+        groups = []
+        for c in range(len(ods)):
+            for group in groups:
+                if np.array_equal(cost[group[0]], cost[c]):
+                    group.append(c)
+                    break
+            else:
+                groups.append([c])
+
+        for group in groups:
+            group_flows = csr.route_classes(G, batches, group, cost[group[0]], p, scale, stores)
+            for c in group:
+                flows[c] += group_flows[c]
+
+        for c in range(len(ods)):
+            cost[c] = costs.bpr(G.base, flows[c], G.capacity, a_e, b_e)
+        time_taken = str(round((time.time() - start) / 60.0, 1)) + 'm'
+        print 'assignment for p = ' + str(p) + ' completed in ' + time_taken + ', ' + \
+              str(len(groups)) + ' cost vector(s) for ' + str(len(ods)) + ' classes'
+
+    flows = np.array([G.to_edge_order(x) for x in flows])
+    cost = np.array([G.to_edge_order(x) for x in cost])
+
+    dfs = None
+    if details:
+        es = g.es
+        dfs = []
+        for c in range(len(ods)):
+            es['flow'] = list(flows[c])
+            es['congested_time_m'] = list(cost[c])
+            compute_gradient('free_flow_time_m', 'flow', 'capacity', a, b, es)
+            dfs.append(read_details(g, [stores[c]], base_cost, route_metrics))
+    return flows, cost, dfs
+
+def array_digest(*arrays):
+    """
+    Summary:
+        Hash arrays into a number that a float64 holds exactly: the first 48 bits of the md5 digest of their float64 values. 
+    
+    Args:
+        *arrays (np.array or float): the arrays 
+    
+    Returns:
+        int: the digest 
+    """
+    h = hashlib.md5()
+    for x in arrays:
+        x = np.ascontiguousarray(x, dtype = np.float64)
+        h.update(str(x.shape))
+        h.update(x.tobytes())
+    return int(h.hexdigest()[:12], 16)
+
+def od_digest(od):
+    """
+    Summary:
+        Hash an OD matrix, origin by origin in sorted order and destination by destination in sorted order, so that two
+        matrices holding the same flows between the same pairs get the same digest however they were built. 
+    
+    Args:
+        od (od_matrix or dict): the OD matrix 
+    
+    Returns:
+        int: the digest, see array_digest() 
+    """
+    h = hashlib.md5()
+    for o in sorted(od):
+        targets, flows = demand.row_arrays(od, o)
+        order = np.argsort(targets, kind = 'mergesort')
+        h.update(repr((o, targets[order].tolist())))
+        h.update(np.ascontiguousarray(flows[order], dtype = np.float64).tobytes())
+    return int(h.hexdigest()[:12], 16)
+
+def assignment_signature(base, capacity, a, b, n, od, P, scale, stores):
+    """
+    Summary:
+        Summarise an assignment problem in a short array, so that a checkpoint is only resumed by the assignment that wrote it. 
+        The costs, capacities, BPR parameters and OD flows are recorded as md5 digests, so that changing any of them, 
+        even in a way that keeps their totals, starts the assignment over. 
+    
+    Args:
+        base (np.array): the base cost of each edge 
+        capacity (np.array): the capacity of each edge 
+        a (float or np.array): the BPR parameter a, or its value on each edge 
+        b (float or np.array): the BPR parameter b, or its value on each edge 
+        n (int): the number of vertices 
+        od (dict): the OD dictionary 
+        P (list): the increments 
+        scale (float): the proportion of flow to assign 
+        stores (list): the route stores of the assignment, None where routes are not kept 
+    
+    Returns:
+        np.array: the signature 
+    """
+    return np.array([len(base), n, len(od), scale, len(stores), sum(store is not None for store in stores), 
+                     array_digest(base), array_digest(capacity), array_digest(a, b), od_digest(od)] + list(P), dtype = float)
+
+def save_checkpoint(file_name, signature, increment, flow, cost, stores):
+    """
+    Summary:
+        Save the state of an assignment after an increment, if file_name is given. 
+    
+    Args:
+        file_name (str): the checkpoint file, or None 
+        signature (np.array): the signature of the assignment, see assignment_signature() 
+        increment (int): the number of increments completed 
+        flow (np.array): the flow through each edge, indexed by edge id 
+        cost (np.array): the congested cost of each edge, indexed by edge id 
+        stores (list): the route stores of the assignment, None where routes are not kept 
+    
+    Returns:
+        None
+    """
+    if file_name is None:
+        return
+    offsets = [store.size() if store is not None else (0, 0) for store in stores]
+    checkpoints.save(file_name, 
+                     signature = signature, 
+                     increment = increment, 
+                     flow = flow, 
+                     cost = cost, 
+                     routes = np.array(offsets, dtype = np.int64))
+
+def restore(file_name, signature, stores):
+    """
+    Summary:
+        Load the checkpoint of an assignment and cut its route stores back to the checkpointed offsets, discarding routes 
+        written after the checkpoint. 
+    
+    Args:
+        file_name (str): the checkpoint file, or None 
+        signature (np.array): the signature of the assignment, see assignment_signature() 
+        stores (list): the route stores of the assignment, None where routes are not kept 
+    
+    Returns:
+        dict: the checkpoint, or None if there is none, it belongs to a different assignment, or its route stores are incomplete 
+    """
+    state = checkpoints.load(file_name)
+    if state is None:
+        return None
+    if state['signature'].shape != signature.shape or (state['signature'] != signature).any():
+        print 'checkpoint ' + file_name + ' belongs to a different assignment, starting over'
+        return None
+    for store, (n_routes, n_edges) in zip(stores, state['routes']):
+        if store is not None and (store.size()[0] < n_routes or store.size()[1] < n_edges):
+            print 'route store ' + store.prefix + ' is shorter than its checkpoint, starting over'
+            return None
+    for store, (n_routes, n_edges) in zip(stores, state['routes']):
+        if store is not None:
+            store.truncate(n_routes, n_edges)
+    return state
+
+def frank_wolfe(g, od, base_cost = 'free_flow_time_m', a = 0.15, b = 4., scale = .25, details = False, gap = 1e-4, max_time = None, max_iter = 100, conjugate = True, batch_size = 256, processes = 1, route_file = '3_throughput/routes', route_metrics = None):
+    """
+    Summary: 
+        Compute the user equilibrium of a network with the Frank-Wolfe algorithm, or its conjugate variant, as an alternative to ITA(). 
+        Each iteration routes all demand over the current costs (an all-or-nothing assignment, as in one increment of ITA_csr) 
+        and moves the flows towards it by the step that minimises the BPR objective. The relative gap is reported after every 
+        iteration, and the assignment stops once it falls to gap, or when the time budget runs out. 
+    
+    Args:
+        g (igraph.Graph()): the network on which to assign flows 
+        od (dict): the OD dictionary, keyed according to vertices of g
+        base_cost (str, optional): attribute containing base cost per edge, usually 'free_flow_time_m' 
+        a (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        b (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+        scale (float, optional): the proportion of flow to assign
+        details (bool, optional): whether to supply a summary data frame with routewise metrics as a return value. The routes of every iteration are kept, so the route store grows with the number of iterations. 
+        gap (float, optional): the relative gap at which to stop 
+        max_time (float, optional): the time budget in minutes; the assignment stops after the first iteration that exceeds it 
+        max_iter (int, optional): the maximum number of iterations 
+        conjugate (bool, optional): if True, use conjugate Frank-Wolfe directions, which usually need far fewer iterations for a tight gap 
+        batch_size (int, optional): the number of origins routed together, see ITA_csr() 
+        processes (int, optional): the number of worker processes, see ITA_csr() 
+        route_file (str, optional): path prefix of the route store used when details = True; its files are deleted once summarised. 
+        route_metrics (dict, optional): additional route metrics for details, see make_details_df(). 
+
+    Returns:
+        df: only if details = True, returns a dataframe summarising route information. The relative gap of each iteration is kept in the graph attribute g['relative_gap']. 
+    """
+    G = csr.csr_from_igraph(g, base_cost)
+    a_e, b_e = [G.from_edge_order(x) for x in bpr_parameters(g.es, a, b)]
+    R = csr.router(G, od, 
+                   processes = processes, 
+                   batch_size = batch_size, 
+                   route_file = route_file if details else None)
+    if details:
+        for store in R.stores:
+            store.remove()
+
+    def route():
+        # all-or-nothing assignment, recording where its routes end in each store
+        y = R.route(1., scale)
+        if details:
+            counts.append([store.size()[0] for store in R.stores])
+        return y
+
+    counts = []
+    gaps = []
+    begin = time.time()
+    try:
+        # the flows are kept as a convex combination of all-or-nothing assignments, 
+        # with weights w_x, so that their routes can be weighted in the same way
+        G.flow[:] = route()
+        w_x = np.ones(1)
+        s, w_s = None, None
+        for k in range(1, max_iter + 1):
+            start = time.time()
+            G.cost[:] = costs.bpr(G.base, G.flow, G.capacity, a_e, b_e)
+            y = route()
+            w_x = np.append(w_x, 0)
+
+            gaps.append(costs.relative_gap(G.cost, G.flow, y))
+            time_taken = str(round((time.time() - start) / 60.0, 1)) + 'm'
+            print 'iteration ' + str(k) + ': relative gap = ' + '%.2e' % gaps[-1] + ' in ' + time_taken
+            if gaps[-1] <= gap:
+                break
+            if max_time is not None and time.time() - begin > 60 * max_time:
+                break
+
+            e_k = np.zeros(len(w_x))
+            e_k[-1] = 1
+            if s is None:
+                s, w_s = y, e_k
+            else:
+                alpha = 0.
+                if conjugate:
+                    hessian = costs.bpr_derivative(G.base, G.flow, G.capacity, a_e, b_e)
+                    alpha = _conjugate_weight(G.flow, s, y, hessian)
+                s = alpha * s + (1 - alpha) * y
+                w_s = alpha * np.append(w_s, 0) + (1 - alpha) * e_k
+
+            step = _line_search(G.base, G.flow, s - G.flow, G.capacity, a_e, b_e)
+            G.flow[:] = G.flow + step * (s - G.flow)
+            w_x = (1 - step) * w_x + step * w_s
+    finally:
+        R.close()
+
+    G.cost[:] = costs.bpr(G.base, G.flow, G.capacity, a_e, b_e)
+
+    es = g.es
+    es['flow'] = list(G.to_edge_order(G.flow))
+    es['congested_time_m'] = list(G.to_edge_order(G.cost))
+    g['relative_gap'] = gaps
+
+    compute_gradient('free_flow_time_m', 'flow', 'capacity', a, b, es)
+
     if details: 
-        df = pd.DataFrame(columns = columns)
-        for k in range(len(P)):
-            piece = pd.read_csv('3_throughput/paths_list_' + str(k) + '.csv')
-            df_piece = make_details_df(piece, es, base_cost)
-            df = df.append(piece)
-            os.remove('3_throughput/paths_list_' + str(k) + '.csv')
-        df = agg_df(df)
-        con_map = { v.index : v['con_name'] for v in g.vs}
-        df['o_con'] = df.o.map(con_map.get)
-        df['d_con'] = df.d.map(con_map.get)
-        nx_map = { v.index : v['name'] for v in g.vs}
-        df['o_nx'] = df.o.map(nx_map.get)
-        df['d_nx'] = df.d.map(nx_map.get)
-        del df['o']
-        del df['d']
-        return df
\ No newline at end of file
+        # weight each route by the final weight of the assignment that found it
+        for j, store in enumerate(R.stores):
+            ends = [0] + [c[j] for c in counts]
+            store.replace('p', np.repeat(w_x, np.diff(ends)))
+        return read_details(g, R.stores, base_cost, route_metrics)
+
+def _conjugate_weight(x, s, y, hessian, delta = .01):
+    # weight of the previous direction that makes the new one conjugate to it
+    # with respect to the (diagonal) Hessian of the objective
+    d_bar = hessian * (s - x)
+    N = np.dot(d_bar, y - x)
+    D = np.dot(d_bar, y - s)
+    if D == 0 or N / D < 0:
+        return 0.
+    return min(N / D, 1 - delta)
+
+def _line_search(base, x, d, capacity, a, b, tol = 1e-10):
+    # bisect on the derivative of the objective along d, which is increasing in the step
+    moving = d != 0
+    base, x, d, capacity = base[moving], x[moving], d[moving], capacity[moving]
+    if np.ndim(a) > 0:
+        a = a[moving]
+    if np.ndim(b) > 0:
+        b = b[moving]
+
+    def slope(step):
+        return np.dot(d, costs.bpr(base, x + step * d, capacity, a, b))
+
+    if slope(1.) <= 0:
+        return 1.
+    lo, hi = 0., 1.
+    while hi - lo > tol:
+        mid = (lo + hi) / 2
+        if slope(mid) > 0:
+            hi = mid
+        else:
+            lo = mid
+    return (lo + hi) / 2
+
+def read_details(g, stores, base_cost, metrics = None):
+    """
+    Summary:
+        Summarise the routes kept by ITA during assignment. The route stores are deleted once read. 
+    
+    Args:
+        g (igraph.Graph()): the network on which ITA was run, carrying flow, congested_time_m and gradient 
+        stores (list): the routes.route_store objects written during assignment 
+        base_cost (str): the attribute containing the base cost, usually free_flow_time_m 
+        metrics (dict, optional): additional route metrics, see make_details_df() 
+    
+    Returns:
+        pd.DataFrame: route-wise metrics, aggregated by origin and destination 
+    """
+    es = g.es
+    pieces = []
+    for store in stores:
+        pieces.append(make_details_df(store.load(), es, base_cost, metrics))
+        store.remove()
+    df = agg_df(pd.concat(pieces, ignore_index = True))
+    con_map = { v.index : v['con_name'] for v in g.vs}
+    df['o_con'] = df.o.map(con_map.get)
+    df['d_con'] = df.d.map(con_map.get)
+    nx_map = { v.index : v['name'] for v in g.vs}
+    df['o_nx'] = df.o.map(nx_map.get)
+    df['d_nx'] = df.d.map(nx_map.get)
+    del df['o']
+    del df['d']
+    return df
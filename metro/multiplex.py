@@ -7,6 +7,15 @@ import pandas as pd
 import os
 import numpy as np
 import ita
+import csr
+import demand
+import simplification
+import spatial
+import results
+import costs
+import columns
+import scenario
+from collections import Mapping
 
 class multiplex:
 	'''
@@ -16,12 +25,41 @@ class multiplex:
 		self.layers -- (list) list of strings
 		self.G -- a networkx.DiGraph object, all of whose nodes and edges have a 
 		'layer' attribute.  
-		self.od -- a dict of dicts ....
+		self.od -- a demand.od_matrix, or a dict of dicts, giving flows between nodes ....
+		self.layer_nodes -- (dict) the set of nodes of each layer, by layer 
+		self.layer_edges -- (dict) the set of edges (u, v) of each layer, by layer 
+		self.spatial_indexes -- (dict) the spatial.spatial_index of the nodes of each layer, by layer, built when first needed 
+		self.mutations -- (int) the number of changes made to self.G, which invalidate the igraph forms cached by to_igraph() 
+		self.columnar -- (bool) whether self is stored in columnar form, see columns() 
+		self.overlays -- (dict) the scenario.overlay of each named scenario, see add_overlay() 
+	The layer index (layer_nodes and layer_edges) is kept up to date by the methods of self; 
+	if self.G is changed directly, rebuild it with index_layers(), which also drops the spatial indexes and igraph forms. 
+	If only attributes are changed directly, call mutated(). 
+	A columnar multiplex keeps its nodes and edges in a columns.store instead (see columns()): self.G is then generated from it 
+	when first used, and regenerated after the store changes, while attribute reads, per-layer reductions, scaling and the 
+	igraph conversion work on its arrays without building self.G at all. 
 	'''
-	def __init__(self):
+	def __init__(self, columnar = False):
 		self.layers = []
 		self.G = nx.DiGraph()
 		self.od = None
+		self.layer_nodes = {}
+		self.layer_edges = {}
+		self.spatial_indexes = {}
+		self.mutations = 0
+		self._igraphs = {}
+		self._od_igraph = None
+		self.columnar = columnar
+		self._store = None
+		self.overlays = {}
+
+	def __getattr__(self, name):
+		# self.G of a columnar multiplex is generated from the store when first used after it changed
+		store = self.__dict__.get('_store')
+		if name == 'G' and store is not None:
+			self.G = store.to_graph()
+			return self.G
+		raise AttributeError(name)
 
 	# -------------------------------------------------------------------------
 	# NETWORK CONSTRUCTION	
@@ -61,6 +99,7 @@ class multiplex:
 					  for n in self.G.node} 
 
 		self.G = nx.relabel_nodes(self.G, mapping = new_labels, copy = False)
+		self.index_layers()
 
 		if self.od is not None:
 			key_map = {self.G.node[n][old_label] : n for n in self.G}
@@ -78,8 +117,8 @@ class multiplex:
 		    None
 		"""
 		self.G = nx.disjoint_union(self.G, H)
-		self.update_layers()
 		self.label_nodes('id')
+		self.update_layers()
 
 	# -------------------------------------------------------------------------
 	# OD CONSTRUCTION
@@ -89,63 +128,27 @@ class multiplex:
 		"""
 		Summary:
 			Read an OD matrix formatted with columns 'o', 'd', and 'flow', where 'o' and 'd' match a node attribute in a layer of self. 
+			The flow between two tracts is spread evenly over all pairs of their nodes. The result is kept as a sparse demand.od_matrix, 
+			which behaves like a dict of dicts. 
 		
 		Args:
 		    layer (str): the layer of nodes whose attributes match the 'o' and 'd' columns
 		    key (str): the node attribute matching the 'o' and 'd' columns
 		    od_file (str): the path of the OD matrix to read in
 		    sep (str): The separator used in the OD file
-		    **kwargs: Additional arguments passed to pd.read_table
+		    **kwargs: Additional arguments passed to demand.read_od() and pd.read_table, e.g. chunksize 
 		
 		Returns:
 		    None
 		"""
-		from itertools import product
-		
-
-		K = self.layers_as_subgraph([layer])
-		cons = {n : int(K.node[n][key]) for n in K}
-		
-
-		o, d = zip(*product(cons.keys(), cons.keys()))
-
-		df = pd.DataFrame({'o' : o, 'd' : d})
-
-		df['o_tract'] = df['o'].map(cons.get) 
-		df['d_tract'] = df['d'].map(cons.get)
-		
-
-		od = pd.read_table(od_file, sep = sep, **kwargs)
-		
-
-		od.rename(columns = {'o' : 'o_tract', 'd' : 'd_tract'}, inplace = True)
-
-		df = df.merge(od, how = 'inner')
-
-		norms = pd.DataFrame(df.groupby(['o_tract','d_tract']).size())
-		norms.rename(columns = {0 : 'norm'}, inplace = True)
-
-		df = df.merge(norms, left_on= ['o_tract', 'd_tract'], right_index=True)
-		
-		    
-		df['flow'] = df['flow'] / df['norm']
-		
-		
-		mat = df.pivot(index = 'o', columns = 'd', values = 'flow')
-		mat[np.isnan(mat)] = 0
-		
-		od = mat.to_dict('index')
-		
-
-		from copy import deepcopy
-		od_copy = deepcopy(od)
-		for origin in od_copy:
-		    for destination in od_copy[origin]:
-		        if od[origin][destination] < .00000000001:
-		            del od[origin][destination]
-	
-
-		self.od = od
+		if getattr(self, 'columnar', False):
+			store = self.columns()
+			mask = store.node_mask([layer])
+			cons = {n : int(k) for n, k in zip(store.labels[mask], store.node_columns[key][mask])}
+		else:
+			K = self.layers_as_subgraph([layer])
+			cons = {n : int(K.node[n][key]) for n in K}
+		self.od = demand.read_od(od_file, cons, sep = sep, **kwargs)
 
 	def re_key_od(self, key_map):
 		"""
@@ -174,6 +177,7 @@ class multiplex:
 		'''
 		d = {e : float(self.G.edge[e[0]][e[1]][weight] or 0) + epsilon for e in self.G.edges_iter()}
 		nx.set_edge_attributes(self.G, weight, d)
+		self.mutated()
 
 	def remove_layer(self, layer):
 		"""
@@ -190,12 +194,20 @@ class multiplex:
 			print "Sorry, " + layer + ' is not current in the multiplex.'
 		else:
 			self.layers.remove(layer)
-			self.G.remove_nodes_from([n for n,attrdict in self.G.node.items() if attrdict['layer'] == layer])
+			nodes = self.layer_nodes.pop(layer, set())
+			self.spatial_indexes.pop(layer, None)
+			for u, v, d in self.G.out_edges(nodes, data = True) + self.G.in_edges(nodes, data = True):
+				self.layer_edges[d['layer']].discard((u, v))
+			self.layer_edges = {l : edges for l, edges in self.layer_edges.items() if edges}
+			self.G.remove_nodes_from(nodes)
+			self.mutated()
 	
-	def spatial_join(self, layer1, layer2, transfer_speed, base_cost, capacity, both = True):
+	def spatial_join(self, layer1, layer2, transfer_speed, base_cost, capacity, both = True, k = 1, radius = None, replace = False):
 		'''
 		Summary: 
-			Add edges to between ALL nodes of layer1 and the nodes of layer2 spatially nearest to the nodes of layer1. New edges are labelled 'layer1_layer2_T' and 'layer1_layer2_T' is added to self.layers.  Requires that each node in each G have a 'pos' tuple of format (latitude, longitude). 
+			Add edges to between ALL nodes of layer1 and the nodes of layer2 spatially nearest to the nodes of layer1. New edges are labelled 'layer1--layer2' and 'layer1--layer2' is added to self.layers.  Requires that each node of both layers have 'lon' and 'lat' attributes; nearest nodes are found with the spatial index of layer2 (see spatial_index()). 
+			Each node of layer1 is joined to its k nearest nodes of layer2 and, if radius is given, to all nodes of layer2 within radius as well, each transfer costing its own distance / transfer_speed + base_cost. 
+			With replace = True, an existing transfer layer between layer1 and layer2 is replaced in place, leaving the other layers untouched, e.g. to compare access assumptions. 
 		
 		Args: 
 			layer1 (str): base layer, all nodes joined to one node in layer2
@@ -203,47 +215,46 @@ class multiplex:
 			transfer_speed (float): assumed speed at which transfer distance can be traversed, e.g. walking speed from street to metro. 
 			base_cost (float): base cost associated with transfer, e.g. mean time spent waiting for metro.
 			both (bool): if true, transfer is bidirectional. 
+			k (int, optional): the number of nearest nodes of layer2 to join each node of layer1 to. 
+			radius (float, optional): if given, each node of layer1 is also joined to all nodes of layer2 within radius km. 
+			replace (bool, optional): if true, replace the transfer layer if it exists, else leave it as it is. 
 
 		Returns:
 			None  		
 		Example: spatial_join(layer1 = 'metro', layer2 = 'street')
 		'''	
-		def find_nearest(n, N1, N2):
-			dists = {m: analysis.distance( (N1.node[n]['lon'], N1.node[n]['lat']), (N2.node[m]['lon'], N2.node[m]['lat']) ) for m in N2}
-			nearest = min(dists, key=dists.get)
-			nearest_dist = dists[nearest]
-			return nearest, nearest_dist
-
 		transfer_layer_name = layer1 + '--' + layer2
-		self.layers.append(transfer_layer_name)
-
-		layer1_copy = self.layers_as_subgraph([layer1])	
-		layer2_copy = self.layers_as_subgraph([layer2])
-
-		edges_added = 0
-		for n in layer1_copy.node:
-			nearest, nearest_dist = find_nearest(n, layer1_copy, layer2_copy)
-			self.G.add_edge(n, nearest, 
-							layer = transfer_layer_name,
-							weight = 0,
-							dist_km = nearest_dist, 
-							free_flow_time_m = nearest_dist / transfer_speed + base_cost,
-							uniform_time_m = nearest_dist / transfer_speed + base_cost,
-							capacity = capacity)
-			
-			bidirectional = ""
+		if transfer_layer_name in self.layers:
+			if not replace:
+				print "ERROR: The layer " + transfer_layer_name + " is already defined in the multiplex, did not overwrite"
+				return
+			self.G.remove_edges_from(self.layer_edges.pop(transfer_layer_name, set()))
+		else:
+			self.layers.append(transfer_layer_name)
+		transfers = self.layer_edges.setdefault(transfer_layer_name, set())
+
+		origins = self.spatial_index(layer1)
+		candidates = self.spatial_index(layer2)
+		query, found, dist = spatial.candidates(candidates, origins.positions, k, radius)
+		time_m = dist / transfer_speed + base_cost
+
+		edges = []
+		for n, m, dist_km, t in zip(origins.names[query], candidates.names[found], dist, time_m):
+			attr = {'layer' : transfer_layer_name,
+			        'weight' : 0,
+			        'dist_km' : dist_km, 
+			        'free_flow_time_m' : t,
+			        'uniform_time_m' : t,
+			        'capacity' : capacity}
+			edges.append((n, m, attr))
 			if both: 
-				self.G.add_edge(nearest, n, 
-								layer = transfer_layer_name,
-								weight = 0,
-								dist_km = nearest_dist, 
-								free_flow_time_m = nearest_dist / transfer_speed + base_cost,
-								uniform_time_m = nearest_dist / transfer_speed + base_cost,
-								capacity = capacity) # assumes bidirectional
-				bidirectional = "bidirectional "
-			edges_added += 1
-
-		print 'Added ' + str(edges_added) + ' ' + bidirectional + 'transfers between '  + layer1 + ' and ' + layer2 + '.'
+				edges.append((m, n, dict(attr))) # assumes bidirectional
+		self.G.add_edges_from(edges)
+		transfers.update((u, v) for u, v, attr in edges)
+		self.mutated()
+
+		bidirectional = "bidirectional " if both else ""
+		print 'Added ' + str(len(query)) + ' ' + bidirectional + 'transfers between '  + layer1 + ' and ' + layer2 + '.'
 	
 	def update_node_attributes(self, attr):
 		'''
@@ -259,6 +270,7 @@ class multiplex:
 
 		for n in attr:
 			for att in attr[n]: self.G.node[n][att] = attr[n][att]
+		self.mutated()
 
 	def update_edge_attributes(self, attr):
 		'''
@@ -273,11 +285,12 @@ class multiplex:
 		'''
 		for e in attr:
 			for att in attr[e]: self.G.edge[e[0]][e[1]] = attr[e][att]
+		self.mutated()
 	
 	def update_layers(self):
 		"""
 		Summary:
-			Check that the layers of self include all layers present in self.G
+			Check that the layers of self include all layers present in self.G, according to the layer index. 
 
 		Args:
 			None
@@ -285,13 +298,104 @@ class multiplex:
 		Returns:
 		    None 
 		"""
-		new_layers = set([attrdict['layer'] 
-		                 for n, attrdict in self.G.node.items()])
-		new_layers.update(set([d['layer'] 
-		                  for u,v,d in self.G.edges(data=True)]))
+		new_layers = set(self.layer_nodes)
+		new_layers.update(set(self.layer_edges))
 
 		self.layers = list(new_layers)
 
+	def index_layers(self):
+		"""
+		Summary:
+			Rebuild the layer index of self (self.layer_nodes and self.layer_edges) from the 'layer' attributes of the nodes and edges of self.G. 
+
+		Returns:
+		    None 
+		"""
+		self.layer_nodes = {}
+		self.layer_edges = {}
+		self.spatial_indexes = {}
+		self.mutated()
+		if 'G' not in self.__dict__:
+			store = self._store
+			for code, layer in enumerate(store.layers):
+				nodes, edges = store.node_layer == code, store.edge_layer == code
+				if nodes.any():
+					self.layer_nodes[layer] = set(store.labels[nodes])
+				if edges.any():
+					self.layer_edges[layer] = set(zip(store.labels[store.sources[edges]], store.labels[store.targets[edges]]))
+			return
+		for n, attrdict in self.G.node.iteritems():
+			self.layer_nodes.setdefault(attrdict['layer'], set()).add(n)
+		for u, v, d in self.G.edges_iter(data = True):
+			self.layer_edges.setdefault(d['layer'], set()).add((u, v))
+
+	def mutated(self):
+		"""
+		Summary:
+			Record a change to self.G, so that the igraph forms of self.G and self.od cached by to_igraph() are rebuilt when next needed. 
+			Called by the methods of self that change self.G; call it after changing nodes, edges or attributes of self.G directly. 
+		
+		Returns:
+		    None 
+		"""
+		self.mutations = getattr(self, 'mutations', 0) + 1
+		self._igraphs = {}
+		self._od_igraph = None
+		if 'G' in self.__dict__:
+			self._store = None
+
+	def columns(self):
+		"""
+		Summary:
+			Retrieve self in columnar form, building it from self.G if needed. The store is kept until self.G changes (see mutated()). 
+			Store it for good with columnar = True, after which changes go to the store (call columns_changed() after changing it 
+			directly) and self.G is regenerated from it when next used. 
+		
+		Returns:
+		    columns.store: the nodes and edges of self, with their attributes as arrays 
+		"""
+		if getattr(self, '_store', None) is None:
+			self._store = columns.store_from_graph(self.G)
+		return self._store
+
+	def columns_changed(self):
+		"""
+		Summary:
+			Record a change to the columnar form of self, so that self.G and the igraph forms cached by to_igraph() are 
+			regenerated from it when next needed. 
+		
+		Returns:
+		    None 
+		"""
+		self.mutations = getattr(self, 'mutations', 0) + 1
+		self._igraphs = {}
+		self._od_igraph = None
+		self.__dict__.pop('G', None)
+
+	def spatial_index(self, layer):
+		"""
+		Summary:
+			Retrieve the spatial index of the nodes of a layer, from their 'lon' and 'lat' attributes, building it if needed. 
+			The index is kept until the nodes of self change, and shared by spatial_join(), analysis.proximity_to() and 
+			utility.find_nearest(). 
+		
+		Args:
+		    layer (str): the layer
+		
+		Returns:
+		    spatial.spatial_index: the index, whose names are the nodes of the layer 
+		"""
+		if layer not in self.spatial_indexes:
+			if getattr(self, 'columnar', False):
+				store = self.columns()
+				mask = store.node_mask([layer])
+				order = np.argsort(store.labels[mask])
+				positions = np.column_stack([store.node_columns['lon'][mask], store.node_columns['lat'][mask]])
+				self.spatial_indexes[layer] = spatial.spatial_index(positions[order], store.labels[mask][order])
+			else:
+				self.spatial_indexes[layer] = spatial.index_of(self.G, self.layer_nodes.get(layer, ()))
+		return self.spatial_indexes[layer]
+
 	def scale_edge_attribute(self, layer = None, attribute = None, beta = 1):
 		"""
 		Summary:
@@ -305,10 +409,48 @@ class multiplex:
 		Returns:
 			None
 		"""
-		d = {e: self.G.edge[e[0]][e[1]][attribute] * beta 
-		     for e in self.layers_as_subgraph([layer]).edges_iter()}
-		nx.set_edge_attributes(self.G, attribute, d)
+		if getattr(self, 'columnar', False):
+			self.columns().scale_edge_attribute(attribute, beta, [layer])
+			self.columns_changed()
+			return
+		for u, v in self.layer_edges.get(layer, ()):
+			self.G.edge[u][v][attribute] *= beta
+		self.mutated()
 	
+	def add_overlay(self, name, multipliers = None, replacements = None):
+		"""
+		Summary:
+			Define a named scenario as an overlay of edge costs, which run_ita(), run_ita_classes(), path_lengths() and route_summary() apply on the fly 
+			when given its name, leaving self unchanged. 
+		
+		Args:
+		    name (str): the name of the scenario 
+		    multipliers (dict, optional): per edge attribute, a dict of multipliers by layer, e.g. {'free_flow_time_m' : {'metro' : beta}} 
+		    replacements (dict, optional): per edge attribute, an array of new values in the order of to_igraph(), or a dict of new values by edge 
+		
+		Returns:
+		    scenario.overlay: the overlay 
+		"""
+		if not hasattr(self, 'overlays'):
+			self.overlays = {}
+		self.overlays[name] = scenario.overlay(name, multipliers, replacements)
+		return self.overlays[name]
+
+	def get_overlay(self, overlay):
+		"""
+		Summary:
+			Retrieve an overlay by name; an overlay or None is returned as is. 
+		
+		Args:
+		    overlay (str or scenario.overlay): the overlay, or the name given to add_overlay() 
+		
+		Returns:
+		    scenario.overlay: the overlay, or None 
+		"""
+		if overlay is None or isinstance(overlay, scenario.overlay):
+			return overlay
+		return getattr(self, 'overlays', {})[overlay]
+
 	# -------------------------------------------------------------------------
 	# NETWORK QUERIES	
 	# -------------------------------------------------------------------------
@@ -339,15 +481,15 @@ class multiplex:
 	def layers_as_subgraph(self, layers):
 		'''
 		Summary:
-			return a subset of the layers of self.G as a networkx.DiGraph() object. 
+			return a subset of the layers of self.G, i.e. the subgraph induced by their nodes, as a read-only layer_view of self.G. 
+			Use its copy() method for an independent networkx.DiGraph() object. 
 		args: 
 			layers (list): a list of layers to return
 
 		Returns:
-			None
+			layer_view: the subgraph, sharing the nodes, edges and attribute dicts of self.G
 		'''
-		return self.G.subgraph([n for n,attrdict in self.G.node.items() 
-		                       if attrdict['layer'] in layers])
+		return layer_view(self.G, set().union(*[self.layer_nodes.get(layer, set()) for layer in layers]))
 
 	def sub_multiplex(self, sublayers):
 		'''
@@ -362,7 +504,7 @@ class multiplex:
 		
 		'''
 		sub_multiplex = multiplex()        
-		sublayer_dict = {layer : self.layer_as_subgraph(layer) 
+		sublayer_dict = {layer : self.layers_as_subgraph([layer]).copy() 
 						 for layer in sublayers}
 		sub_multiplex.add_layers(sublayer_dict)
 		return sub_multiplex
@@ -393,10 +535,8 @@ class multiplex:
 			None
 
 		'''
-		layers = {layer: (len([n for n,attrdict in self.G.node.items() 
-		                  if attrdict['layer'] == layer]), 
-						  len([(u,v,d) for u,v,d in self.G.edges(data=True) 
-						      if d['layer'] == layer])) for layer in self.layers} 
+		layers = {layer: (len(self.layer_nodes.get(layer, ())), 
+						  len(self.layer_edges.get(layer, ()))) for layer in self.layers} 
 		
 		if self.od is not None:
 			print 'OD: loaded\n'
@@ -436,21 +576,61 @@ class multiplex:
 		    pandas.DataFrame: a df in which each row is a node and each specified column is a node attribute.  
 		"""
 		attrs = attrs + ['layer']
+		if getattr(self, 'columnar', False):
+			return self.columns().nodes_df(sorted(attrs), layers)[sorted(attrs + ['label'])]
 		return nodes_2_df(self.layers_as_subgraph(layers), attrs)
 
-	def to_igraph(self):
+	def to_igraph(self, node_attrs = None, edge_attrs = None):
 		"""
 		Summary: 
-			Retrieve self.G and self.od in igraph form. 
+			Retrieve self.G and self.od in igraph form. The conversion is cached until self.G changes (see mutated()), once per choice 
+			of attributes, and each call returns a copy of the cached graph, which can be changed freely. The re-keyed OD matrix is cached 
+			too when self.od is a demand.od_matrix; it shares its flows with self.od, so changes to the flows of either show in both. 
+		
+		Args:
+		    node_attrs (list, optional): the node attributes to copy to the vertices, all of them if not given 
+		    edge_attrs (list, optional): the edge attributes to copy to the edges, all of them if not given 
 		
 		Returns:
 		    igraph.Graph: an igraph-formatted copy of G for use in computationally-intensive operations. 
-		    od_ig: a copy of self.od keyed to the returned igraph graph. 
+		    od_ig: a copy of self.od keyed to the returned igraph graph, or None if self has no OD matrix. 
+		"""
+		key = (None if node_attrs is None else tuple(sorted(node_attrs)), 
+		       None if edge_attrs is None else tuple(sorted(edge_attrs)))
+		if key not in self._igraphs:
+			if getattr(self, 'columnar', False):
+				g = self.columns().to_igraph(node_attrs, edge_attrs)
+			else:
+				g = nx_2_igraph(self.G, node_attrs, edge_attrs)
+			self._igraphs[key] = (g, {name : i for i, name in enumerate(g.vs['name'])})
+		g, key_map = self._igraphs[key]
+
+		# every cached graph has the vertex order of self.G, so the re-keyed OD matrix serves them all
+		if self.od is None:
+			od_ig = None
+		elif self._od_igraph is not None and self._od_igraph[0] is self.od:
+			od_ig = self._od_igraph[1]
+		else:
+			od_ig = re_key_od(self.od, key_map)
+			if isinstance(self.od, demand.od_matrix):
+				self._od_igraph = (self.od, od_ig)
+		return g.copy(), od_ig
+
+	def routing_graph(self, base_cost = 'free_flow_time_m'):
 		"""
-		g = nx_2_igraph(self.G)
-		d = {v['name'] : v.index for v in g.vs}
-		od_ig = re_key_od(self.od, d)
-		return g, od_ig
+		Summary: 
+			Retrieve self.G and self.od in igraph form, contracted for routing: chains of pass-through nodes become single edges, 
+			and connectors joined to a single node by free transfer edges are merged into it. See simplification.routing_graph. 
+		
+		Args:
+		    base_cost (str, optional): the edge attribute of base cost, by which free transfer edges are recognised 
+		
+		Returns:
+		    simplification.routing_graph: the contracted graph (its attribute g) and OD matrix (its attribute od), with the mapping 
+		    with which flows on it are expanded back onto the igraph form of self.G (see simplification.routing_graph.expand()). 
+		"""
+		g, od = self.to_igraph()
+		return simplification.routing_graph(g, od, base_cost)
 		
 	def edges_2_df(self, layers, attrs):
 		"""
@@ -465,6 +645,9 @@ class multiplex:
 		    pandas.DataFrame: a df in which each row is an edge and each column is an edge attribute.  
 		"""
 		attrs = attrs + ['layer']
+		if getattr(self, 'columnar', False):
+			store = self.columns()
+			return store.edges_df(sorted(attrs), store.subgraph_edge_mask(layers))
 		return edges_2_df(self.layers_as_subgraph(layers), attrs)
 	# -------------------------------------------------------------------------
 	# ANALYSIS
@@ -483,6 +666,10 @@ class multiplex:
 		Returns:
 		    The weighted average of attr over the specified layer set. 
 		"""
+		if getattr(self, 'columnar', False):
+			store = self.columns()
+			return store.mean_edge_attribute(attr, store.subgraph_edge_mask(layers), weight_attr)
+
 		H = self.layers_as_subgraph(layers = layers)
 		attr_array = np.array([H.edge[e[0]][e[1]][attr] for e in H.edges_iter()])
 
@@ -495,7 +682,7 @@ class multiplex:
 		return np.average(attr_array, weights = weight_array)
 
 
-	def run_ita(self, n_nodes = None, summary = False, base_cost = 'free_flow_time_m', attrname = 'congested_time_m', flow_name = 'flow', P = [.4, .3, .2, .1], scale = 1):
+	def run_ita(self, n_nodes = None, summary = False, base_cost = 'free_flow_time_m', attrname = 'congested_time_m', flow_name = 'flow', P = [.4, .3, .2, .1], scale = 1, backend = 'csr', processes = 1, route_metrics = None, method = 'ita', gap = 1e-4, max_time = None, checkpoint = None, resume = False, group = None, targeted = False, hierarchy = False, simplify = False, write = False, overlay = None, route_file = None):
 		"""
 		Summary: 
 			Run Iterated Traffic Assignment on self.G, using self.od as the OD matrix. 
@@ -508,30 +695,118 @@ class multiplex:
 		    flow_name (str, optional): the name of the new edge attribute to reflect congested flow. 
 		    P (list, optional): the iteration levels to use. 
 		    scale (int, optional): the fraction of flow to assign. 
+		    backend (str, optional): 'csr' to assign on compressed sparse row arrays (ita.ITA_csr), or 'igraph' to assign through igraph edge attributes (ita.ITA). 
+		    processes (int, optional): the number of worker processes to route with; only used by the 'csr' backend. 
+		    route_metrics (dict, optional): additional route metrics to include when summary = True, see ita.make_details_df(). 
+		    method (str, optional): 'ita' for Iterated Traffic Assignment over the increments P, or 'fw' / 'cfw' for an equilibrium assignment with (conjugate) Frank-Wolfe, see ita.frank_wolfe(). Frank-Wolfe ignores P and always uses the 'csr' backend. 
+		    gap (float, optional): for 'fw' and 'cfw', the relative gap at which to stop. 
+		    max_time (float, optional): for 'fw' and 'cfw', the time budget in minutes. 
+		    checkpoint (str, optional): for 'ita', a .npz file in which to save the state of the assignment after each increment, see ita.ITA(). 
+		    resume (bool, optional): for 'ita', whether to continue from checkpoint if it was written by the same assignment. 
+		    group (str, optional): for 'ita' with the 'csr' backend, search once per group of origins: 'street' groups connectors by the street node they attach to, with unchanged routes; 'taz' groups them by tract, routing each trip from the tract's connector closest to its destination. See csr.origin_groups(). 
+		    targeted (bool, optional): for 'ita' with the 'csr' backend, whether to bound each origin's search by a landmark radius around its destinations, see ita.ITA_csr(). 
+		    hierarchy (bool, optional): for 'ita' with the 'csr' backend, whether to search with a customizable contraction hierarchy rather than Dijkstra, see ita.ITA_csr() and metro.cch. 
+		    simplify (bool, optional): whether to assign on the contracted routing graph of routing_graph(), in which pass-through chains are single edges and connectors are merged into the street nodes they attach to. Flows are expanded exactly onto the edges of self.G, and congested times recomputed edge by edge from them; summary rows are then keyed by the nodes trips were merged into. 
+		    write (bool, optional): whether to write the flows and congested times into self.G straight away, see results.assignment_result.write(). 
+		    overlay (str or scenario.overlay, optional): a scenario whose edge costs to assign with, see add_overlay(). self is left unchanged. 
+		    route_file (str, optional): the path prefix of the route store used when summary = True; defaults to '3_throughput/routes', 
+		    suffixed by '_' and the name of overlay, see scenario.route_file(). Assignments that run at the same time need different prefixes. 
 		
 		Returns:
-		    pd.DataFrame: if summary = True, return a df with route-by-route metrics. Otherwise None.  
+		    results.assignment_result: the flow, congested time and gradient of each edge of self.G, as arrays in the order of to_igraph(), with the df 
+		    of route-by-route metrics as its details if summary = True. The results are only written into the edge attributes flow_name and 
+		    attrname of self.G if write = True, or when its write() method is called. For method = 'fw' or 'cfw', its relative_gap is 
+		    the relative gap after each iteration.  
 		"""
+		if method not in ('ita', 'fw', 'cfw'):
+			raise ValueError("method must be 'ita', 'fw' or 'cfw', not " + repr(method))
+		if method == 'ita':
+			assign = {'csr' : ita.ITA_csr, 'igraph' : ita.ITA}[backend]
+			kwargs = {'processes' : processes, 'P' : P, 'group' : group, 'targeted' : targeted, 'hierarchy' : hierarchy} if backend == 'csr' else {'P' : P}
+		else:
+			assign = ita.frank_wolfe
+			kwargs = {'processes' : processes, 'gap' : gap, 'max_time' : max_time, 'conjugate' : method == 'cfw'}
+
 		g, od = self.to_igraph()
+		overlay = self.get_overlay(overlay)
+		if overlay is not None:
+			overlay.apply(g)
+		kwargs['route_file'] = scenario.route_file(overlay) if route_file is None else route_file
 		if n_nodes is not None:
-			sub_od = {key : od[key] for key in od.keys()[:n_nodes]}
-			df = ita.ITA(g, sub_od, base_cost, P = P, details = summary, scale = scale)
+			od = {key : od[key] for key in od.keys()[:n_nodes]}
+		routing = simplification.routing_graph(g, od, base_cost) if simplify else None
+		if method == 'ita':
+			kwargs['checkpoint'] = checkpoint
+			kwargs['resume'] = resume
+		names = g.vs['name']
+		edges = [(names[u], names[v]) for u, v in g.get_edgelist()]
+
+		if simplify:
+			df = assign(routing.g, routing.od, base_cost, details = summary, scale = scale, route_metrics = route_metrics, **kwargs)
+			routing.expand(scale, base_cost)
 		else:
-			df = ita.ITA(g, od, base_cost, P = P, details = summary, scale = scale)	
-
-		d = {(g.vs[g.es[i].source]['name'], g.vs[g.es[i].target]['name']) : g.es[i]['congested_time_m'] for i in range(len(g.es))}
-		f = {(g.vs[g.es[i].source]['name'], g.vs[g.es[i].target]['name']) : g.es[i]['flow'] for i in range(len(g.es))}
-
-		nx.set_edge_attributes(self.G, attrname, nx.get_edge_attributes(self.G, 'free_flow_time_m'))
-		nx.set_edge_attributes(self.G, flow_name, 0)
+			df = assign(g, od, base_cost, details = summary, scale = scale, route_metrics = route_metrics, **kwargs)	
 
-		nx.set_edge_attributes(self.G, attrname, d)
-		nx.set_edge_attributes(self.G, flow_name, f)
-
-		return df
+		flow = np.array(g.es['flow'], dtype = np.float64)
+		gradient = costs.gradient(g.es[base_cost], flow, [float(c) for c in g.es['capacity']])
+		assigned = routing.g if simplify else g
+		relative_gap = assigned['relative_gap'] if 'relative_gap' in assigned.attributes() else None
+		result = results.assignment_result(edges, flow, g.es['congested_time_m'], gradient, 
+		                                   details = df, flow_name = flow_name, attrname = attrname, relative_gap = relative_gap)
+		if write:
+			result.write(self)
+		return result
 
 
-	def route_summary(self, n_nodes = None, cost = 'congested_time_m', layer = 'streets', funs = None):
+	def run_ita_classes(self, ods, summary = False, base_cost = 'free_flow_time_m', attrname = 'congested_time_m', flow_name = 'flow', P = [.4, .3, .2, .1], scale = 1, route_metrics = None, write = False, overlay = None, route_file = None):
+		"""
+		Summary: 
+			Run Iterated Traffic Assignment on self.G for several OD matrices at once, sharing shortest path trees between them 
+			wherever their costs agree (see ita.ITA_classes()). Each OD matrix is assigned as by run_ita(). 
+		
+		Args:
+		    ods (dict): OD matrices keyed as self.od, e.g. read with demand.read_od(), keyed by a name for each matrix 
+		    summary (bool, optional): whether to construct route-by-route summaries of key metrics. 
+		    base_cost (str, optional): the cost to use as the base in ITA. 
+		    attrname (str, optional): the edge attribute to reflect congested travel time, suffixed by '_' and the name of each OD matrix 
+		    flow_name (str, optional): the edge attribute to reflect congested flow, suffixed by '_' and the name of each OD matrix 
+		    P (list, optional): the iteration levels to use. 
+		    scale (int, optional): the fraction of flow to assign. 
+		    route_metrics (dict, optional): additional route metrics to include when summary = True, see ita.make_details_df(). 
+		    write (bool, optional): whether to write the flows and congested times of every OD matrix into self.G straight away, see results.assignment_result.write(). 
+		    overlay (str or scenario.overlay, optional): a scenario whose edge costs to assign with, see add_overlay(). self is left unchanged. 
+		    route_file (str, optional): the path prefix of the route stores used when summary = True, suffixed by class number; defaults 
+		    as in run_ita(). 
+		
+		Returns:
+		    dict: a results.assignment_result for each OD matrix, keyed by name, as run_ita() returns, with the df of route-by-route 
+		    metrics as its details if summary = True. The results are only written into the edge attributes flow_name + '_' + name 
+		    and attrname + '_' + name of self.G if write = True, or when their write() method is called. 
+		"""
+		g, od = self.to_igraph()
+		overlay = self.get_overlay(overlay)
+		if overlay is not None:
+			overlay.apply(g)
+		route_file = scenario.route_file(overlay) if route_file is None else route_file
+		key_map = {name : i for i, name in enumerate(g.vs['name'])}
+		names = sorted(ods.keys())
+		flows, times, dfs = ita.ITA_classes(g, [re_key_od(ods[name], key_map) for name in names], base_cost, 
+		                                    P = P, scale = scale, details = summary, route_file = route_file, route_metrics = route_metrics)
+
+		vertex_names = g.vs['name']
+		edges = [(vertex_names[u], vertex_names[v]) for u, v in g.get_edgelist()]
+		base = np.array(g.es[base_cost], dtype = np.float64)
+		capacity = [float(c) for c in g.es['capacity']]
+		assignment = {}
+		for c, name in enumerate(names):
+			assignment[name] = results.assignment_result(edges, flows[c], times[c], costs.gradient(base, flows[c], capacity), 
+			                                             details = dfs[c] if summary else None, 
+			                                             flow_name = flow_name + '_' + str(name), attrname = attrname + '_' + str(name))
+			if write:
+				assignment[name].write(self)
+		return assignment
+
+	def route_summary(self, n_nodes = None, cost = 'congested_time_m', layer = 'streets', funs = None, overlay = None):
 		'''
 		Summary: 
 			Compute route-wise metrics over shortest paths using flexibly-defined functions. 
@@ -546,12 +821,16 @@ class multiplex:
 			        'free_flow_time' : lambda e : e['free_flow_time_m'],
 			        'weighted_demand' : lambda e : e['flow_100'] * e['dist_km'],
 			        'weighted_capacity' : lambda e : e['capacity'] * e['dist_km']}
+		    overlay (str or scenario.overlay, optional): a scenario whose edge costs to use, see add_overlay(). 
 
 		Returns:
 			A pandas.DataFrame with the routes, flows, and summarised metrics.  
 		
 		'''
 		g, od = self.to_igraph()
+		overlay = self.get_overlay(overlay)
+		if overlay is not None:
+			overlay.apply(g)
 		if n_nodes is not None:
 			sub_od = {key : od[key] for key in od.keys()[:n_nodes]}
 			df = igraph_route_summary(g, sub_od, cost, layer, funs)
@@ -565,7 +844,7 @@ class multiplex:
 		df['flow'] = df.apply(get_flow, axis = 1)
 		return df
 
-	def path_lengths(self, n_nodes, weight, mode = 'array'):
+	def path_lengths(self, n_nodes, weight, mode = 'array', overlay = None):
 		"""
 		Summary:
 			Compute shortest path lengths under a given weight. 
@@ -574,11 +853,17 @@ class multiplex:
 		    n_nodes (int): the number of nodes for which to compute; only n_nodes = None should be used for final analysis.  
 		    weight (str): the edge attribute to use as cost for shortest paths.  
 		    mode (str, optional): the mode in which to return the results; see analysis.path_lengths_igraph() for options. 
+		    overlay (str or scenario.overlay, optional): a scenario whose edge costs to use, see add_overlay(). 
 		
 		Returns:
 		    TYPE: 
 		"""
-		g, od = self.to_igraph()
+		overlay = self.get_overlay(overlay)
+		if overlay is None:
+			g, od = self.to_igraph(node_attrs = ['layer'], edge_attrs = [weight])
+		else:
+			g, od = self.to_igraph(node_attrs = ['layer'], edge_attrs = sorted(set([weight, 'layer'] + overlay.attributes())))
+			overlay.apply(g)
 		nodes = np.array([v.index for v in g.vs 
 		                 if g.vs[v.index]['layer'] == 'streets'])
 
@@ -589,6 +874,122 @@ class multiplex:
 		return lengths
 
 
+class layer_view:
+	'''
+	layer_view is a read-only view of the subgraph of a networkx.DiGraph induced by a set of 
+	nodes, for use in place of G.subgraph(nodes), which in networkx 1.10 copies the adjacency 
+	of the subgraph. The view supports the queries made of layers by multiplex and its helpers 
+	(node, edge, succ, pred, nodes, edges, iteration, etc.); node and edge attribute dicts are 
+	those of the graph, so attributes set through the view are set on the graph. 
+	attributes:
+		self.G -- (networkx.DiGraph) the graph
+		self.nodes_set -- (set) the nodes of the view
+	'''
+	def __init__(self, G, nodes):
+		self.G = G
+		self.nodes_set = nodes
+		self.node = _restricted(G.node, nodes)
+		self.succ = _adjacency(G.succ, nodes)
+		self.pred = _adjacency(G.pred, nodes)
+		self.adj = self.edge = self.succ
+		self.graph = G.graph
+
+	def __iter__(self):
+		return iter(self.nodes_set)
+
+	def __len__(self):
+		return len(self.nodes_set)
+
+	def __contains__(self, n):
+		return n in self.nodes_set
+
+	def __getitem__(self, n):
+		return self.succ[n]
+
+	def is_directed(self):
+		return True
+
+	def is_multigraph(self):
+		return False
+
+	def has_node(self, n):
+		return n in self.nodes_set
+
+	def has_edge(self, u, v):
+		return u in self.nodes_set and v in self.succ[u]
+
+	def nodes_iter(self, data = False):
+		if data:
+			return ((n, self.G.node[n]) for n in self.nodes_set)
+		return iter(self.nodes_set)
+
+	def nodes(self, data = False):
+		return list(self.nodes_iter(data))
+
+	def edges_iter(self, nbunch = None, data = False):
+		nodes = self.nodes_set if nbunch is None else [n for n in nbunch if n in self.nodes_set]
+		for u in nodes:
+			for v, d in self.G.succ[u].iteritems():
+				if v in self.nodes_set:
+					yield (u, v, d) if data else (u, v)
+
+	def edges(self, nbunch = None, data = False):
+		return list(self.edges_iter(nbunch, data))
+
+	def number_of_nodes(self):
+		return len(self.nodes_set)
+
+	def number_of_edges(self):
+		return sum(1 for e in self.edges_iter())
+
+	def copy(self):
+		"""
+		Summary:
+			Copy the view into a networkx.DiGraph(), as G.subgraph(nodes) would. 
+
+		Returns:
+			networkx.DiGraph: the subgraph, whose attribute dicts are still shared with the graph, as in networkx 1.10
+		"""
+		return self.G.subgraph(self.nodes_set)
+
+	def subgraph(self, nbunch):
+		return self.G.subgraph([n for n in nbunch if n in self.nodes_set])
+
+	def to_undirected(self):
+		return self.copy().to_undirected()
+
+class _restricted(Mapping):
+	'''
+	_restricted is a read-only view of the items of a dict whose keys are in a set. 
+	'''
+	def __init__(self, d, keys):
+		self.d = d
+		self.keys_set = keys
+
+	def __getitem__(self, k):
+		if k not in self.keys_set:
+			raise KeyError(k)
+		return self.d[k]
+
+	def __contains__(self, k):
+		return k in self.keys_set and k in self.d
+
+	def __iter__(self):
+		if len(self.keys_set) < len(self.d):
+			return (k for k in self.keys_set if k in self.d)
+		return (k for k in self.d if k in self.keys_set)
+
+	def __len__(self):
+		return sum(1 for k in self)
+
+class _adjacency(_restricted):
+	'''
+	_adjacency is a read-only view of an adjacency dict (e.g. G.succ) restricted to a set of nodes, 
+	both as the keys of the outer dict and of each inner dict. 
+	'''
+	def __getitem__(self, u):
+		return _restricted(_restricted.__getitem__(self, u), self.keys_set)
+
 # -----------------------------------------------------------------------------
 # HELPER FUNCTIONS
 # -----------------------------------------------------------------------------
@@ -600,18 +1001,25 @@ def re_key_od(od, key_map):
 		Re-key an od matrix according to a mapping from old keys to new ones. 
 	
 	Args:
-	    od (dict): a dict of dicts giving ods 
+	    od (dict or demand.od_matrix): a dict of dicts giving ods 
 	    key_map (dict): a dict in which keys are old labels and values are new labels. 
 	
 	Returns:
-	    (dict): the re-keyed od matrix. 
+	    (dict or demand.od_matrix): the re-keyed od matrix. 
 	"""
+	if isinstance(od, demand.od_matrix):
+		return od.re_key(key_map)
 	new_od = {key_map[o] : {key_map[d] : od[o][d] for d in od[o]} for o in od}
 	return new_od
 
-def read_multi(nodes_file_name = '2_multiplex/mx_nodes.txt', edges_file_name = '2_multiplex/mx_edges.txt', sep = '\t', nid = 'id', eidfrom = 'source', eidto = 'target'):
+def read_multi(nodes_file_name = '2_multiplex/mx_nodes.txt', edges_file_name = '2_multiplex/mx_edges.txt', sep = '\t', nid = 'id', eidfrom = 'source', eidto = 'target', columnar = False, **kwargs):
 	"""A convenience function for easily reading in pipeline's multiplex. 
 	
+	Args:
+		columnar (bool, optional): whether to store the multiplex in columnar form, see multiplex.columns()
+		**kwargs: further kwargs passed down to utility.graph_from_txt(), e.g. edge_columns to read only some edge attributes; 
+		          'layer' and 'capacity' are always read, see multiplex_from_txt()
+	
 	Returns:
 		multiplex.multiplex(): the pipeline's multiplex from make_multiplex.py
 	"""
@@ -620,23 +1028,116 @@ def read_multi(nodes_file_name = '2_multiplex/mx_nodes.txt', edges_file_name = '
 									   sep = sep,
 									   nid = nid,
 									   eidfrom = eidfrom,
-									   eidto = eidto)
+									   eidto = eidto, 
+									   columnar = columnar, 
+									   **kwargs)
 	return multi
 
-def multiplex_from_txt(**kwargs):
+def multiplex_from_tables(layers, transfers = [], columnar = False):
+	"""
+	Summary:
+		Build a multiplex in one pass from tables of nodes and edges, as add_layers() followed by spatial_join() for each transfer 
+		would, without copying and relabelling the growing graph once per layer. Nodes are labelled layer + '_' + i, with i counting 
+		the nodes of all layers in order and kept as their 'old_label' attribute. Every column becomes a node or edge attribute, 
+		except the 'source' and 'target' columns of edge tables; missing (NaN) values are left unset. 
+	
+	Args:
+		layers (list): per layer, a tuple (layer, nodes, edges, nid): the name of the layer, a pandas.DataFrame of its nodes, 
+			a pandas.DataFrame of its edges (or None), and the column of nodes identifying each node, which the 'source' and 
+			'target' columns of edges refer to. Nodes need 'lon' and 'lat' columns for transfers. 
+		transfers (list, optional): per transfer layer, a dict of the arguments of spatial_join() (layer1, layer2, transfer_speed, 
+			base_cost, capacity and optionally both, k and radius), in the order in which they would be joined. 
+		columnar (bool, optional): whether to store the multiplex in columnar form, see multiplex.columns() 
+	
+	Returns:
+		multiplex.multiplex(): the multiplex
+	"""
+	def records(df):
+		columns = list(df)
+		return [{k : v for k, v in zip(columns, row) if not (isinstance(v, float) and np.isnan(v))} 
+		        for row in zip(*[df[col].values for col in columns])]
+
+	node_list, edge_list, names, positions = [], [], {}, {}
+	first = 0
+	for layer, nodes, edges, nid in layers:
+		labels = np.array([layer + '_' + str(i) for i in range(first, first + len(nodes))], dtype = object)
+		attrs = records(nodes)
+		for i, attr in enumerate(attrs):
+			attr['layer'] = layer
+			attr['old_label'] = first + i
+		node_list.extend(zip(labels, attrs))
+		names[layer] = labels
+		if 'lon' in nodes and 'lat' in nodes:
+			positions[layer] = nodes[['lon', 'lat']].values
+		first += len(nodes)
+
+		if edges is not None:
+			index = pd.Series(np.arange(len(nodes)), index = nodes[nid].values)
+			sources = labels[index[edges['source'].values].values]
+			targets = labels[index[edges['target'].values].values]
+			attrs = records(edges.drop(['source', 'target'], axis = 1))
+			for attr in attrs:
+				attr['layer'] = layer
+			edge_list.extend(zip(sources, targets, attrs))
+
+	layer_names = [layer for layer, nodes, edges, nid in layers]
+	indexes = {}
+	for transfer in transfers:
+		layer1, layer2 = transfer['layer1'], transfer['layer2']
+		transfer_layer_name = layer1 + '--' + layer2
+		layer_names.append(transfer_layer_name)
+		if layer2 not in indexes:
+			indexes[layer2] = spatial.spatial_index(positions[layer2], names[layer2])
+		query, found, dist = spatial.candidates(indexes[layer2], positions[layer1], transfer.get('k', 1), transfer.get('radius'))
+		time = dist / transfer['transfer_speed'] + transfer['base_cost']
+		for n, m, dist_km, time_m in zip(names[layer1][query], names[layer2][found], dist, time):
+			attr = {'layer' : transfer_layer_name, 
+			        'weight' : 0, 
+			        'dist_km' : dist_km, 
+			        'free_flow_time_m' : time_m, 
+			        'uniform_time_m' : time_m, 
+			        'capacity' : transfer['capacity']}
+			edge_list.append((n, m, attr))
+			if transfer.get('both', True):
+				edge_list.append((m, n, dict(attr)))
+		print 'Added ' + str(len(query)) + ' ' + ('bidirectional ' if transfer.get('both', True) else '') + \
+		      'transfers between ' + layer1 + ' and ' + layer2 + '.'
+
+	multi = multiplex(columnar)
+	if columnar:
+		multi._store = columns.store_from_records(node_list, edge_list)
+		del multi.G
+	else:
+		multi.G.add_nodes_from(node_list)
+		multi.G.add_edges_from(edge_list)
+	multi.layers = layer_names
+	multi.index_layers()
+	multi.spatial_indexes = indexes
+	return multi
+
+def multiplex_from_txt(columnar = False, **kwargs):
 	"""Convenience function to quickly read a multiplex object from a pair of node and edge files. 
 	
 	Args:
-		**kwargs: kwargs passed down to utility.graph_from_txt()
+		columnar (bool, optional): whether to store the multiplex in columnar form, see multiplex.columns()
+		**kwargs: kwargs passed down to utility.graph_from_txt(). When node_columns or edge_columns select some attributes, 
+		          'layer' is added to both and 'capacity' to edge_columns, since the multiplex needs them. 
 	
 	Returns:
 		multiplex.multiplex(): a multiplex object with appropriate attributes, etc. 
 	"""
+	for key, required in (('node_columns', ['layer']), ('edge_columns', ['layer', 'capacity'])):
+		if kwargs.get(key) is not None:
+			kwargs[key] = list(kwargs[key]) + [col for col in required if col not in kwargs[key]]
+
+	if columnar:
+		return columnar_from_txt(**kwargs)
+
 	G = graph_from_txt(**kwargs)
 	
 
-	cap = {(e[0], e[1]) : float(G.edge[e[0]][e[1]]['capacity']) 
-	        for e in G.edges_iter()} 
+	cap = {(u, v) : float(attr['capacity']) 
+	        for u, v, attr in G.edges_iter(data = True) if 'capacity' in attr} 
 	nx.set_edge_attributes(G, 'capacity', cap)
 
 	multi = multiplex()
@@ -644,10 +1145,47 @@ def multiplex_from_txt(**kwargs):
 
 	return multi
 
+def columnar_from_txt(nodes_file_name = None, edges_file_name = None, nid = None, eidfrom = None, eidto = None, **kwargs):
+	"""Read a columnar multiplex from a pair of node and edge files, building its store straight from the tables, without 
+	a networkx graph. Nodes, labels and attributes are those multiplex_from_txt() gives. 
+	
+	Args:
+		nodes_file_name, edges_file_name, nid, eidfrom, eidto, **kwargs: see utility.graph_from_txt()
+	
+	Returns:
+		multiplex.multiplex(): a columnar multiplex
+	"""
+	nodes, edges = tables_from_txt(nodes_file_name, edges_file_name, nid = nid, eidfrom = eidfrom, eidto = eidto, **kwargs)
+
+	# add_graph() numbers nodes in the order networkx holds them, that of a dict filled in file order, 
+	# labels them layer + '_' + number and keeps the number as their 'id' 
+	held = {}
+	for n in nodes[nid].values:
+		held[n] = None
+	number = {n : i for i, n in enumerate(held)}
+	order = np.argsort([number[n] for n in nodes[nid].values], kind = 'mergesort')
+	nodes = nodes.iloc[order].reset_index(drop = True)
+	ids = np.arange(len(nodes))
+	nodes['id'] = ids
+	labels = [layer + '_' + str(i) for layer, i in zip(nodes['layer'].values, ids)]
+	label_of = dict(zip([n for n in held], labels))
+
+	# a repeated edge is one edge of the graph, with the attributes of its last row
+	edges = edges.drop_duplicates([eidfrom, eidto], keep = 'last')
+	if 'capacity' in edges:
+		edges['capacity'] = edges['capacity'].astype(float)
+	multi = multiplex(columnar = True)
+	multi._store = columns.store_from_tables(labels, nodes, [label_of[u] for u in edges[eidfrom].values], 
+	                                         [label_of[v] for v in edges[eidto].values], edges)
+	del multi.G
+	multi.index_layers()
+	multi.update_layers()
+	return multi
+
 def igraph_route_summary(g, od, cost, layer, funs):
     """
     Summary:
-    	Compute a flexible summary of route information over shortest paths. 
+    	Compute a flexible summary of route information over shortest paths, found with full csr searches (see csr.target_paths()). 
     
     Args:
         g (igraph.Graph): the graph over which to compute shortest paths
@@ -666,6 +1204,10 @@ def igraph_route_summary(g, od, cost, layer, funs):
     """
     summary = []
     es = g.es
+    G = csr.csr_from_igraph(g, cost, capacity = None)
+    origins = [o for o in od if len(od[o]) > 0]
+    all_targets = [list(od[o].keys()) for o in origins]
+    all_paths = csr.target_paths(G, origins, all_targets)
     
     def entries(o, d, path, funs):
         labs = {'o' : o, 'd' : d} 
@@ -675,18 +1217,10 @@ def igraph_route_summary(g, od, cost, layer, funs):
         labs.update(metrics)
         return labs
     
-    for o in od:
-        ds = od[o]
-        if len(ds) > 0:
-            targets = ds.keys()
-            paths = g.get_shortest_paths(o, 
-                                         to=targets, 
-                                         weights=cost, 
-                                         mode='OUT', 
-                                         output='epath')
-            update = [entries(o, targets[i], paths[i], funs) 
-            		  for i in range(len(targets))]
-            summary += update
+    for o, targets, paths in zip(origins, all_targets, all_paths):
+        update = [entries(o, targets[i], paths[i], funs) 
+        		  for i in range(len(targets))]
+        summary += update
             
     return pd.DataFrame(summary)
     
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+class assignment_result:
+    '''
+    assignment_result holds the outcome of a traffic assignment on a multiplex (see multiplex.run_ita())
+    as NumPy arrays aligned with one edge order, that of multiplex.to_igraph(), which follows
+    multiplex.G.edges(). Results stay in these arrays until they are asked for: write() copies them into
+    the edge attribute dicts of a multiplex, so that many assignments (e.g. one per beta) need not each
+    add attributes to every edge of G.
+    attributes:
+        self.edges -- (list) the edges (u, v) of the multiplex, in the order of the arrays
+        self.flow -- (np.array) the flow on each edge
+        self.congested_time -- (np.array) the congested travel time of each edge
+        self.gradient -- (np.array) the congestion gradient of each edge, see costs.gradient()
+        self.details -- (pd.DataFrame) the route-by-route summary of the assignment, or None
+        self.flow_name -- (str) the edge attribute under which write() saves flows
+        self.attrname -- (str) the edge attribute under which write() saves congested times
+        self.relative_gap -- (list) for Frank-Wolfe assignments, the relative gap after each iteration, or None
+    '''
+    def __init__(self, edges, flow, congested_time, gradient = None, details = None, flow_name = 'flow', attrname = 'congested_time_m', relative_gap = None):
+        self.edges = list(edges)
+        self.flow = np.asarray(flow, dtype = np.float64)
+        self.congested_time = np.asarray(congested_time, dtype = np.float64)
+        self.gradient = None if gradient is None else np.asarray(gradient, dtype = np.float64)
+        self.details = details
+        self.flow_name = flow_name
+        self.attrname = attrname
+        self.relative_gap = relative_gap
+        self._positions = None
+
+    def __len__(self):
+        return len(self.edges)
+
+    def position(self, u, v):
+        """
+        Summary:
+            Find the position of an edge in the arrays of self.
+
+        Args:
+            u: the source of the edge
+            v: the target of the edge
+
+        Returns:
+            int: the position of (u, v), or None if it is not an edge of self
+        """
+        if self._positions is None:
+            self._positions = {e : i for i, e in enumerate(self.edges)}
+        return self._positions.get((u, v))
+
+    def aligned(self, edges, values = None, default = 0.):
+        """
+        Summary:
+            Reorder an array of self, the flows by default, to another edge order, e.g. that of the multiplex
+            after it has changed.
+
+        Args:
+            edges (list): the edges (u, v) in the order wanted
+            values (np.array, optional): values aligned with self.edges, self.flow if not given
+            default (float, optional): the value of edges missing from self
+
+        Returns:
+            np.array: the values of edges
+        """
+        values = self.flow if values is None else values
+        if edges == self.edges:
+            return np.array(values, dtype = np.float64)
+        positions = [self.position(u, v) for u, v in edges]
+        return np.array([default if i is None else values[i] for i in positions], dtype = np.float64)
+
+    def to_df(self, gradient = False):
+        """
+        Summary:
+            Tabulate the results of self, one row per edge.
+
+        Args:
+            gradient (bool, optional): whether to include a 'gradient' column
+
+        Returns:
+            pd.DataFrame: a df with columns 'source', 'target', self.flow_name and self.attrname
+        """
+        df = pd.DataFrame({'source' : [u for u, v in self.edges],
+                           'target' : [v for u, v in self.edges],
+                           self.flow_name : self.flow,
+                           self.attrname : self.congested_time},
+                          columns = ['source', 'target', self.flow_name, self.attrname])
+        if gradient:
+            df['gradient'] = self.gradient
+        return df
+
+    def write(self, multi, gradient = False):
+        """
+        Summary:
+            Write the results of self into the edge attribute dicts of a multiplex, or the edge columns of a
+            columnar multiplex, under self.flow_name and self.attrname. Edges of the multiplex missing from self
+            are left unchanged.
+
+        Args:
+            multi (multiplex.multiplex): the multiplex assigned on
+            gradient (bool, optional): whether to also write the gradient, as 'gradient'
+
+        Returns:
+            None
+        """
+        columns = [(self.flow_name, self.flow), (self.attrname, self.congested_time)]
+        if gradient:
+            columns.append(('gradient', self.gradient))
+        if getattr(multi, 'columnar', False):
+            store = multi.columns()
+            ids = store.edge_ids(self.edges)
+            found = ids >= 0
+            for name, values in columns:
+                store.set_edge_attribute(name, values[found], ids[found], np.float64)
+            multi.columns_changed()
+            return
+        for i, (u, v) in enumerate(self.edges):
+            if multi.G.has_edge(u, v):
+                attr = multi.G.edge[u][v]
+                for name, values in columns:
+                    attr[name] = float(values[i])
+        multi.mutated()
+
+def read_csv(file_name, multi, flow_name, attrname, **kwargs):
+    """
+    Summary:
+        Read an assignment_result from a table with columns 'source', 'target', flow_name and attrname,
+        as written by assignment_result.to_df(), matching its edges to those of a multiplex by name.
+
+    Args:
+        file_name (str): the table
+        multi (multiplex.multiplex): the multiplex assigned on
+        flow_name (str): the column of flows
+        attrname (str): the column of congested times
+        **kwargs: additional arguments passed to pd.read_csv()
+
+    Returns:
+        assignment_result: the result, without gradient or details
+    """
+    df = pd.read_csv(file_name, **kwargs)
+    labels = multi.columns().labels if getattr(multi, 'columnar', False) else multi.G.nodes_iter()
+    nodes = {str(n) : n for n in labels}
+    edges = [(nodes[str(u)], nodes[str(v)]) for u, v in zip(df['source'], df['target'])]
+    return assignment_result(edges, df[flow_name].values, df[attrname].values, flow_name = flow_name, attrname = attrname)
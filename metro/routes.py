@@ -0,0 +1,218 @@
+import numpy as np
+import os
+from scipy.sparse import csr_matrix
+from metro.utility import check_directory
+
+# column name, dtype and file suffix of each column of a route store
+COLUMNS = [('o', np.int32),
+           ('d', np.int32),
+           ('p', np.float64),
+           ('flow', np.float64),
+           ('ends', np.int64),
+           ('edges', np.int32)]
+
+class route_store:
+    '''
+    route_store keeps the routes of an assignment on disk as flat binary columns,
+    one raw little-endian file per column, so that routes never pass through text
+    and can be read back with np.memmap. Each route has an origin 'o', destination
+    'd', increment 'p' and OD 'flow'; its edges are edges[starts[i]:ends[i]], where
+    'ends' holds the running total of edges written. Routes are appended, typically
+    once per increment, and the store's size is read off the files so that several
+    processes can each write their own store.
+    attributes:
+        self.prefix -- (str) path prefix of the column files, e.g. '3_throughput/routes'
+    '''
+    def __init__(self, prefix):
+        self.prefix = prefix
+        check_directory(os.path.dirname(prefix) or '.')
+
+    def file_name(self, col):
+        return self.prefix + '.' + col + '.bin'
+
+    def size(self):
+        """
+        Summary:
+            Count the routes and edges currently in the store.
+
+        Returns:
+            tuple: (number of routes, number of edges)
+        """
+        sizes = []
+        for col, dtype in [('ends', np.int64), ('edges', np.int32)]:
+            f = self.file_name(col)
+            sizes.append(os.path.getsize(f) // np.dtype(dtype).itemsize if os.path.exists(f) else 0)
+        return tuple(sizes)
+
+    def append(self, o, d, p, flow, lengths, edges):
+        """
+        Summary:
+            Append a block of routes to the store.
+
+        Args:
+            o (np.array): origin of each route
+            d (np.array): destination of each route
+            p (float or np.array): increment of each route
+            flow (np.array): OD flow of each route
+            lengths (np.array): number of edges of each route
+            edges (np.array): the edges of all routes, concatenated in route order
+
+        Returns:
+            None
+        """
+        n_routes, n_edges = self.size()
+        columns = {'o' : o,
+                   'd' : d,
+                   'p' : np.zeros(len(o)) + p,
+                   'flow' : flow,
+                   'ends' : n_edges + np.cumsum(lengths),
+                   'edges' : edges}
+        for col, dtype in COLUMNS:
+            with open(self.file_name(col), 'ab') as f:
+                np.asarray(columns[col], dtype = dtype).tofile(f)
+
+    def load(self, mmap = True):
+        """
+        Summary:
+            Read the store's columns.
+
+        Args:
+            mmap (bool, optional): if True, memory-map the column files rather than reading them into memory
+
+        Returns:
+            dict: one array per column, plus 'starts', the position of each route's first edge
+        """
+        routes = {}
+        for col, dtype in COLUMNS:
+            f = self.file_name(col)
+            if not os.path.exists(f) or os.path.getsize(f) == 0:
+                routes[col] = np.zeros(0, dtype = dtype)
+            elif mmap:
+                routes[col] = np.memmap(f, dtype = dtype, mode = 'r')
+            else:
+                routes[col] = np.fromfile(f, dtype = dtype)
+        ends = routes['ends']
+        routes['starts'] = np.concatenate(([0], ends[:-1])).astype(np.int64) if len(ends) > 0 else np.zeros(0, dtype = np.int64)
+        return routes
+
+    def replace(self, col, values):
+        """
+        Summary:
+            Overwrite a per-route column of the store, e.g. to reweight routes once an assignment has finished.
+
+        Args:
+            col (str): the column, one of 'o', 'd', 'p' or 'flow'
+            values (np.array): one value per route
+
+        Returns:
+            None
+        """
+        dtype = dict(COLUMNS)[col]
+        with open(self.file_name(col), 'wb') as f:
+            np.asarray(values, dtype = dtype).tofile(f)
+
+    def truncate(self, n_routes, n_edges):
+        """
+        Summary:
+            Cut the store back to its first n_routes routes, holding n_edges edges, e.g. to discard routes written after a checkpoint.
+
+        Args:
+            n_routes (int): the number of routes to keep
+            n_edges (int): the number of edges those routes hold
+
+        Returns:
+            None
+        """
+        for col, dtype in COLUMNS:
+            size = (n_edges if col == 'edges' else n_routes) * np.dtype(dtype).itemsize
+            if os.path.exists(self.file_name(col)):
+                with open(self.file_name(col), 'r+b') as f:
+                    f.truncate(size)
+
+    def remove(self):
+        """
+        Summary:
+            Delete the store's files.
+
+        Returns:
+            None
+        """
+        for col, dtype in COLUMNS:
+            if os.path.exists(self.file_name(col)):
+                os.remove(self.file_name(col))
+
+def incidence_matrix(route_table, n_edges, weights = None, lo = 0, hi = None):
+    """
+    Summary:
+        Construct the sparse route-by-edge incidence matrix of a range of routes. Row i holds weights[i]
+        in the column of every edge of route i, so the product with an edge attribute vector gives the
+        weighted sum of the attribute along each route.
+
+    Args:
+        route_table (dict): the columns of a route store, as returned by route_store.load()
+        n_edges (int): the number of edges of the network
+        weights (np.array, optional): the weight of each route in the range, e.g. its increment p; defaults to 1
+        lo (int, optional): the first route of the range
+        hi (int, optional): the end of the range; defaults to the number of routes
+
+    Returns:
+        scipy.sparse.csr_matrix: the (hi - lo) by n_edges incidence matrix
+    """
+    if hi is None:
+        hi = len(route_table['ends'])
+    starts, ends = route_table['starts'][lo:hi], route_table['ends'][lo:hi]
+    first = starts[0] if hi > lo else 0
+    indptr = np.concatenate(([0], ends - first))
+    if weights is None:
+        data = np.ones(indptr[-1])
+    else:
+        data = np.repeat(weights, ends - starts)
+    return csr_matrix((data, np.asarray(route_table['edges'][first:first + indptr[-1]]), indptr),
+                      shape = (hi - lo, n_edges))
+
+def route_metrics(route_table, X, chunk_size = 2 ** 20):
+    """
+    Summary:
+        Sum edge attributes along every route of a store, as products of the route-edge incidence
+        matrix with the attribute vectors. Any per-edge quantity can be summed this way, e.g. the
+        metro share of distance from dist_km restricted to metro edges, or transfer counts from an
+        indicator of transfer edges.
+
+    Args:
+        route_table (dict): the columns of a route store, as returned by route_store.load()
+        X (np.array): edge attributes, one row per edge and one column per attribute (or a single vector)
+        chunk_size (int, optional): the number of routes handled at a time, bounding memory use
+
+    Returns:
+        np.array: the sum of each attribute over each route, one row per route
+    """
+    X = np.asarray(X, dtype = np.float64)
+    n_routes = len(route_table['ends'])
+    out = np.zeros((n_routes,) + X.shape[1:])
+    for lo in range(0, n_routes, chunk_size):
+        hi = min(lo + chunk_size, n_routes)
+        out[lo:hi] = incidence_matrix(route_table, X.shape[0], lo = lo, hi = hi).dot(X)
+    return out
+
+def od_aggregation(o, d, weights):
+    """
+    Summary:
+        Construct a sparse matrix that sums weighted rows by (origin, destination) pair.
+
+    Args:
+        o (np.array): origin of each row
+        d (np.array): destination of each row
+        weights (np.array): weight of each row, e.g. its increment p
+
+    Returns:
+        np.array: origin of each pair
+        np.array: destination of each pair
+        scipy.sparse.csr_matrix: the pairs by rows aggregation matrix
+    """
+    o = np.asarray(o, dtype = np.int64)
+    d = np.asarray(d, dtype = np.int64)
+    n = max(o.max(), d.max()) + 1 if len(o) else 1
+    pairs, inverse = np.unique(o * n + d, return_inverse = True)
+    A = csr_matrix((np.asarray(weights, dtype = np.float64), (inverse, np.arange(len(o)))),
+                   shape = (len(pairs), len(o)))
+    return pairs // n, pairs % n, A
@@ -0,0 +1,101 @@
+import numpy as np
+import costs
+
+class overlay:
+    '''
+    overlay describes a scenario as changes to the edge costs of a multiplex that are applied on the fly,
+    to the igraph copy that an assignment or shortest path computation works on, rather than to the
+    multiplex itself: per-layer multipliers of an edge attribute (e.g. the metro free flow times scaled by
+    beta) and replacement values of an edge attribute. The base multiplex is never changed, so any number
+    of scenarios can share it, one after another or at the same time, and applying a scenario twice gives
+    exactly the same costs. See multiplex.add_overlay() and the overlay argument of multiplex.run_ita(),
+    multiplex.path_lengths() and multiplex.route_summary().
+    attributes:
+        self.name -- (str) the name of the scenario
+        self.multipliers -- (dict) per edge attribute, a dict of multipliers by layer; edges of other layers are unchanged
+        self.replacements -- (dict) per edge attribute, its new values: an array with one value per edge in the order of
+                             multiplex.to_igraph(), or a dict of values keyed by edge (u, v) for some edges only
+    '''
+    def __init__(self, name = None, multipliers = None, replacements = None):
+        self.name = name
+        self.multipliers = multipliers or {}
+        self.replacements = replacements or {}
+
+    def attributes(self):
+        """
+        Summary:
+            List the edge attributes that self changes.
+
+        Returns:
+            list: the attributes
+        """
+        return sorted(set(self.multipliers) | set(self.replacements))
+
+    def costs(self, attr, base, layers, edges = None):
+        """
+        Summary:
+            Compute the effective values of an edge attribute under self: its replacement values where
+            given, otherwise its base values, times the multiplier of each edge's layer.
+
+        Args:
+            attr (str): the edge attribute
+            base (np.array): the base value of each edge
+            layers (list): the layer of each edge
+            edges (list, optional): the edges (u, v), in the order of base; needed for replacements keyed by edge
+
+        Returns:
+            np.array: the effective value of each edge
+        """
+        values = np.array(base, dtype = np.float64)
+        replacement = self.replacements.get(attr)
+        if isinstance(replacement, dict):
+            for i, e in enumerate(edges):
+                if e in replacement:
+                    values[i] = replacement[e]
+        elif replacement is not None:
+            replacement = np.asarray(replacement, dtype = np.float64)
+            if len(replacement) != len(values):
+                raise ValueError('overlay ' + str(self.name) + ' replaces ' + attr + ' on ' + str(len(replacement)) +
+                                 ' edges, but the graph has ' + str(len(values)))
+            values = replacement.copy()
+        if attr in self.multipliers:
+            values *= costs.edge_parameters(self.multipliers[attr], layers, default = 1.)
+        return values
+
+    def apply(self, g):
+        """
+        Summary:
+            Set the effective costs of self on the edges of an igraph graph, e.g. a copy returned by
+            multiplex.to_igraph(), whose edges carry the attributes changed and 'layer'.
+
+        Args:
+            g (igraph.Graph): the graph, changed in place
+
+        Returns:
+            igraph.Graph: g
+        """
+        layers = g.es['layer']
+        edges = None
+        if any(isinstance(r, dict) for r in self.replacements.values()):
+            names = g.vs['name']
+            edges = [(names[u], names[v]) for u, v in g.get_edgelist()]
+        for attr in self.attributes():
+            g.es[attr] = self.costs(attr, g.es[attr], layers, edges).tolist()
+        return g
+
+def route_file(overlay, prefix = '3_throughput/routes'):
+    """
+    Summary:
+        Name the route store of an assignment under a scenario, so that assignments of different scenarios that
+        run at the same time do not remove or append to each other's routes.
+
+    Args:
+        overlay (overlay): the scenario, or None
+        prefix (str, optional): the path prefix of the route store without a scenario
+
+    Returns:
+        str: prefix, suffixed by '_' and the name of overlay if it has one
+    """
+    if overlay is None or overlay.name is None:
+        return prefix
+    return prefix + '_' + str(overlay.name)
@@ -0,0 +1,175 @@
+import numpy as np
+import igraph as ig
+from metro import costs
+from metro import demand
+
+class routing_graph:
+    '''
+    routing_graph is a contracted copy of an igraph network for routing and assignment. Two
+    kinds of vertices are contracted:
+        - leaves joined to a single other vertex (their hub) by a pair of free edges, such as
+          the taz connectors that spatial_join() attaches to streets with base_cost = 0, are
+          merged into their hub: their transfer edges are dropped and their demand is moved
+          to the hub;
+        - pass-through vertices, with one edge in and one out, or a pair of edges to each of
+          two neighbours, all in the same layer and without demand, are bypassed: each chain
+          of them becomes a single edge, whose additive attributes (time, distance) are the
+          sums over the chain and whose bottleneck attributes (capacity) are the minimum.
+    Vertices keep their ids, so contracted vertices are left without edges. The mapping of
+    original edges onto routing edges is kept, so that flows on the routing graph can be
+    expanded exactly onto the original edges (see expand()): every edge of a chain carries
+    the chain's flow, and a leaf's transfer edges carry the demand from and to the leaf.
+    The graph is built from an igraph network g with a 'layer' edge attribute and an OD matrix
+    od keyed to its vertices; edges whose base_cost is at most free count as free, edge
+    attributes in additive are summed along chains, those in bottleneck are minimised, and
+    the others are taken from the first edge of each chain.
+    attributes:
+        self.original -- (igraph.Graph) the network
+        self.g -- (igraph.Graph) the routing graph, on the vertices of self.original
+        self.od -- (demand.od_matrix) the OD matrix, keyed to vertices of self.g
+        self.hub -- (np.array) the vertex each vertex of self.original is merged into; itself if not merged
+        self.edge_of -- (np.array) for each original edge, the routing edge whose flow it carries, or -1 for transfer edges of merged leaves
+        self.leaf_out -- (np.array) original edges from a merged leaf to its hub
+        self.leaf_in -- (np.array) original edges from a hub to a merged leaf
+        self.demand_out -- (np.array) the demand originating at the tail of each edge of self.leaf_out
+        self.demand_in -- (np.array) the demand destined to the head of each edge of self.leaf_in
+    '''
+    def __init__(self, g, od, base_cost = 'free_flow_time_m', free = 1e-9,
+                 additive = ['free_flow_time_m', 'uniform_time_m', 'dist_km'], bottleneck = ['capacity']):
+        self.original = g
+        n, m = g.vcount(), g.ecount()
+        edges = np.array(g.get_edgelist(), dtype = np.int64).reshape(-1, 2)
+        tails, heads = edges[:, 0], edges[:, 1]
+        base = np.array(g.es[base_cost], dtype = np.float64)
+        layer = g.es['layer']
+
+        out_edges = [[] for v in range(n)]
+        in_edges = [[] for v in range(n)]
+        for e, (u, v) in enumerate(edges.tolist()):
+            if u != v:
+                out_edges[u].append(e)
+                in_edges[v].append(e)
+
+        # leaves joined to their hub by free edges in both directions
+        self.hub = np.arange(n)
+        for v in range(n):
+            if len(out_edges[v]) == 1 and len(in_edges[v]) == 1:
+                e, f = out_edges[v][0], in_edges[v][0]
+                h = heads[e]
+                if tails[f] == h and base[e] <= free and base[f] <= free and len(out_edges[h]) > 1:
+                    self.hub[v] = h
+        merged = self.hub != np.arange(n)
+        self.leaf_out = np.nonzero(merged[tails])[0]
+        self.leaf_in = np.nonzero(merged[heads])[0]
+
+        key_map = {v : int(self.hub[v]) for v in np.nonzero(merged)[0].tolist()}
+        self.od = demand.merge_od(od, key_map)
+        demand_out, demand_in = np.zeros(n), np.zeros(n)
+        for o in od:
+            d, f = demand.row_arrays(od, o)
+            # trips that start where they end are not routed
+            f = f[d != o]
+            demand_out[o] += f.sum()
+            np.add.at(demand_in, d[d != o], f)
+        self.demand_out = demand_out[tails[self.leaf_out]]
+        self.demand_in = demand_in[heads[self.leaf_in]]
+
+        # pass-through vertices, among the edges that remain
+        kept = ~(merged[tails] | merged[heads]) & (tails != heads)
+        out_edges = [[e for e in es if kept[e]] for es in out_edges]
+        in_edges = [[e for e in es if kept[e]] for es in in_edges]
+        ends = set(self.od.labels[self.od.origins].tolist()) | set(self.od.labels[self.od.destinations].tolist())
+        through = np.zeros(n, dtype = bool)
+        for v in range(n):
+            if v in ends or merged[v] or len(set(layer[e] for e in out_edges[v] + in_edges[v])) != 1:
+                continue
+            succ = sorted(heads[out_edges[v]].tolist())
+            pred = sorted(tails[in_edges[v]].tolist())
+            if (len(succ) == 1 and len(pred) == 1 and succ != pred) or \
+               (len(succ) == 2 and succ == pred and succ[0] != succ[1]):
+                through[v] = True
+
+        # walk the chains from every edge leaving a vertex that is not passed through
+        pairs = set((u, v) for u, v in edges[kept & ~through[tails] & ~through[heads]].tolist())
+        chains = []
+        covered = np.zeros(m, dtype = bool)
+        for e in np.nonzero(kept & ~through[tails])[0].tolist():
+            chain = [e]
+            while through[heads[chain[-1]]]:
+                v, previous = heads[chain[-1]], tails[chain[-1]]
+                chain.append([f for f in out_edges[v] if heads[f] != previous][0])
+            covered[chain] = True
+            u, v = tails[chain[0]], heads[chain[-1]]
+            if len(chain) == 1:
+                chains.append(chain)
+            elif u != v and (u, v) not in pairs:
+                pairs.add((u, v))
+                chains.append(chain)
+            else:
+                chains.extend([[f] for f in chain])
+        # edges of rings of pass-through vertices are never reached from outside them
+        chains.extend([[e] for e in np.nonzero(kept & ~covered)[0].tolist()])
+
+        self.members = np.array([e for chain in chains for e in chain], dtype = np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum([len(chain) for chain in chains])))
+        self.edge_of = np.repeat(-1, m)
+        self.edge_of[self.members] = np.repeat(np.arange(len(chains)), np.diff(self.offsets))
+
+        first = self.members[self.offsets[:-1]]
+        last = self.members[self.offsets[1:] - 1]
+        self.g = ig.Graph(n = n, edges = zip(tails[first].tolist(), heads[last].tolist()), directed = True)
+        for attr in g.vs.attributes():
+            self.g.vs[attr] = g.vs[attr]
+        for attr in g.es.attributes():
+            values = g.es[attr]
+            if attr in additive:
+                self.g.es[attr] = np.add.reduceat(np.array(values, dtype = np.float64)[self.members], self.offsets[:-1]).tolist()
+            elif attr in bottleneck:
+                self.g.es[attr] = np.minimum.reduceat(np.array(values, dtype = np.float64)[self.members], self.offsets[:-1]).tolist()
+            else:
+                self.g.es[attr] = [values[e] for e in first.tolist()]
+
+    def expand_flow(self, flow, scale = 1):
+        """
+        Summary:
+            Expand flows on the routing graph onto the original edges. Transfer edges of merged leaves carry all of
+            the leaf's demand, times scale.
+
+        Args:
+            flow (list): the flow through each routing edge
+            scale (float, optional): the proportion of demand that was assigned
+
+        Returns:
+            np.array: the flow through each original edge
+        """
+        flow = np.asarray(flow, dtype = np.float64)
+        expanded = np.zeros(len(self.edge_of))
+        expanded[self.members] = flow[self.edge_of[self.members]]
+        expanded[self.leaf_out] = scale * self.demand_out
+        expanded[self.leaf_in] = scale * self.demand_in
+        return expanded
+
+    def expand(self, scale = 1, base_cost = 'free_flow_time_m', a = costs.BPR_A, b = costs.BPR_B):
+        """
+        Summary:
+            Write the 'flow' of an assignment on self.g onto the edges of self.original, with the 'congested_time_m'
+            of each original edge computed from its own base cost, capacity and flow.
+
+        Args:
+            scale (float, optional): the proportion of demand that was assigned
+            base_cost (str, optional): the edge attribute of base cost
+            a (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+            b (float or dict, optional): BPR parameter, or a dict of BPR parameters keyed by layer
+
+        Returns:
+            None
+        """
+        es = self.original.es
+        flow = self.expand_flow(self.g.es['flow'], scale)
+        layers = es['layer'] if isinstance(a, dict) or isinstance(b, dict) else None
+        es['flow'] = flow.tolist()
+        es['congested_time_m'] = costs.bpr(es[base_cost],
+                                           flow,
+                                           np.array(es['capacity'], dtype = np.float64),
+                                           costs.edge_parameters(a, layers, costs.BPR_A),
+                                           costs.edge_parameters(b, layers, costs.BPR_B)).tolist()
@@ -0,0 +1,153 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+LAT_DIST = 110766.95237186992 / 1000.0 # in km. See http://www.csgnetwork.com/degreelenllavcalc.html
+LON_DIST = 101274.42720366278 / 1000.0 # in km. See http://www.csgnetwork.com/degreelenllavcalc.html
+
+class spatial_index:
+    '''
+    spatial_index is a k-d tree over a set of points given as (lon, lat), projected to kilometers
+    by scaling with LON_DIST and LAT_DIST, so that Euclidean distances between projected points are
+    the distances of analysis.distance(). It answers nearest, k-nearest and radius queries for whole
+    arrays of query points at once. Build it once per set of points (see multiplex.spatial_index(),
+    which keeps one per layer) and share it between queries.
+    attributes:
+        self.names -- (np.array) the name of each point, e.g. its node, or its position if not given
+        self.positions -- (np.array) the (lon, lat) of each point, shape (n, 2)
+        self.points -- (np.array) the projected positions of the points, in kilometers
+        self.tree -- (scipy.spatial.cKDTree) the tree over self.points
+    '''
+    def __init__(self, positions, names = None, leafsize = 16):
+        self.positions = np.asarray(positions, dtype = np.float64).reshape(-1, 2)
+        self.names = np.arange(len(self.positions)) if names is None else np.asarray(names, dtype = object)
+        self.points = project(self.positions)
+        self.tree = cKDTree(self.points, leafsize = leafsize)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def nearest(self, positions):
+        """
+        Summary:
+            Find the nearest point of self to each of a batch of positions.
+
+        Args:
+            positions (np.array): the (lon, lat) of each query, shape (m, 2)
+
+        Returns:
+            np.array: the index in self of the nearest point to each query
+            np.array: the distance to it, in kilometers
+        """
+        dist, index = self.tree.query(project(positions), k = 1)
+        return index.astype(np.int64), dist
+
+    def k_nearest(self, positions, k):
+        """
+        Summary:
+            Find the k nearest points of self to each of a batch of positions, nearest first. If self
+            has fewer than k points, all of them are returned.
+
+        Args:
+            positions (np.array): the (lon, lat) of each query, shape (m, 2)
+            k (int): the number of points to find per query
+
+        Returns:
+            np.array: the indices in self of the nearest points, shape (m, min(k, len(self)))
+            np.array: the distances to them, in kilometers, of the same shape
+        """
+        k = min(k, len(self))
+        dist, index = self.tree.query(project(positions), k = k)
+        return index.reshape(-1, k).astype(np.int64), dist.reshape(-1, k)
+
+    def within(self, positions, radius):
+        """
+        Summary:
+            Find all points of self within a radius of each of a batch of positions, nearest first.
+            The results for all queries are flattened into one pair of arrays, those of query i
+            being found between offsets[i] and offsets[i + 1].
+
+        Args:
+            positions (np.array): the (lon, lat) of each query, shape (m, 2)
+            radius (float): the search radius, in kilometers
+
+        Returns:
+            np.array: the offsets of the results of each query, of length m + 1
+            np.array: the indices in self of the points found
+            np.array: the distances to them, in kilometers
+        """
+        queries = project(positions)
+        found = self.tree.query_ball_point(queries, radius)
+        counts = np.array([len(f) for f in found], dtype = np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        index = np.fromiter((i for f in found for i in f), dtype = np.int64, count = offsets[-1])
+        query = np.repeat(np.arange(len(queries)), counts)
+        dist = np.sqrt(((self.points[index] - queries[query]) ** 2).sum(axis = 1))
+
+        # nearest first within each query
+        order = np.lexsort((dist, query))
+        return offsets, index[order], dist[order]
+
+def project(positions):
+    """
+    Summary:
+        Project (lon, lat) positions to kilometers, as analysis.distance() does.
+
+    Args:
+        positions (np.array): the (lon, lat) of each position, shape (n, 2)
+
+    Returns:
+        np.array: the projected positions, shape (n, 2)
+    """
+    return np.asarray(positions, dtype = np.float64).reshape(-1, 2) * [LON_DIST, LAT_DIST]
+
+def index_of(G, nodes = None):
+    """
+    Summary:
+        Build a spatial_index over nodes of a networkx graph from their 'lon' and 'lat' attributes.
+
+    Args:
+        G (networkx.DiGraph): the graph
+        nodes (iterable, optional): the nodes to index, all nodes of G if not given
+
+    Returns:
+        spatial_index: the index, whose names are the nodes
+    """
+    nodes = sorted(G.nodes() if nodes is None else nodes)
+    positions = [(G.node[n]['lon'], G.node[n]['lat']) for n in nodes]
+    return spatial_index(positions, names = nodes)
+
+def candidates(index, positions, k = 1, radius = None):
+    """
+    Summary:
+        Find the candidates of each of a batch of positions among the points of an index: its k nearest
+        points, together with all points within a radius if one is given. Every query therefore has at
+        least min(k, len(index)) candidates, however far they are.
+
+    Args:
+        index (spatial_index): the points to search
+        positions (np.array): the (lon, lat) of each query, shape (m, 2)
+        k (int, optional): the number of nearest points to take for every query
+        radius (float, optional): the radius, in kilometers, within which to take all points
+
+    Returns:
+        np.array: the query of each candidate, in increasing order
+        np.array: the index in index of each candidate, nearest first for each query
+        np.array: the distance to each candidate, in kilometers
+    """
+    nearest, nearest_dist = index.k_nearest(positions, k)
+    query = np.repeat(np.arange(len(nearest)), nearest.shape[1])
+    found, dist = nearest.ravel(), nearest_dist.ravel()
+
+    if radius is not None:
+        offsets, within, within_dist = index.within(positions, radius)
+        query = np.concatenate([query, np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))])
+        found = np.concatenate([found, within])
+        dist = np.concatenate([dist, within_dist])
+
+        # points among both the nearest and those within the radius are kept once
+        keys = query * len(index) + found
+        keys, first = np.unique(keys, return_index = True)
+        query, found, dist = query[first], found[first], dist[first]
+
+    order = np.lexsort((dist, query))
+    return query[order], found[order], dist[order]
@@ -3,6 +3,7 @@ import numpy as np
 import igraph as ig
 import pandas as pd
 import os
+from metro import spatial
 
 
 # -----------------------------------------------------------------------------
@@ -22,8 +23,30 @@ def check_directory(directory):
 		os.makedirs(directory)
 
 
-def graph_from_txt(nodes_file_name = None, edges_file_name = None, sep = '\t', nid = None, eidfrom = None, eidto = None):
-	"""Summary
+def tables_from_txt(nodes_file_name = None, edges_file_name = None, sep = '\t', nid = None, eidfrom = None, eidto = None, node_columns = None, edge_columns = None, node_dtypes = None, edge_dtypes = None):
+	"""Read node and edge tables, each parsed once, with the dtypes given and the others inferred (columns that are 
+	entirely numeric become numeric). See graph_from_txt() for the arguments. 
+	
+	Returns:
+		pandas.DataFrame: the nodes
+		pandas.DataFrame: the edges, or None if edges_file_name is None
+	"""
+	def read(file_name, ids, columns, dtypes):
+		usecols = None if columns is None else lambda col : col in ids or col in columns
+		df = pd.read_csv(file_name, sep = sep, index_col = False, usecols = usecols, dtype = dtypes)
+		for col in df:
+			if dtypes is None or col not in dtypes:
+				df[col] = pd.to_numeric(df[col], errors = 'ignore')
+		return df
+
+	nodes = read(nodes_file_name, [nid], node_columns, node_dtypes)
+	edges = read(edges_file_name, [eidfrom, eidto], edge_columns, edge_dtypes) if edges_file_name is not None else None
+	return nodes, edges
+
+def graph_from_txt(nodes_file_name = None, edges_file_name = None, sep = '\t', nid = None, eidfrom = None, eidto = None, node_columns = None, edge_columns = None, node_dtypes = None, edge_dtypes = None):
+	"""Read a graph from node and edge tables in bulk: each table is parsed once, with the dtypes given and the others 
+	inferred (columns that are entirely numeric become numeric), and the graph is built in one call per table from 
+	the column arrays, every column becoming an attribute. 
 	
 	Args:
 		nodes_file_name (str, optional): the file in which to find node ids and attributes
@@ -32,32 +55,25 @@ def graph_from_txt(nodes_file_name = None, edges_file_name = None, sep = '\t', n
 		nid (str, optional): the hashable attribute used to identify nodes
 		eidfrom (str, optional): the hashable attribute used to identify sources of edges (must match nid)
 		eidto (str, optional): the hashable attribute used to identify targets of edges (must match nid)
+		node_columns (list, optional): the node attributes to read, besides nid; all of them if not given
+		edge_columns (list, optional): the edge attributes to read, besides eidfrom and eidto; all of them if not given
+		node_dtypes (dict, optional): the dtype of some node columns, e.g. {'lon' : np.float64}
+		edge_dtypes (dict, optional): the dtype of some edge columns, e.g. {'capacity' : np.float64}
 	
 	Returns:
 		a networkx.DiGraph() object
 	"""
-	nodes = pd.read_table(nodes_file_name, sep = sep, index_col=False)
-	for col in nodes:
-		nodes[col] = pd.to_numeric(nodes[col], errors = 'ignore')
-	
-	N = nx.DiGraph()
-	for n in range(len(nodes)):
-		attr = {nid: nodes[nid][n]}
-		attr2 = {col: nodes[col][n] for col in list(nodes) if col != nid}
-		attr.update(attr2)
-		
-		N.add_node(n = nodes[nid][n], attr_dict = attr)
+	def records(df):
+		columns = list(df)
+		return [dict(zip(columns, row)) for row in zip(*[df[col].values for col in columns])]
 
-	if edges_file_name is not None: 
-		edges = pd.read_table(edges_file_name, sep = sep, index_col=False)
-		for col in edges:
-			edges[col] = pd.to_numeric(edges[col], errors = 'ignore')
+	nodes, edges = tables_from_txt(nodes_file_name, edges_file_name, sep, nid, eidfrom, eidto, 
+	                               node_columns, edge_columns, node_dtypes, edge_dtypes)
+	N = nx.DiGraph()
+	N.add_nodes_from(zip(nodes[nid].values, records(nodes)))
 
-		for e in range(len(edges)):
-			attr = {eidfrom : edges[eidfrom][e], eidto : edges[eidto][e]}
-			attr2 = {col: edges[col][e] for col in list(edges)}
-			attr.update(attr2)
-			N.add_edge(edges[eidfrom][e], edges[eidto][e], attr)
+	if edges is not None: 
+		N.add_edges_from(zip(edges[eidfrom].values, edges[eidto].values, records(edges)))
 
 	return N
 
@@ -146,31 +162,36 @@ def write_nx_edges(N, directory, file_name):
 # NETWORK CONVERSIONS
 # -----------------------------------------------------------------------------
 
-def nx_2_igraph(graph):
-	"""convert a networkx.DiGraph() object into an igraph.Graph() object. 
+def nx_2_igraph(graph, node_attrs = None, edge_attrs = None):
+	"""convert a networkx.DiGraph() object into an igraph.Graph() object, built in one call from the edge list. 
+	Vertices are named by str() of the nodes and follow the order of graph.nodes(), and edges that of graph.edges(). 
+	The networkx graph is left unchanged. 
 	
 	Args:
 		graph (networkx.DiGraph()): the network to convert
+		node_attrs (list, optional): the node attributes to copy, all of them if not given
+		edge_attrs (list, optional): the edge attributes to copy, all of them except 'source' and 'target' if not given
 	
 	Returns:
 		igraph.Graph(): the converted network in igraph format
 	"""
-	ig_graph = ig.Graph()
-	ig_graph = ig_graph.as_directed(mutual = False)
+	nodes = graph.nodes()
+	edges = graph.edges(data = True)
+	index = {n : i for i, n in enumerate(nodes)}
 
-	nodes = graph.node.keys()
-	edges = graph.edges_iter()
+	ig_graph = ig.Graph(n = len(nodes), edges = [(index[u], index[v]) for u, v, attr in edges], directed = True)
+	ig_graph.vs['name'] = [str(n) for n in nodes]
 
-	for n in nodes:
-		attr = graph.node[n]
-		ig_graph.add_vertex(str(n), **attr)
+	if node_attrs is None:
+		node_attrs = set().union(*[graph.node[n].keys() for n in nodes]) - set(['name'])
+	for a in node_attrs:
+		ig_graph.vs[a] = [graph.node[n].get(a) for n in nodes]
+
+	if edge_attrs is None:
+		edge_attrs = set().union(*[attr.keys() for u, v, attr in edges]) - set(['source', 'target'])
+	for a in edge_attrs:
+		ig_graph.es[a] = [attr.get(a) for u, v, attr in edges]
 
-	for e in edges:
-		attr = graph[e[0]][e[1]]
-		attr.pop('source', None)
-		attr.pop('target', None)
-		ig_graph.add_edge(str(e[0]), str(e[1]), **attr)
-		
 	return ig_graph
 
 def igraph_2_nx(ig_graph):
@@ -281,9 +302,10 @@ def spatial_multiplex_join(N1, N2, TRANSFER_SPEED):
 
 	N1_sub = multiplex.subgraph(N1_nodes)
 	N2_sub = multiplex.subgraph(N2_nodes)
+	index = spatial.index_of(N2_sub)
 
 	for n in N1_sub.node:
-		nearest, nearest_dist = find_nearest(n, N1_sub, N2_sub)
+		nearest, nearest_dist = find_nearest(n, N1_sub, N2_sub, index)
 		multiplex.add_edge(n, 
 		                   nearest, 
 		                   {'dist_km' : nearest_dist, 
@@ -301,6 +323,24 @@ def spatial_multiplex_join(N1, N2, TRANSFER_SPEED):
 
 	return multiplex
 
+def find_nearest(n, N1, N2, index = None):
+	"""find the node of N2 spatially nearest to a node of N1, from their 'lon' and 'lat' attributes
+	
+	Args:
+		n (str): the node of N1
+		N1 (networkx.DiGraph()): the network of n
+		N2 (networkx.DiGraph()): the network in which to search
+		index (spatial.spatial_index, optional): a spatial index of the nodes of N2 (see spatial.index_of() and 
+			multiplex.spatial_index()), built for this call if not given. Pass it when searching for many nodes. 
+	
+	Returns:
+		the nearest node of N2 and its distance to n, in kilometers
+	"""
+	if index is None:
+		index = spatial.index_of(N2)
+	nearest, nearest_dist = index.nearest([(N1.node[n]['lon'], N1.node[n]['lat'])])
+	return index.names[nearest[0]], nearest_dist[0]
+
 def del_edge_attribute(N, a):
 	"""
 	Summary: 
@@ -1,19 +1,27 @@
 from metro import multiplex as mx
-from metro import io            # for reading multiplex
 from metro import utility       # for manipulating multiplex
 from metro import analysis      # analytical functions
 from metro import viz           # for bubble_plot()
-from metro import assignment    # for reading and manipulating OD data
 from metro import ita
+from metro import checkpoint
 import networkx as nx           # assigning attributes to multiplex
 import pandas as pd
+import numpy as np
 from copy import deepcopy
 import assign_flows
+import os
+import sys
 
 def od_total(od):
 		return np.sum(np.sum(od[o].values()) for o in od)
 
-def simulate(multi, beta, n):
+def simulate(multi, beta, n, resume = False, overlay = None):
+		targeted_file = '3_throughput/targeted_' + str(beta) + '.csv'
+		uniform_file = '3_throughput/uniform_' + str(beta) + '.csv'
+		if resume and os.path.exists(targeted_file) and os.path.exists(uniform_file):
+				print 'simulation for beta = ' + str(beta) + ' already complete, skipping'
+				return
+
 		con_map = {int(multi.G.node[n]['con_name']) : n for n in multi.G.node if multi.G.node[n]['layer'] == 'taz'}
 		
 		df = pd.read_csv('3_throughput/route_info_' + str(beta) + '.csv')
@@ -31,14 +39,18 @@ def simulate(multi, beta, n):
 		
 
 
-		df = multi.run_ita(n_nodes = None, 
-						   summary = True, # change this to get route tables 
-						   attrname = 'congested_time_m_TEST',
-						   flow_name = 'flow_TEST',
-						   P = [.2, .2, .2, .2, .1, .1],
-						   scale = .25)
-		
-		df.to_csv('3_throughput/targeted_' + str(beta) + '.csv')
+		if not (resume and os.path.exists(targeted_file)):
+				df = multi.run_ita(n_nodes = None, 
+								   summary = True, # change this to get route tables 
+								   attrname = 'congested_time_m_TEST',
+								   flow_name = 'flow_TEST',
+								   P = [.2, .2, .2, .2, .1, .1],
+								   scale = .25, 
+								   checkpoint = '3_throughput/checkpoint_targeted_' + str(beta) + '.npz', 
+								   resume = resume, 
+								   overlay = overlay).details
+				
+				checkpoint.to_csv(df, targeted_file)
 		
 		
 		# Reset the OD
@@ -54,9 +66,12 @@ def simulate(multi, beta, n):
 						   attrname = 'congested_time_m_RAND',
 						   flow_name = 'flow_RAND',
 						   P = [.2, .2, .2, .2, .1, .1],
-						   scale = .25)
+						   scale = .25, 
+						   checkpoint = '3_throughput/checkpoint_uniform_' + str(beta) + '.npz', 
+						   resume = resume, 
+						   overlay = overlay).details
 		
-		df.to_csv('3_throughput/uniform_' + str(beta) + '.csv')
+		checkpoint.to_csv(df, uniform_file)
 		
 		# Reset the OD again, so we can clean up. 
 		multi.od = od
@@ -64,6 +79,10 @@ def simulate(multi, beta, n):
 
 def main():
 
+	# python simulation.py --resume skips betas whose results are complete and 
+	# resumes interrupted assignments from their checkpoints
+	resume = '--resume' in sys.argv
+
 	no_metro_beta = 1000
 	betas = pd.read_csv('plot_betas.csv').beta
 
@@ -116,15 +135,10 @@ def main():
 	# run
 	
 	for beta in betas:
-			m.scale_edge_attribute(layer = 'metro',
-									   attribute = 'free_flow_time_m',
-									   beta = beta)
-			
-			simulate(m, beta = beta, n = 50000)
+			# metro times are scaled by beta on the fly, leaving m unchanged
+			overlay = m.add_overlay('beta_' + str(beta), multipliers = {'free_flow_time_m' : {'metro' : beta}})
 			
-			m.scale_edge_attribute(layer = 'metro',
-									   attribute = 'free_flow_time_m',
-									   beta = 1.0/beta)
+			simulate(m, beta = beta, n = 50000, resume = resume, overlay = overlay)
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,59 @@
+import heapq
+import unittest
+import numpy as np
+import igraph as ig
+from metro import cch
+from metro import csr
+
+def random_graph(rng, n, m, zero = 0.):
+    edges = [tuple(e) for e in rng.randint(0, n, size = (m, 2))]
+    g = ig.Graph(n = n, edges = edges, directed = True)
+    g.es['w'] = [0. if rng.rand() < zero else float(rng.randint(1, 10)) for e in edges]
+    return g
+
+def reference(g, origin):
+    # plain Dijkstra over the igraph edges
+    dist = [np.inf] * g.vcount()
+    dist[origin] = 0.
+    heap = [(0., origin)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > dist[u]:
+            continue
+        for e in g.es.select(_source = u):
+            if d + e['w'] < dist[e.target]:
+                dist[e.target] = d + e['w']
+                heapq.heappush(heap, (dist[e.target], e.target))
+    return np.array(dist)
+
+class test_hierarchy(unittest.TestCase):
+
+    def check(self, g):
+        G = csr.csr_from_igraph(g, 'w', None)
+        H = cch.hierarchy_of(G, None)
+        origins = np.arange(g.vcount())
+        dist, pred = H.trees(origins)
+        for o in origins:
+            np.testing.assert_array_equal(dist[o], reference(g, o))
+
+    def test_zero_weights(self):
+        # ties between zero-cost edges fall back to Dijkstra over the edge weights of G
+        rng = np.random.RandomState(0)
+        for k in range(100):
+            self.check(random_graph(rng, 8, 20, zero = .5))
+
+    def test_positive_weights(self):
+        rng = np.random.RandomState(1)
+        for k in range(100):
+            self.check(random_graph(rng, 10, 15))
+
+    def test_path(self):
+        # contracting a path creates no lower triangles
+        g = ig.Graph(n = 5, edges = [(0, 1), (1, 2), (2, 3), (3, 4)], directed = True)
+        g.es['w'] = [1., 2., 3., 4.]
+        self.check(g)
+        lengths = cch.path_lengths(g, [0, 4], [0, 4], 'w', cache_dir = None)
+        np.testing.assert_array_equal(lengths, [[0., 10.], [np.inf, 0.]])
+
+if __name__ == '__main__':
+    unittest.main()
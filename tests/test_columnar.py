@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from metro import multiplex as mx
+
+def write_multiplex(directory, rng, n_streets = 40, n_taz = 6, n_edges = 160):
+    # a street layer with random, tie-free travel times and a layer of tracts joined to it both ways
+    with open(os.path.join(directory, 'nodes.txt'), 'w') as f:
+        f.write('id\tlayer\ttaz\tlon\n')
+        for i in range(n_streets):
+            f.write('s%d\tstreets\tNone\t%r\n' % (i, rng.rand()))
+        for i in range(n_taz):
+            f.write('t%d\ttaz\t%d\t%r\n' % (i, i, rng.rand()))
+    with open(os.path.join(directory, 'edges.txt'), 'w') as f:
+        f.write('source\ttarget\tlayer\tfree_flow_time_m\tcapacity\n')
+        for i in range(n_streets):
+            f.write('s%d\ts%d\tstreets\t%r\t%r\n' % (i, (i + 1) % n_streets, rng.rand() + .1, 50. + 100 * rng.rand()))
+        for u, v in rng.randint(0, n_streets, size = (n_edges, 2)):
+            if u != v:
+                f.write('s%d\ts%d\tstreets\t%r\t%r\n' % (u, v, rng.rand() + .1, 50. + 100 * rng.rand()))
+        for i in range(n_taz):
+            s = rng.randint(n_streets)
+            f.write('t%d\ts%d\ttaz--streets\t%r\t1000000.0\n' % (i, s, .01 * rng.rand()))
+            f.write('s%d\tt%d\ttaz--streets\t%r\t1000000.0\n' % (s, i, .01 * rng.rand()))
+    with open(os.path.join(directory, 'od.txt'), 'w') as f:
+        f.write('o d flow\n')
+        for o in range(n_taz):
+            for d in range(n_taz):
+                if o != d:
+                    f.write('%d %d %r\n' % (o, d, 100 * rng.rand()))
+
+class test_columnar(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        write_multiplex(self.directory, np.random.RandomState(0))
+        self.forms = []
+        for columnar in (False, True):
+            m = mx.read_multi(os.path.join(self.directory, 'nodes.txt'), os.path.join(self.directory, 'edges.txt'), columnar = columnar)
+            m.read_od(layer = 'taz', key = 'taz', od_file = os.path.join(self.directory, 'od.txt'), sep = ' ')
+            self.forms.append(m)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_graph(self):
+        G, H = self.forms[0].G, self.forms[1].columns().to_graph()
+        self.assertEqual(sorted(G.nodes(data = True)), sorted(H.nodes(data = True)))
+        self.assertEqual(sorted(G.edges(data = True)), sorted(H.edges(data = True)))
+        self.assertEqual(self.forms[0].layers, self.forms[1].layers)
+
+    def test_igraph(self):
+        # the same graph, up to the order of vertices and edges
+        attrs = ['free_flow_time_m', 'capacity', 'layer']
+        graphs = [m.to_igraph(['layer', 'taz'], attrs)[0] for m in self.forms]
+        vertices, edges = [], []
+        for g in graphs:
+            names = g.vs['name']
+            vertices.append(sorted((v['name'], v['layer'], v['taz']) for v in g.vs))
+            edges.append(sorted((names[e.source], names[e.target]) + tuple(e[a] for a in attrs) for e in g.es))
+        self.assertEqual(vertices[0], vertices[1])
+        self.assertEqual(edges[0], edges[1])
+
+    def test_assignment(self):
+        # without ties between equal-cost paths, both forms assign the same flows
+        flows = [m.run_ita(P = [.5, .3, .2]) for m in self.forms]
+        edges = flows[0].edges
+        np.testing.assert_allclose(flows[1].aligned(edges), flows[0].flow)
+        np.testing.assert_allclose(flows[1].aligned(edges, flows[1].congested_time), flows[0].congested_time)
+        self.assertAlmostEqual(flows[0].flow.sum(), flows[1].flow.sum())
+
+if __name__ == '__main__':
+    unittest.main()
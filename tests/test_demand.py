@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from metro import demand
+
+CONNECTORS = {'a' : 1, 'b' : 1, 'c' : 2, 'd' : 3}
+
+def as_dict(od):
+    return {o : dict(od[o].items()) for o in od}
+
+class test_cache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.od_file = os.path.join(self.directory, 'od.txt')
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.write([(1, 2, 4.), (2, 3, 6.), (3, 1, 8.)], 1000000000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, rows, mtime):
+        with open(self.od_file, 'w') as f:
+            f.write('o d flow\n')
+            for o, d, flow in rows:
+                f.write('%d %d %.1f\n' % (o, d, flow))
+        os.utime(self.od_file, (mtime, mtime))
+
+    def read(self, connectors = CONNECTORS):
+        return demand.read_od(self.od_file, connectors, cache_dir = self.cache_dir)
+
+    def entries(self):
+        return sorted(set(f.split('.npy')[0].rsplit('.', 1)[0] for f in os.listdir(self.cache_dir)))
+
+    def test_cached_equals_fresh(self):
+        fresh = demand.read_od(self.od_file, CONNECTORS, cache = False)
+        first, second = self.read(), self.read()
+        self.assertEqual(len(self.entries()), 1)
+        self.assertEqual(as_dict(first), as_dict(fresh))
+        self.assertEqual(as_dict(second), as_dict(fresh))
+        self.assertEqual(as_dict(second), {'a' : {'c' : 2.}, 'b' : {'c' : 2.}, 'c' : {'d' : 6.}, 'd' : {'a' : 4., 'b' : 4.}})
+
+    def test_changed_mtime(self):
+        self.read()
+        old = self.entries()
+        # same size, new flows and modification time
+        self.write([(1, 2, 5.), (2, 3, 6.), (3, 1, 8.)], 1000000100)
+        self.assertEqual(self.read()['a']['c'], 2.5)
+        self.assertEqual(len(self.entries()), 1)
+        self.assertNotEqual(self.entries(), old)
+
+    def test_changed_size(self):
+        self.read()
+        self.write([(1, 2, 4.), (2, 3, 6.), (3, 1, 8.), (3, 2, 1.)], 1000000000)
+        self.assertEqual(self.read()['d']['c'], 1.)
+        self.assertEqual(len(self.entries()), 1)
+
+    def test_connectors(self):
+        # another connector set gets its own entry, and both stay usable
+        other = {'a' : 1, 'c' : 2, 'd' : 3}
+        self.read()
+        self.assertEqual(as_dict(self.read(other)), {'a' : {'c' : 4.}, 'c' : {'d' : 6.}, 'd' : {'a' : 8.}})
+        self.assertEqual(len(self.entries()), 2)
+        self.assertEqual(as_dict(self.read()), as_dict(demand.read_od(self.od_file, CONNECTORS, cache = False)))
+        self.assertEqual(len(self.entries()), 2)
+
+if __name__ == '__main__':
+    unittest.main()
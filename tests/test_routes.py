@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from metro import routes
+
+# two blocks of routes, as two increments would append them; the third route is empty
+BLOCKS = [dict(o = [0, 0, 1], d = [2, 3, 1], p = .4, flow = [10., 20., 5.], paths = [[0, 2, 5], [0, 3], []]),
+          dict(o = [2], d = [0], p = .6, flow = [7.], paths = [[4, 1, 1]])]
+
+def append(store, block):
+    store.append(o = block['o'],
+                 d = block['d'],
+                 p = block['p'],
+                 flow = block['flow'],
+                 lengths = [len(path) for path in block['paths']],
+                 edges = np.array(sum(block['paths'], []), dtype = np.int32))
+
+def paths(table):
+    return [table['edges'][s:e].tolist() for s, e in zip(table['starts'], table['ends'])]
+
+class test_route_store(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = routes.route_store(os.path.join(self.directory, 'routes'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for block in BLOCKS:
+            append(self.store, block)
+        self.assertEqual(self.store.size(), (4, 8))
+        for mmap in (True, False):
+            table = self.store.load(mmap = mmap)
+            self.assertEqual(table['o'].tolist(), [0, 0, 1, 2])
+            self.assertEqual(table['d'].tolist(), [2, 3, 1, 0])
+            self.assertEqual(table['p'].tolist(), [.4, .4, .4, .6])
+            self.assertEqual(table['flow'].tolist(), [10., 20., 5., 7.])
+            self.assertEqual(paths(table), BLOCKS[0]['paths'] + BLOCKS[1]['paths'])
+
+    def test_empty(self):
+        table = self.store.load()
+        self.assertEqual(self.store.size(), (0, 0))
+        for col in ['o', 'd', 'p', 'flow', 'ends', 'edges', 'starts']:
+            self.assertEqual(len(table[col]), 0)
+        self.assertEqual(table['starts'].dtype, np.int64)
+        self.assertEqual(routes.incidence_matrix(table, 6).shape, (0, 6))
+        self.assertEqual(routes.route_metrics(table, np.ones((6, 2))).shape, (0, 2))
+
+    def test_truncate(self):
+        append(self.store, BLOCKS[0])
+        size = self.store.size()
+        append(self.store, BLOCKS[1])
+        self.store.truncate(*size)
+        self.assertEqual(self.store.size(), size)
+        self.assertEqual(paths(self.store.load()), BLOCKS[0]['paths'])
+
+        # routes appended after a truncation follow on from the kept ones
+        append(self.store, BLOCKS[1])
+        self.assertEqual(paths(self.store.load()), BLOCKS[0]['paths'] + BLOCKS[1]['paths'])
+
+    def test_replace(self):
+        for block in BLOCKS:
+            append(self.store, block)
+        self.store.replace('flow', [1., 2., 3., 4.])
+        table = self.store.load()
+        self.assertEqual(table['flow'].tolist(), [1., 2., 3., 4.])
+        self.assertEqual(paths(table), BLOCKS[0]['paths'] + BLOCKS[1]['paths'])
+
+    def test_remove(self):
+        append(self.store, BLOCKS[0])
+        self.store.remove()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self.store.size(), (0, 0))
+
+class test_route_metrics(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        store = routes.route_store(os.path.join(self.directory, 'routes'))
+        for block in BLOCKS:
+            append(store, block)
+        self.table = store.load()
+        self.paths = BLOCKS[0]['paths'] + BLOCKS[1]['paths']
+        self.X = np.array([[1., 0.], [2., 1.], [4., 0.], [8., 1.], [16., 0.], [32., 1.]])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sums(self):
+        # each route's sums, added up edge by edge along its path
+        expected = np.array([[sum(self.X[e, k] for e in path) for k in range(2)] for path in self.paths])
+        for chunk_size in (1, 3, 2 ** 20):
+            np.testing.assert_array_equal(routes.route_metrics(self.table, self.X, chunk_size), expected)
+        np.testing.assert_array_equal(routes.route_metrics(self.table, self.X[:, 0]), expected[:, 0])
+        self.assertEqual(expected[:, 0].tolist(), [37., 9., 0., 20.])
+
+    def test_incidence_matrix(self):
+        weights = np.array([.5, 2.])
+        M = routes.incidence_matrix(self.table, 6, weights, lo = 2, hi = 4).toarray()
+        self.assertEqual(M.tolist(), [[0.] * 6, [0., 4., 0., 0., 2., 0.]])
+
+if __name__ == '__main__':
+    unittest.main()